@@ -1,6 +1,6 @@
 import argparse
-from phdf.main import launcher_json_string, launcher_fileio
-from phdf import utils
+from phdf.main import launcher
+from phdf import batch, server, utils, watch
 
 APP_NAME = "phdf"
 log = utils.setup_logger(APP_NAME)  # type: ignore
@@ -16,10 +16,13 @@ def main_fn():
     )
     parser.add_argument(
         "data_input",
-        help="Accepts 'filepath' |or| 'dataString' in JSON format",
+        nargs="?",
+        help="Accepts 'filepath' |or| 'dataString' in JSON format |or| '-' to read stdin"
+        " |or| 'shm://name' of a shared memory segment",
     )
     parser.add_argument(
         "output_dir",
+        nargs="?",
         help="Output directory",
     )
     parser.add_argument(
@@ -34,33 +37,252 @@ def main_fn():
         action="store_true",
         help="Measures time taken for the python process calls",
     )
+    parser.add_argument(
+        "-lo",
+        "--layout",
+        choices=utils.LAYOUTS,
+        default="tables",
+        help="HDF5 layout: one node per table, or one stacked (table, row, col) dataset",
+    )
+
+    parser.add_argument(
+        "-cp",
+        "--complevel",
+        type=int,
+        default=3,
+        help="HDF5 compression level, 0-9",
+    )
+    parser.add_argument(
+        "--codec",
+        choices=utils.CODECS,
+        default="zlib",
+        help="HDF5 compression codec",
+    )
+    parser.add_argument(
+        "--shuffle",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Byte-shuffle filter before compression",
+    )
+    parser.add_argument(
+        "--metrics",
+        metavar="PATH",
+        help="Appends per-stage time, throughput and peak memory as a JSON line"
+        " to this file, '-' for stderr",
+    )
+    parser.add_argument(
+        "--max_memory",
+        metavar="MB",
+        type=float,
+        help="Parses file and stdin inputs in chunks to stay near this memory ceiling",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Merges into an existing output, rewriting only the tables that changed;"
+        " an interrupted conversion resumes when run again",
+    )
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="Writes tables in a background thread as soon as they are complete,"
+        " while the rest of the input is parsed",
+    )
+    parser.add_argument(
+        "--precision",
+        metavar="SPEC",
+        help="Value storage precision, a default and channel=precision overrides,"
+        f" e.g. 'float32,aTB_*=int16q'; one of {', '.join(utils.PRECISIONS)}",
+    )
+    parser.add_argument(
+        "--sparse",
+        metavar="DENSITY",
+        type=float,
+        help="Stores tables with fewer than this fraction of pixels holding a value"
+        " as coordinate lists (row, col, value), e.g. 0.3",
+    )
+    parser.add_argument(
+        "--tune_compression",
+        action="store_true",
+        help="Benchmarks the codecs on data_input (write/read time, file size), then exits",
+    )
+    parser.add_argument(
+        "--benchmark",
+        action="store_true",
+        help="Times every conversion stage on generated inputs, data_input being"
+        " comma separated sizes (small, medium, large, optionally as size:format),"
+        " 'all' or input files,"
+        " saves a .csv to output_dir, then exits",
+    )
+    parser.add_argument(
+        "--serve",
+        metavar="SOCKET",
+        help="Runs as a persistent worker, listening on this Unix domain socket",
+    )
+    parser.add_argument(
+        "--connect",
+        metavar="SOCKET",
+        help="Sends the conversion to the worker listening on this socket",
+    )
+
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="Treats data_input as a directory, a glob or '@filelist' of input files",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of worker processes for --batch, --watch and --compact,"
+        " or for parsing a single file",
+    )
+    parser.add_argument(
+        "--merge",
+        metavar="NAME.h5",
+        help="With --batch, writes all results into this one file in output_dir",
+    )
+    parser.add_argument(
+        "--compact",
+        metavar="NAME.h5",
+        help="Merges the PHDF outputs in data_input (a directory, a glob or '@filelist')"
+        " into this one recompressed file in output_dir",
+    )
+    parser.add_argument(
+        "--on_duplicate",
+        choices=("last", "first", "error"),
+        default="last",
+        help="With --compact, which copy of a table found in several files is kept,"
+        " in file name order",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Treats data_input as a directory and converts new .txt, .csv and .phdb"
+        " files as they complete",
+    )
+    parser.add_argument(
+        "--queue_size",
+        type=int,
+        default=8,
+        help="With --watch, completed files queued on top of the --jobs being converted;"
+        " with --pipeline, tables queued for the writer thread",
+    )
+    parser.add_argument(
+        "--idle_timeout",
+        type=float,
+        help="With --watch, stops after this many seconds without new files",
+    )
+    parser.add_argument(
+        "--startup_report",
+        action="store_true",
+        help="Reports the slowest imports of startup and conversion, then exits",
+    )
 
     args = parser.parse_args()
 
-    if len(args.data_input) > 256:
-        launcher_json_string(
+    if args.startup_report:
+        utils.log_startup_report()
+        return 0
+
+    if args.serve:
+        return server.serve(args.serve)
+
+    if args.data_input is None or args.output_dir is None:
+        parser.error("the following arguments are required: data_input, output_dir")
+
+    if not 0 <= args.complevel <= 9:
+        parser.error("--complevel takes a level in 0-9")
+    compression = utils.Compression(args.codec, args.complevel, args.shuffle)
+    options = dict(
+        skip_cleanup=args.skip_cleanup,
+        measure_timing=args.measure_timing,
+        layout=args.layout,
+        compression=compression,
+        max_memory_mb=args.max_memory,
+        metrics_path=args.metrics,
+        incremental=args.incremental,
+    )
+    if args.precision:
+        try:
+            precision = utils.Precision.from_spec(args.precision)
+        except ValueError as e:
+            parser.error(f"--precision: {e}")
+        if args.layout == "stacked" and precision.channels:
+            parser.error("--layout stacked takes a single --precision, no overrides")
+        options["precision"] = precision
+    if args.sparse is not None:
+        if not 0 < args.sparse <= 1:
+            parser.error("--sparse takes a density in (0, 1]")
+        if args.layout != "tables":
+            parser.error("--sparse only supports --layout tables")
+        options["sparse_density"] = args.sparse
+    if args.incremental and args.layout != "tables":
+        parser.error("--incremental only supports --layout tables")
+    if args.pipeline:
+        if args.layout != "tables" or args.incremental:
+            parser.error(
+                "--pipeline only supports --layout tables, without --incremental"
+            )
+        options.update(pipeline=True, pipeline_queue_size=args.queue_size)
+
+    if args.tune_compression:
+        from phdf import benchmark
+
+        benchmark.tune_compression(args.data_input, args.output_dir, layout=args.layout)
+        return 0
+
+    if args.benchmark:
+        from phdf import benchmark
+
+        sizes = None if args.data_input == "all" else args.data_input.split(",")
+        benchmark.run_benchmark_suite(args.output_dir, sizes, layout=args.layout)
+        return 0
+
+    if args.compact:
+        from phdf import compact
+
+        return compact.run_compaction(
             args.data_input,
             args.output_dir,
-            measure_timing=args.measure_timing,
+            args.compact,
+            jobs=args.jobs,
+            on_duplicate=args.on_duplicate,
+            compression=compression,
+            precision=options.get("precision"),
+            sparse_density=options.get("sparse_density"),
         )
 
-    elif (".txt" == args.data_input[-4:]) or (".TXT" == args.data_input[-4:]):
-        launcher_fileio(
+    if args.watch:
+        watcher = watch.DirectoryWatcher(
             args.data_input,
             args.output_dir,
-            skip_cleanup=args.skip_cleanup,
-            measure_timing=args.measure_timing,
+            jobs=args.jobs,
+            queue_size=args.queue_size,
+            **options,
         )
+        return watcher.run(idle_timeout=args.idle_timeout)
 
-    else:
-        launcher_json_string(
+    if args.batch:
+        if args.merge and args.layout != "tables":
+            parser.error("--merge only supports --layout tables")
+        if args.merge and args.incremental:
+            parser.error("--merge writes a new file, it does not support --incremental")
+        return batch.run_batch(
             args.data_input,
             args.output_dir,
-            measure_timing=args.measure_timing,
+            jobs=args.jobs,
+            merge=args.merge,
+            **options,
         )
 
-    return 0
+    options["parse_jobs"] = args.jobs  # single input, workers split the file
+    if args.connect:
+        return server.client(args.connect, args.data_input, args.output_dir, **options)
+
+    return launcher(args.data_input, args.output_dir, **options)
 
 
 if __name__ == "__main__":
-    main_fn()
+    raise SystemExit(main_fn())
@@ -0,0 +1 @@
+# Places the repository root on sys.path so tests can import the phdf package
@@ -0,0 +1,194 @@
+import glob
+import os
+import time
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ProcessPoolExecutor,
+    as_completed,
+    wait,
+)
+from pathlib import Path
+from typing import Any, NamedTuple, Optional
+
+from phdf import main, utils
+
+log = utils.setup_logger()
+
+
+class BatchResult(NamedTuple):
+    input_file: Path
+    ok: bool
+    elapsed: float
+    error: str = ""
+    tables: Optional[list] = None  # only when merging, list[models.Table]
+    summary: Any = None  # only when merging, pd.DataFrame
+
+
+def collect_inputs(
+    source: str, suffixes: tuple[str, ...] = main.INPUT_SUFFIXES
+) -> list[Path]:
+    """Expands a batch source into the input files, sorted by name
+
+    :param source: a directory (all files with one of suffixes in it), a glob
+        pattern, a single file, or '@filelist' with one path per line; a
+        leading ~ is expanded, also for quoted patterns the shell left alone
+    :type source: str
+    :param suffixes: file suffixes taken from a directory, defaults to
+        main.INPUT_SUFFIXES (.txt, .csv and .phdb)
+    :type suffixes: tuple[str, ...], optional
+    :return: input files
+    :rtype: list[Path]
+    """
+    if source.startswith("@"):
+        lines = Path(source[1:]).expanduser().read_text().splitlines()
+        return [Path(x.strip()).expanduser() for x in lines if x.strip()]
+    source = os.path.expanduser(source)
+    path = Path(source)
+    if path.is_dir():
+        return sorted(x for x in path.iterdir() if x.suffix.lower() in suffixes)
+    if path.is_file():
+        return [path]
+    return sorted(Path(x) for x in glob.glob(source))
+
+
+def convert_file(
+    input_file: Path, output_dir: str, merge: bool = False, **options
+) -> BatchResult:
+    """Runs the DevicePixelArray pipeline on one file, in a worker process"""
+    start_time = time.perf_counter()
+    tables = summary = None
+    try:
+        if merge:
+            models = main.import_models()
+            dpx = models.DevicePixelArray(
+                inp=input_file,
+                output_folder=output_dir,
+                compression=options.get("compression"),
+                max_memory_mb=options.get("max_memory_mb"),
+                precision=options.get("precision"),
+                sparse_density=options.get("sparse_density"),
+            )
+            dpx.run()
+            tables, summary = dpx.tables, dpx.summary
+            exit_code = 0 if tables else 1
+        else:
+            exit_code = main.launcher_fileio(str(input_file), output_dir, **options)
+    except Exception as e:
+        return BatchResult(input_file, False, time.perf_counter() - start_time, f"{e=}")
+    elapsed = time.perf_counter() - start_time
+    if exit_code:
+        return BatchResult(input_file, False, elapsed, f"{exit_code=}")
+    return BatchResult(input_file, True, elapsed, "", tables, summary)
+
+
+def run_batch(
+    source: str,
+    output_dir: str,
+    jobs: int = 1,
+    merge: Optional[str] = None,
+    **options: Any,
+) -> int:
+    """Converts many input files in parallel across worker processes
+
+    With merge, workers only parse and pivot; the tables of every file are
+    written by this process, as '<file stem>/<table name>', into one file.
+
+    :param source: see collect_inputs()
+    :type source: str
+    :param output_dir: output directory
+    :type output_dir: str
+    :param jobs: number of worker processes, defaults to 1
+    :type jobs: int, optional
+    :param merge: output file name to merge all results into, defaults to None
+    :type merge: str, optional
+    :return: exit code, 1 if any file failed
+    :rtype: int
+    """
+    input_files = collect_inputs(source)
+    if not input_files:
+        log.error(f"no input files found for {source=}")
+        return 1
+    log.info(f"batch of {len(input_files)} files, {jobs=}")
+
+    writer = None
+    if merge:
+        import pandas as pd
+
+        from phdf import writers
+
+        writer = writers.HdfWriter(
+            Path(output_dir) / merge,
+            compression=options.get("compression"),
+            precision_schema=options.get("precision"),
+            sparse_density=options.get("sparse_density"),
+        )
+        writer.open()
+
+    start_time = time.perf_counter()
+    n_failed = 0
+    summaries = []
+    try:
+        for i, result in enumerate(
+            iter_results(input_files, output_dir, jobs, bool(merge), options), 1
+        ):
+            if result.ok:
+                log.info(
+                    f"[{i}/{len(input_files)}] ok {result.input_file.name}"
+                    f" ({result.elapsed:.4f}s)"
+                )
+            else:
+                n_failed += 1
+                log.error(
+                    f"[{i}/{len(input_files)}] failed {result.input_file.name}:"
+                    f" {result.error}"
+                )
+            if writer is not None and result.tables:
+                stem = result.input_file.stem
+                for table in result.tables:
+                    writer.write(f"{stem}/{table.name}", table.df)
+                log.info(f"appended({stem}) to {merge}")
+                if result.summary is not None:
+                    summaries.append(result.summary.rename(index=f"{stem}/{{}}".format))
+        if summaries:
+            writer.write_summary(pd.concat(summaries))
+    except BaseException:  # incl. KeyboardInterrupt
+        if writer is not None:
+            writer.close(commit=False)  # never replace merge with a partial lot
+        raise
+    if writer is not None:
+        writer.close()
+
+    elapsed_time = time.perf_counter() - start_time
+    log.info(
+        f"batch completed: {len(input_files) - n_failed} ok, {n_failed} failed"
+        f" in {elapsed_time:.4f}s"
+    )
+    return 1 if n_failed else 0
+
+
+def iter_results(
+    input_files: list[Path],
+    output_dir: str,
+    jobs: int,
+    merge: bool,
+    options: dict[str, Any],
+):
+    if jobs <= 1:
+        for input_file in input_files:
+            yield convert_file(input_file, output_dir, merge, **options)
+        return
+    # at most 2 * jobs files in flight, results dropped once consumed: with
+    # merge, every result holds the tables of a whole file
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        pending: set[Future] = set()
+        for input_file in input_files:
+            pending.add(
+                executor.submit(convert_file, input_file, output_dir, merge, **options)
+            )
+            if len(pending) >= 2 * jobs:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        for future in as_completed(pending):
+            yield future.result()
@@ -0,0 +1,231 @@
+import tempfile
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from phdf import main, parsers, utils, views, writers
+
+log = utils.setup_logger()
+
+TUNING_LEVELS = (1, 3, 5, 9)
+
+# views.generate_testfilewriter_file() arguments per benchmark size
+BENCHMARK_SIZES = {
+    "small": dict(n_parts=1, n_sites=2, n_channels=10, n_rows=40, n_cols=64),
+    "medium": dict(
+        n_parts=4, n_sites=4, n_channels=10, n_rows=64, n_cols=64, missing=0.05
+    ),
+    "large": dict(
+        n_parts=4, n_sites=4, n_channels=20, n_rows=128, n_cols=128, missing=0.1
+    ),
+}
+STAGES = ("read", "parse", "frame", "process", "pivot", "write")
+
+
+def compression_candidates() -> list[utils.Compression]:
+    candidates = [utils.Compression("none", 0, False)]
+    for codec in utils.CODECS:
+        if codec == "none":
+            continue
+        for level in TUNING_LEVELS:
+            for shuffle in (True, False):
+                candidates.append(utils.Compression(codec, level, shuffle))
+    return candidates
+
+
+def tune_compression(
+    data_input: str,
+    output_dir: str,
+    layout: str = "tables",
+    repeats: int = 3,
+) -> pd.DataFrame:
+    """Writes and reads data_input with every codec/level/shuffle candidate
+
+    data_input is parsed and pivoted once; only the HDF5 write and read are
+    timed, best of `repeats`, on a temporary file inside output_dir so the
+    target disk is measured.
+
+    :param data_input: 'filepath' |or| 'dataString' in JSON format
+    :type data_input: str
+    :param output_dir: directory on the disk to benchmark
+    :type output_dir: str
+    :param layout: "tables" or "stacked", defaults to "tables"
+    :type layout: str, optional
+    :param repeats: timing repeats per candidate, defaults to 3
+    :type repeats: int, optional
+    :return: one row per candidate, sorted by write time
+    :rtype: pd.DataFrame
+    """
+    models = main.import_models()
+    inp = Path(data_input) if main.is_input_file(data_input) else data_input
+    dpx = models.DevicePixelArray(inp=inp, output_folder=output_dir)
+    dpx.run()
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+
+    results = []
+    with tempfile.TemporaryDirectory(dir=output_dir) as tmpdir:
+        outpath = Path(tmpdir) / "tune.h5"
+        for compression in compression_candidates():
+            write_times, read_times = [], []
+            for _ in range(repeats):
+                outpath.unlink(missing_ok=True)
+                start_time = time.perf_counter()
+                with writers.HdfWriter(
+                    outpath, compression=compression, layout=layout
+                ) as writer:
+                    if layout == "stacked":
+                        writer.write_stack(*dpx.stack)
+                    else:
+                        for table in dpx.tables:
+                            writer.write(table.name, table.df)
+                write_times.append(time.perf_counter() - start_time)
+
+                start_time = time.perf_counter()
+                read_all_tables(outpath, layout)
+                read_times.append(time.perf_counter() - start_time)
+
+            results.append(
+                dict(
+                    codec=compression.codec,
+                    level=compression.complevel,
+                    shuffle=compression.shuffle,
+                    write_s=min(write_times),
+                    read_s=min(read_times),
+                    size_kb=outpath.stat().st_size / 1024,
+                )
+            )
+
+    df = pd.DataFrame(results).sort_values("write_s", ignore_index=True)
+    log.info(f"compression tuning on {dpx.outpath.stem} ({layout=}):")
+    for line in df.to_string(float_format=lambda x: f"{x:.4f}").splitlines():
+        log.info(line)
+    fastest = df.iloc[0]
+    smallest = df.loc[df["size_kb"].idxmin()]
+    log.info(
+        f"fastest write: --codec {fastest['codec']} -cp {fastest['level']}"
+        f" ({'--shuffle' if fastest['shuffle'] else '--no-shuffle'})"
+    )
+    log.info(
+        f"smallest file: --codec {smallest['codec']} -cp {smallest['level']}"
+        f" ({'--shuffle' if smallest['shuffle'] else '--no-shuffle'})"
+    )
+    return df
+
+
+def read_all_tables(filepath: Path, layout: str = "tables") -> int:
+    if layout == "stacked":
+        return len(views.read_stacked_hdf5_file(filepath))
+    with views.PixelMapReader(filepath, cache_mb=0) as reader:
+        return len([df for _, df in reader.iter_tables(reader.names)])
+
+
+def time_stages(
+    input_file: str | Path, output_dir: str | Path, layout: str = "tables"
+) -> dict[str, float]:
+    """Runs the DevicePixelArray pipeline on input_file, timing every stage
+
+    read: input file into memory, parse: scan into ColumnarRecords, frame: hand
+    over to pandas, process: table names and coord decoding, pivot: pixel
+    maps per table, write: HDF5 output into output_dir.
+
+    :param input_file: testfilewriter input file
+    :type input_file: str | Path
+    :param output_dir: directory for the HDF5 output
+    :type output_dir: str | Path
+    :param layout: "tables" or "stacked", defaults to "tables"
+    :type layout: str, optional
+    :return: seconds per stage, in STAGES order
+    :rtype: dict[str, float]
+    """
+    models = main.import_models()
+    compression = utils.Compression()
+    outpath = Path(output_dir) / utils.get_output_name(
+        Path(input_file).stem, compression
+    )
+    outpath.unlink(missing_ok=True)
+
+    timer = utils.StageTimer()
+    data = Path(input_file).read_bytes()
+    timer.lap("read")
+    view, size = memoryview(data), parsers.READ_CHUNK_SIZE
+    records = parsers.scan_chunks(view[i : i + size] for i in range(0, len(data), size))
+    timer.lap("parse")
+    del view, data
+    df = records.to_frame()
+    timer.lap("frame")
+    df["table_name"] = models.table_keys(df)
+    df["row"], df["col"] = models.decode_coords(df["coord"])
+    df = df[df["row"] >= 0]
+    timer.lap("process")
+    stack = models.pivot_stack(df)
+    tables = stack.to_tables()
+    timer.lap("pivot")
+    with writers.HdfWriter(outpath, compression=compression, layout=layout) as writer:
+        if layout == "stacked":
+            writer.write_stack(*stack)
+        else:
+            for table in tables:
+                writer.write(table.name, table.df)
+    timer.lap("write")
+    return timer.laps
+
+
+def run_benchmark_suite(
+    output_dir: str | Path,
+    sizes: list[str] | None = None,
+    repeats: int = 3,
+    layout: str = "tables",
+) -> pd.DataFrame:
+    """Times every stage on generated inputs of each size, saves a .csv
+
+    Inputs are generated with a fixed seed into a temporary directory inside
+    output_dir; every stage is reported as the best of `repeats`. A size may
+    name the input format as "size:format" (see parsers.FORMATS), or be a
+    filepath, which is benchmarked as is.
+
+    :param output_dir: directory for the inputs, outputs and results
+    :type output_dir: str | Path
+    :param sizes: BENCHMARK_SIZES keys or filepaths, defaults to None (all)
+    :type sizes: list[str], optional
+    :param repeats: timing repeats per size, defaults to 3
+    :type repeats: int, optional
+    :param layout: "tables" or "stacked", defaults to "tables"
+    :type layout: str, optional
+    :return: one row per size, seconds per stage
+    :rtype: pd.DataFrame
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    results = []
+    with tempfile.TemporaryDirectory(dir=output_dir) as tmpdir:
+        for size in sizes or list(BENCHMARK_SIZES):
+            name, _, fmt = size.partition(":")
+            if name in BENCHMARK_SIZES:
+                input_file = views.generate_testfilewriter_file(
+                    Path(tmpdir) / f"benchmark-{name}-{fmt or 'json'}.txt",
+                    seed=0,
+                    fmt=fmt or "json",
+                    **BENCHMARK_SIZES[name],
+                )
+            else:
+                input_file = Path(size)
+            laps = [time_stages(input_file, tmpdir, layout) for _ in range(repeats)]
+            best = {k: min(x[k] for x in laps) for k in STAGES}
+            results.append(
+                dict(
+                    size=size,
+                    input_mb=input_file.stat().st_size / 2**20,
+                    **best,
+                    total=sum(best.values()),
+                )
+            )
+            log.info(f"benchmarked {size} ({results[-1]['total']:.4f}s)")
+
+    df = pd.DataFrame(results)
+    outpath = output_dir / f"benchmark-{utils.get_time()}.csv"
+    df.to_csv(outpath, index=False)
+    log.info(f"stage timings ({layout=}, best of {repeats}), saved to {outpath}:")
+    for line in df.to_string(float_format=lambda x: f"{x:.4f}").splitlines():
+        log.info(line)
+    return df
@@ -0,0 +1,209 @@
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterator, NamedTuple, Optional
+
+import pandas as pd
+
+from phdf import batch, models, utils, views, writers
+
+log = utils.setup_logger()
+
+DUPLICATE_POLICIES = ("last", "first", "error")
+
+
+class CompactionPlan(NamedTuple):
+    parts: dict[Path, list[str]]  # tables to copy from each input, in input order
+    duplicates: int
+    failed: list[Path]
+
+
+class CompactedPart(NamedTuple):
+    input_file: Path
+    tables: list[models.Table]
+    summary: Optional[pd.DataFrame] = None
+    error: str = ""
+
+
+def plan_compaction(
+    input_files: list[Path], on_duplicate: str = "last"
+) -> CompactionPlan:
+    """Decides which input holds the kept copy of every table
+
+    Only the table names are read, from the HDF5 metadata of each input.
+
+    :param input_files: PHDF outputs, in priority order (e.g. sorted by name,
+        so nil-<timestamp> outputs are in time order)
+    :type input_files: list[Path]
+    :param on_duplicate: table in several inputs: "last" keeps the copy from
+        the latest input, "first" the earliest, "error" raises, defaults to "last"
+    :type on_duplicate: str, optional
+    :raises ValueError: on a duplicate table with on_duplicate="error"
+    :return: tables to copy per input, duplicates resolved, unreadable inputs
+    :rtype: CompactionPlan
+    """
+    if on_duplicate not in DUPLICATE_POLICIES:
+        raise NotImplementedError(f"{on_duplicate=}")
+    owners: dict[str, Path] = {}
+    duplicates = 0
+    failed = []
+    for input_file in input_files:
+        try:
+            with views.PixelMapReader(input_file, cache_mb=0) as reader:
+                names = reader.names
+        except Exception as e:
+            log.error(f"cannot read {input_file.name}: {e=}")
+            failed.append(input_file)
+            continue
+        for name in names:
+            if name in owners:
+                duplicates += 1
+                match on_duplicate:
+                    case "first":
+                        continue
+                    case "error":
+                        raise ValueError(
+                            f"{name} is in {owners[name].name} and {input_file.name}"
+                        )
+            owners[name] = input_file
+    parts: dict[Path, list[str]] = {x: [] for x in input_files if x not in failed}
+    for name, input_file in owners.items():
+        parts[input_file].append(name)
+    return CompactionPlan(parts, duplicates, failed)
+
+
+def read_part(input_file: Path, names: list[str]) -> CompactedPart:
+    """Reads the planned tables of one input, and their summary rows
+
+    Summary rows are taken from the input's summary index when it has them,
+    computed from the tables otherwise (e.g. outputs written before v1.2.0).
+    """
+    try:
+        with views.PixelMapReader(input_file, cache_mb=0) as reader:
+            tables = [models.Table(name, reader.read(name)) for name in names]
+            try:
+                summary = reader.summary()
+            except KeyError:
+                summary = None
+    except Exception as e:
+        return CompactedPart(input_file, [], error=f"{e=}")
+    frames = []
+    known = set()
+    if summary is not None:
+        known = set(summary.index.intersection(names))
+        frames.append(summary.loc[summary.index.isin(known)])
+    missing = [t for t in tables if t.name not in known]
+    if missing:
+        frames.append(models.summarize_tables(missing))
+    summary = pd.concat(frames).reindex(names)
+    if "source" not in summary.columns:
+        summary["source"] = input_file.name
+    summary["source"] = summary["source"].fillna(input_file.name)
+    return CompactedPart(input_file, tables, summary)
+
+
+def iter_parts(plan: CompactionPlan, jobs: int) -> Iterator[CompactedPart]:
+    """Reads the inputs in plan order, at most 2 * jobs parts in memory"""
+    items = [(k, v) for k, v in plan.parts.items() if v]
+    if jobs <= 1:
+        for input_file, names in items:
+            yield read_part(input_file, names)
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        pending: deque[Future] = deque()
+        for input_file, names in items:
+            pending.append(executor.submit(read_part, input_file, names))
+            if len(pending) >= 2 * jobs:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def run_compaction(
+    source: str,
+    output_dir: str,
+    name: str,
+    jobs: int = 1,
+    on_duplicate: str = "last",
+    compression: Optional[utils.Compression] = None,
+    precision: Optional[utils.Precision] = None,
+    sparse_density: Optional[float] = None,
+) -> int:
+    """Merges many PHDF outputs of a lot into one recompressed file
+
+    Tables are streamed file by file into output_dir/name, under their own
+    names, with the combined summary index of all kept tables (and their
+    source file) at /_phdf/summary. Inputs of either layout are accepted, the
+    output has layout="tables". The output only appears once complete.
+
+    :param source: a directory (all .h5 files in it), a glob pattern or
+        '@filelist' of PHDF outputs, see batch.collect_inputs()
+    :type source: str
+    :param output_dir: output directory
+    :type output_dir: str
+    :param name: output file name, must not exist yet
+    :type name: str
+    :param jobs: worker processes reading the inputs, defaults to 1
+    :type jobs: int, optional
+    :param on_duplicate: see plan_compaction(), defaults to "last"
+    :type on_duplicate: str, optional
+    :param compression: defaults to None (zlib, level 3)
+    :type compression: utils.Compression, optional
+    :param precision: value storage schema of the output, defaults to None
+        (as read: float32, quantized inputs decoded)
+    :type precision: utils.Precision, optional
+    :param sparse_density: stores the tables with a lower fraction of pixels
+        holding a value as coordinate lists, defaults to None (all dense)
+    :type sparse_density: float, optional
+    :return: exit code, 1 if any input could not be read
+    :rtype: int
+    """
+    outpath = Path(output_dir) / name
+    if outpath.exists():
+        log.error(f"{outpath} already exists, compact it with the new files instead")
+        return 1
+    input_files = [x for x in batch.collect_inputs(source, (".h5",)) if x != outpath]
+    if not input_files:
+        log.error(f"no PHDF outputs found for {source=}")
+        return 1
+    start_time = time.perf_counter()
+    try:
+        plan = plan_compaction(input_files, on_duplicate)
+    except ValueError as e:
+        log.error(f"{e}, see --on_duplicate")
+        return 1
+    n_tables = sum(len(x) for x in plan.parts.values())
+    log.info(
+        f"compacting {n_tables} tables of {len(input_files)} files into {name},"
+        f" {plan.duplicates} duplicates resolved ({on_duplicate=}), {jobs=}"
+    )
+
+    failed = list(plan.failed)
+    summaries = []
+    with writers.HdfWriter(
+        outpath,
+        compression=compression,
+        precision_schema=precision,
+        sparse_density=sparse_density,
+    ) as writer:
+        for i, part in enumerate(iter_parts(plan, jobs), 1):
+            if part.error:
+                log.error(f"failed {part.input_file.name}: {part.error}")
+                failed.append(part.input_file)
+                continue
+            for table in part.tables:
+                writer.write(table.name, table.df)
+            summaries.append(part.summary)
+            log.info(f"[{i}] appended({part.input_file.name}) to {name}")
+        if summaries:
+            writer.write_summary(pd.concat(summaries))
+
+    input_bytes = sum(x.stat().st_size for x in input_files)
+    log.info(
+        f"compaction completed: {len(input_files) - len(failed)} ok,"
+        f" {len(failed)} failed, {input_bytes / 2**20:.1f} MB ->"
+        f" {outpath.stat().st_size / 2**20:.1f} MB"
+        f" in {time.perf_counter() - start_time:.4f}s"
+    )
+    return 1 if failed else 0
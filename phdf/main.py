@@ -1,25 +1,153 @@
+import sys
 import time
 from pathlib import Path
+from typing import Any, BinaryIO, Optional
 
-from phdf import models
-from phdf.utils import setup_logger
+from phdf.utils import SEGMENT_SUFFIX, SHM_PREFIX, Metrics, setup_logger
 
 log = setup_logger()
 
+# kept free of pandas/numpy/tables, which are only imported by the launchers
+# once a conversion actually runs (see import_models)
+# file inputs, the format (see parsers.FORMATS) is detected from the data
+INPUT_SUFFIXES = (".txt", ".csv", ".phdb")
+
+
+def is_segment(data_input: str) -> bool:
+    return data_input.startswith(SHM_PREFIX) or (
+        len(data_input) <= 256 and data_input.lower().endswith(SEGMENT_SUFFIX)
+    )
+
+
+def is_input_file(data_input: str) -> bool:
+    return len(data_input) <= 256 and Path(data_input).suffix.lower() in INPUT_SUFFIXES
+
+
+def import_models():
+    from phdf import models
+
+    return models
+
+
+def get_input_label(inp: Any) -> str:
+    match inp:
+        case Path():
+            return str(inp)
+        case str():
+            return "json"
+        case _ if hasattr(inp, "source"):  # segments.SegmentSource
+            return inp.source
+        case _:
+            return "stdin"
+
+
+def convert(
+    inp: Any,
+    output_dir: str,
+    layout: str = "tables",
+    metrics_path: Optional[str] = None,
+    incremental: bool = False,
+    pipeline: bool = False,
+    pipeline_queue_size: int = 8,
+    **options: Any,
+):
+    """Runs DevicePixelArray on inp and saves the tables
+
+    :param inp: DevicePixelArray input
+    :type inp: str | Path | io.IOBase
+    :param output_dir: output directory
+    :type output_dir: str
+    :param layout: HDF5 layout, defaults to "tables"
+    :type layout: str, optional
+    :param metrics_path: file to append the stage metrics to as a JSON line,
+        "-" for stderr, defaults to None (no metrics)
+    :type metrics_path: str, optional
+    :param incremental: merges into an existing output, only rewriting the
+        tables that changed, defaults to False
+    :type incremental: bool, optional
+    :param pipeline: writes the tables in a background thread while the next
+        ones are built, see DevicePixelArray.run_pipelined(), defaults to False
+    :type pipeline: bool, optional
+    :param pipeline_queue_size: with pipeline, tables waiting for the writer,
+        defaults to 8
+    :type pipeline_queue_size: int, optional
+    :param options: DevicePixelArray keyword options, e.g. compression
+    :return: exit code and the DevicePixelArray
+    :rtype: tuple[int, models.DevicePixelArray]
+    """
+    metrics = Metrics()
+    exit_code, dpx = 1, None
+    try:
+        with metrics.stage("import"):
+            models = import_models()
+        dpx = models.DevicePixelArray(
+            inp=inp,
+            output_folder=output_dir,
+            metrics=metrics,
+            pipeline=pipeline,
+            **options,
+        )
+        if pipeline:
+            try:
+                dpx.run_pipelined(layout=layout, queue_size=pipeline_queue_size)
+            except models.writers.BackgroundWriteError as e:
+                log.error(f"{e}, discarded {dpx.outpath.name}")
+                return exit_code, dpx
+        else:
+            dpx.run()
+        if not dpx.tables:
+            log.error("no pixel data found in data_input")
+            return exit_code, dpx
+        if not pipeline:
+            dpx.save_to_hdf(layout=layout, incremental=incremental)
+        exit_code = 0
+        return exit_code, dpx
+    finally:
+        if metrics_path:
+            metrics.emit(
+                metrics_path,
+                input=get_input_label(inp),
+                output=str(dpx.outpath) if dpx is not None else None,
+                layout=layout,
+                exit_code=exit_code,
+            )
+
 
 def launcher_json_string(
-    data_input: str, output_dir: str, measure_timing: bool = False
+    data_input: str,
+    output_dir: str,
+    measure_timing: bool = False,
+    layout: str = "tables",
+    **options: Any,
 ):
     assert isinstance(data_input, str)
     if measure_timing:
         start_time = time.perf_counter()
-    dpx = models.DevicePixelArray(inp=data_input, output_folder=output_dir)
-    dpx.run()
-    dpx.save_to_hdf()
+    exit_code, _ = convert(data_input, output_dir, layout=layout, **options)
     if measure_timing:
         elapsed_time = time.perf_counter() - start_time  # type: ignore
         log.info(f"{'*'*5} PHDF_time_taken = {elapsed_time:.4f}s {'*'*5}")
-    return 0
+    return exit_code
+
+
+def launcher_segment(
+    data_input: str,
+    output_dir: str,
+    measure_timing: bool = False,
+    layout: str = "tables",
+    **options: Any,
+):
+    """Builds the pixel maps straight from a shared memory block or .phsm file"""
+    if measure_timing:
+        start_time = time.perf_counter()
+    from phdf import segments
+
+    source = segments.SegmentSource(data_input)
+    exit_code, _ = convert(source, output_dir, layout=layout, **options)
+    if measure_timing:
+        elapsed_time = time.perf_counter() - start_time  # type: ignore
+        log.info(f"{'*'*5} PHDF_time_taken = {elapsed_time:.4f}s {'*'*5}")
+    return exit_code
 
 
 def launcher_fileio(
@@ -27,14 +155,16 @@ def launcher_fileio(
     output_dir: str,
     skip_cleanup: bool = False,
     measure_timing: bool = False,
+    layout: str = "tables",
+    **options: Any,
 ):
     fp = Path(data_input)
     assert fp.is_file()
     if measure_timing:
         start_time = time.perf_counter()
-    dpx = models.DevicePixelArray(inp=fp, output_folder=output_dir)
-    dpx.run()
-    dpx.save_to_hdf()
+    exit_code, dpx = convert(fp, output_dir, layout=layout, **options)
+    if exit_code:
+        return exit_code
 
     if skip_cleanup:
         dpx.cleanup()
@@ -46,3 +176,91 @@ def launcher_fileio(
         log.info(f"{'*'*5} PHDF_time_taken = {elapsed_time:.4f}s {'*'*5}")
 
     return 0
+
+
+def launcher_stdin(
+    output_dir: str,
+    measure_timing: bool = False,
+    layout: str = "tables",
+    stdin: Optional[BinaryIO] = None,
+    **options: Any,
+):
+    """Parses the record stream from stdin as it arrives
+
+    :param stdin: binary stream to read instead of sys.stdin.buffer, e.g. the
+        stdin a --connect client sent, defaults to None
+    :type stdin: BinaryIO, optional
+    """
+    if measure_timing:
+        start_time = time.perf_counter()
+    stream = sys.stdin.buffer if stdin is None else stdin
+    exit_code, _ = convert(stream, output_dir, layout=layout, **options)
+    if measure_timing:
+        elapsed_time = time.perf_counter() - start_time  # type: ignore
+        log.info(f"{'*'*5} PHDF_time_taken = {elapsed_time:.4f}s {'*'*5}")
+    return exit_code
+
+
+def launcher(
+    data_input: str,
+    output_dir: str,
+    skip_cleanup: bool = False,
+    measure_timing: bool = False,
+    layout: str = "tables",
+    **options: Any,
+):
+    """Dispatches data_input to the JSON string, FileIO, stdin or segment launcher
+
+    :param data_input: 'filepath' |or| 'dataString' in JSON format |or| '-' (stdin)
+        |or| 'shm://name' |or| .phsm filepath (segment)
+    :type data_input: str
+    :param output_dir: output directory
+    :type output_dir: str
+    :param options: DevicePixelArray keyword options, e.g. compression
+    :return: exit code
+    :rtype: int
+    """
+    if data_input == "-":
+        return launcher_stdin(
+            output_dir,
+            measure_timing=measure_timing,
+            layout=layout,
+            **options,
+        )
+
+    elif is_segment(data_input):
+        return launcher_segment(
+            data_input,
+            output_dir,
+            measure_timing=measure_timing,
+            layout=layout,
+            **options,
+        )
+
+    elif len(data_input) > 256:
+        return launcher_json_string(
+            data_input,
+            output_dir,
+            measure_timing=measure_timing,
+            layout=layout,
+            **options,
+        )
+
+    elif is_input_file(data_input):
+        return launcher_fileio(
+            data_input,
+            output_dir,
+            skip_cleanup=skip_cleanup,
+            measure_timing=measure_timing,
+            layout=layout,
+            **options,
+        )
+
+    else:
+        return launcher_json_string(
+            data_input,
+            output_dir,
+            measure_timing=measure_timing,
+            layout=layout,
+            **options,
+        )
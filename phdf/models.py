@@ -1,19 +1,13 @@
+import io
 import json
-from dataclasses import dataclass
-from typing import Mapping, NamedTuple, Optional
+import time
+import warnings
+from typing import Iterator, Mapping, NamedTuple, Optional
 from pathlib import Path
+import numpy as np
 import pandas as pd
 
-from phdf import utils
-
-
-@dataclass
-class PixelData:
-    site: str
-    serialnumber: str
-    coord: str
-    ch: str
-    value: float
+from phdf import parsers, segments, utils, writers
 
 
 class Table(NamedTuple):
@@ -21,35 +15,474 @@ class Table(NamedTuple):
     df: pd.DataFrame
 
 
+class PixelStack(NamedTuple):
+    """All pixel maps of a run, as one (table, row, col) float32 or float64 array"""
+
+    names: list[str]
+    rows: pd.Index
+    cols: pd.Index
+    values: np.ndarray
+
+    def get_table(self, i: int) -> Table:
+        plane = self.values[i]
+        present = ~np.isnan(plane)
+        row_mask = present.any(axis=1)
+        col_mask = present.any(axis=0)
+        df = pd.DataFrame(
+            plane[np.ix_(row_mask, col_mask)],
+            index=self.rows[row_mask],
+            columns=self.cols[col_mask],
+        )
+        return Table(name=self.names[i], df=df)
+
+    def to_tables(self) -> list[Table]:
+        return [self.get_table(i) for i in range(len(self.names))]
+
+    def summarize(self) -> pd.DataFrame:
+        """Per-table statistics, computed on the whole stack at once
+
+        Counts refer to the table as written, i.e. the rows and cols holding
+        at least one value; std has ddof=1, like pandas.
+
+        :return: one row per table, indexed by table name, SUMMARY_COLUMNS
+        :rtype: pd.DataFrame
+        """
+        values = self.values
+        present = ~np.isnan(values)
+        n_rows = present.any(axis=2).sum(axis=1)
+        n_cols = present.any(axis=1).sum(axis=1)
+        count = present.sum(axis=(1, 2))
+        fields = [split_table_name(x) for x in self.names]
+        with warnings.catch_warnings():
+            # tables with no or a single value get NaN statistics
+            warnings.simplefilter("ignore", RuntimeWarning)
+            stats = {
+                "min": np.nanmin(values, axis=(1, 2), initial=np.inf),
+                "max": np.nanmax(values, axis=(1, 2), initial=-np.inf),
+                "mean": np.nanmean(values, axis=(1, 2), dtype=np.float64),
+                "std": np.nanstd(values, axis=(1, 2), dtype=np.float64, ddof=1),
+            }
+        df = pd.DataFrame(
+            {
+                "site": [x[0] for x in fields],
+                "serialnumber": [x[1] for x in fields],
+                "ch": [x[2] for x in fields],
+                "rows": n_rows.astype(np.int64),
+                "cols": n_cols.astype(np.int64),
+                "count": count.astype(np.int64),
+                "nan_count": (n_rows * n_cols - count).astype(np.int64),
+                **{k: v.astype(np.float64) for k, v in stats.items()},
+            },
+            index=pd.Index(self.names, name="table", dtype=object),
+        )
+        empty = count == 0
+        df.loc[empty, ["min", "max"]] = np.nan
+        return df[SUMMARY_COLUMNS]
+
+
+SUMMARY_COLUMNS = [
+    "site",
+    "serialnumber",
+    "ch",
+    "rows",
+    "cols",
+    "count",
+    "nan_count",
+    "min",
+    "max",
+    "mean",
+    "std",
+]
+
+
+def summarize_tables(tables: list[Table]) -> pd.DataFrame:
+    """Summary of tables read back from a file, see PixelStack.summarize()"""
+    if not tables:
+        return pd.DataFrame(
+            columns=SUMMARY_COLUMNS, index=pd.Index([], name="table", dtype=object)
+        )
+    return pd.concat(
+        PixelStack(
+            [t.name], t.df.index, t.df.columns, t.df.to_numpy(np.float32)[None]
+        ).summarize()
+        for t in tables
+    )
+
+
+def split_table_name(name: str) -> tuple[str, str, str]:
+    """(site, serialnumber, ch) of a "site_serialnumber_ch" table name
+
+    Channels may contain "_" (e.g. "aTB_0"), site and serialnumber may not.
+    """
+    parts = name.rsplit("/", 1)[-1].split("_", 2)
+    return tuple(parts + [""] * (3 - len(parts)))  # type: ignore
+
+
+# working memory per character of input text while a chunk is scanned
+CHUNK_MEMORY_FACTOR = 16
+MIN_CHUNK_SIZE = 1 << 16
+PIPELINE_CHUNK_SIZE = 1 << 21  # parse temporaries as --max_memory 32
+SPARSE_PIVOT_RATIO = 8  # grid cells per record above which pivots are record-sized
+
+
+def get_chunk_size(max_memory_mb: float) -> int:
+    return max(MIN_CHUNK_SIZE, int(max_memory_mb * 2**20 / CHUNK_MEMORY_FACTOR))
+
+
+COORD_PATTERN = r"^\s*[Rr](\d+)\s*[Cc](\d+)\s*$"
+
+
+def decode_coords(coord: pd.Series) -> tuple[np.ndarray, np.ndarray]:
+    """Decodes "RxxCyy" coords into integer row and col, any number of digits
+
+    Each unique coord is parsed once and mapped back to the records through
+    the categorical codes. Coords that do not match get row = col = -1.
+
+    :param coord: coord column, categorical or str
+    :type coord: pd.Series
+    :return: row and col indices
+    :rtype: tuple[np.ndarray, np.ndarray]
+    """
+    coord = coord.astype("category")
+    rc = coord.cat.categories.astype(str).str.extract(COORD_PATTERN)
+    rc = rc.fillna(-1).astype(np.int64).to_numpy()
+    codes = coord.cat.codes.to_numpy()
+    rows = np.append(rc[:, 0], -1)  # code -1 (missing) picks the trailing -1
+    cols = np.append(rc[:, 1], -1)
+    return rows[codes], cols[codes]
+
+
+def table_keys(df: pd.DataFrame) -> pd.Categorical:
+    """Builds the categorical "site_serialnumber_ch" table key of every record
+
+    Names are only formatted once per unique (site, serialnumber, ch) and
+    ordered by first appearance.
+
+    :param df: frame with site, serialnumber and ch columns
+    :type df: pd.DataFrame
+    :return: table_name column
+    :rtype: pd.Categorical
+    """
+    parts = [df[k].astype("category") for k in ("site", "serialnumber", "ch")]
+    key = np.zeros(len(df), dtype=np.int64)
+    for part in parts:
+        key = key * (len(part.cat.categories) + 1) + part.cat.codes.to_numpy() + 1
+    codes, uniques = pd.factorize(key, sort=False)
+    names = []
+    for k in uniques:
+        labels = []
+        for part in reversed(parts):
+            k, code = divmod(k, len(part.cat.categories) + 1)
+            labels.append(str(part.cat.categories[code - 1]) if code else "nan")
+        names.append("_".join(reversed(labels)))
+    name_codes, name_uniques = pd.factorize(np.array(names, dtype=object))
+    return pd.Categorical.from_codes(name_codes[codes], categories=name_uniques)
+
+
+def pivot_stack(df: pd.DataFrame, dtype=np.float32) -> PixelStack:
+    """Scatters every table into one preallocated stack, in a single pass
+
+    Equivalent to pd.pivot_table(columns="col", index="row", values="value")
+    for each table_name: duplicated pixels are averaged, NaN values ignored.
+
+    :param df: output of DevicePixelArray.process_raw_dataframe()
+    :type df: pd.DataFrame
+    :param dtype: stack dtype, defaults to np.float32
+    :type dtype: np.dtype, optional
+    :return: stacked pixel maps, tables in order of first appearance
+    :rtype: PixelStack
+    """
+    t_codes, names = pd.factorize(df["table_name"], sort=False)
+    return scatter_stack(
+        t_codes,
+        [str(x) for x in names],
+        df["row"].to_numpy(),
+        df["col"].to_numpy(),
+        df["value"].to_numpy(dtype=np.float64),
+        dtype,
+    )
+
+
+def scatter_stack(
+    t_codes: np.ndarray,
+    names: list[str],
+    row: np.ndarray,
+    col: np.ndarray,
+    values: np.ndarray,
+    dtype=np.float32,
+) -> PixelStack:
+    """Scatters records, already split into array columns, into a PixelStack
+
+    :param t_codes: index into names of every record
+    :type t_codes: np.ndarray
+    :param names: table names
+    :type names: list[str]
+    :param row: row label of every record
+    :type row: np.ndarray
+    :param col: col label of every record
+    :type col: np.ndarray
+    :param values: float64 value of every record
+    :type values: np.ndarray
+    :param dtype: stack dtype, defaults to np.float32
+    :type dtype: np.dtype, optional
+    :return: stacked pixel maps, rows and cols sorted
+    :rtype: PixelStack
+    """
+    r_codes, rows = pd.factorize(row, sort=True)
+    c_codes, cols = pd.factorize(col, sort=True)
+    shape = (len(names), len(rows), len(cols))
+    flat = np.ravel_multi_index((t_codes, r_codes, c_codes), shape)
+    valid = ~np.isnan(values)
+    flat, values = flat[valid], values[valid]
+
+    size = int(np.prod(shape))
+    if len(flat) * SPARSE_PIVOT_RATIO < size:
+        # mostly empty grid (e.g. partial wafers): average the duplicates over
+        # the records, without grid sized temporaries
+        flat, inverse, counts = np.unique(flat, return_inverse=True, return_counts=True)
+        stack = np.full(shape, np.nan, dtype=dtype)
+        stack.reshape(-1)[flat] = np.bincount(inverse, weights=values) / counts
+    else:
+        counts = np.bincount(flat, minlength=size)
+        if counts.max(initial=0) <= 1:
+            stack = np.full(shape, np.nan, dtype=dtype)
+            stack.reshape(-1)[flat] = values
+        else:
+            sums = np.bincount(flat, weights=values, minlength=size)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                stack = (sums / counts).astype(dtype).reshape(shape)
+
+    return PixelStack(
+        names=list(names),
+        rows=pd.Index(rows, name="row"),
+        cols=pd.Index(cols, name="col"),
+        values=stack,
+    )
+
+
+class PixelAccumulator:
+    """Accumulates records chunk by chunk into per-table pixel arrays
+
+    Holds one mean (float32 by default) and one uint32 count per (table,
+    row, col); the arrays grow as new tables, rows and cols appear. Duplicated
+    pixels are averaged and NaN values ignored, as in pivot_stack(), so to_stack()
+    gives the same pixel maps without keeping the records of past chunks.
+    """
+
+    def __init__(self, dtype=np.float32):
+        self.dtype = dtype
+        self.names: dict[str, int] = {}
+        self.rows: dict = {}
+        self.cols: dict = {}
+        self.means = np.zeros((0, 0, 0), dtype=dtype)
+        self.counts = np.zeros((0, 0, 0), dtype=np.uint32)
+        self.max_count = 0
+
+    @property
+    def nbytes(self) -> int:
+        return self.means.nbytes + self.counts.nbytes
+
+    def add(self, df: pd.DataFrame) -> None:
+        """Adds a chunk, the output of DevicePixelArray.process_raw_dataframe()
+
+        :param df: frame with table_name, row, col and value columns
+        :type df: pd.DataFrame
+        """
+        if self.max_count + len(df) > np.iinfo(np.uint32).max:
+            # checked first, a rejected chunk leaves the accumulator as it was
+            raise OverflowError("more than 2**32 - 1 records for one pixel")
+        t = self.get_index(self.names, df["table_name"])
+        r = self.get_index(self.rows, df["row"])
+        c = self.get_index(self.cols, df["col"])
+        self.reserve((len(self.names), len(self.rows), len(self.cols)))
+
+        values = df["value"].to_numpy(dtype=np.float64)
+        valid = ~np.isnan(values)
+        flat = np.ravel_multi_index((t[valid], r[valid], c[valid]), self.means.shape)
+        flat, inverse = np.unique(flat, return_inverse=True)
+        sums = np.bincount(inverse, weights=values[valid])
+        counts = np.bincount(inverse)
+
+        means = self.means.reshape(-1)
+        n_old = self.counts.reshape(-1)[flat].astype(np.float64)
+        n_new = n_old + counts
+        means[flat] = (means[flat] * n_old + sums) / n_new
+        self.counts.reshape(-1)[flat] = n_new
+        self.max_count = max(self.max_count, int(n_new.max(initial=0)))
+
+    @staticmethod
+    def get_index(lookup: dict, column: pd.Series) -> np.ndarray:
+        codes, labels = pd.factorize(column, sort=False)
+        index = np.array(
+            [lookup.setdefault(x, len(lookup)) for x in labels], dtype=np.intp
+        )
+        return index[codes]
+
+    def reserve(self, shape: tuple[int, int, int]) -> None:
+        if all(n <= c for n, c in zip(shape, self.means.shape)):
+            return
+        capacity = tuple(
+            c if n <= c else max(n, c + c // 2) for n, c in zip(shape, self.means.shape)
+        )
+        means = np.zeros(capacity, dtype=self.dtype)
+        counts = np.zeros(capacity, dtype=np.uint32)
+        t, r, c = self.means.shape
+        means[:t, :r, :c] = self.means
+        counts[:t, :r, :c] = self.counts
+        self.means, self.counts = means, counts
+
+    def get_table(self, name: str) -> Table:
+        """Pixel map of one table so far, as to_stack().get_table() would give it"""
+        i = self.names[name]
+        present = self.counts[i, : len(self.rows), : len(self.cols)] > 0
+        rows = np.array(list(self.rows))
+        cols = np.array(list(self.cols))
+        row_idx = np.flatnonzero(present.any(axis=1))
+        col_idx = np.flatnonzero(present.any(axis=0))
+        row_idx = row_idx[np.argsort(rows[row_idx], kind="stable")]
+        col_idx = col_idx[np.argsort(cols[col_idx], kind="stable")]
+        plane = self.means[i][np.ix_(row_idx, col_idx)]
+        plane[~present[np.ix_(row_idx, col_idx)]] = np.nan
+        df = pd.DataFrame(
+            plane,
+            index=pd.Index(rows[row_idx], name="row"),
+            columns=pd.Index(cols[col_idx], name="col"),
+        )
+        return Table(name=name, df=df)
+
+    def to_stack(self) -> PixelStack:
+        """Returns the pixel maps, rows and cols sorted; resets the accumulator"""
+        shape = (len(self.names), len(self.rows), len(self.cols))
+        means = self.means[: shape[0], : shape[1], : shape[2]]
+        means[self.counts[: shape[0], : shape[1], : shape[2]] == 0] = np.nan
+        rows = np.array(list(self.rows))
+        cols = np.array(list(self.cols))
+        row_order = np.argsort(rows, kind="stable")
+        col_order = np.argsort(cols, kind="stable")
+        values = means.take(row_order, axis=1).take(col_order, axis=2)
+        stack = PixelStack(
+            names=[str(x) for x in self.names],
+            rows=pd.Index(rows[row_order], name="row"),
+            cols=pd.Index(cols[col_order], name="col"),
+            values=values,
+        )
+        self.__init__(self.dtype)
+        return stack
+
+
 class DevicePixelArray:
     serialnumber: str
     tables: list[Table]
+    stack: PixelStack | None = None
+    summary: pd.DataFrame | None = None
+    n_records: int = 0
     h5_compression_level: int = 3
     outname: str = "nil"
     input_file: Path | None
 
-    def __init__(self, inp: str | Path, output_folder: Optional[str] | Path = None):
+    def __init__(
+        self,
+        inp: str | Path | io.IOBase | segments.SegmentSource,
+        output_folder: Optional[str] | Path = None,
+        compression: Optional[utils.Compression] = None,
+        max_memory_mb: Optional[float] = None,
+        parse_jobs: int = 1,
+        metrics: Optional[utils.Metrics] = None,
+        pipeline: bool = False,
+        precision: Optional[utils.Precision] = None,
+        sparse_density: Optional[float] = None,
+    ):
+        """
+        :param inp: JSON or lines string, filepath or binary stream, the input
+            format is detected from the data, see parsers.FORMATS; or a
+            shared memory segment
+        :type inp: str | Path | io.IOBase | segments.SegmentSource
+        :param output_folder: defaults to None (the resources folder)
+        :type output_folder: Optional[str] | Path, optional
+        :param compression: defaults to None (zlib, level 3)
+        :type compression: utils.Compression, optional
+        :param max_memory_mb: for file and stream inputs, parses the input in
+            chunks sized to this ceiling during run(), accumulating straight
+            into the pixel arrays, defaults to None (parse all at once)
+        :type max_memory_mb: float, optional
+        :param parse_jobs: worker processes parsing a .txt filepath, defaults to 1
+        :type parse_jobs: int, optional
+        :param metrics: stage metrics to record into, defaults to None (new)
+        :type metrics: utils.Metrics, optional
+        :param pipeline: for file and stream inputs, parses the input in chunks
+            during run_pipelined(), defaults to False
+        :type pipeline: bool, optional
+        :param precision: value storage schema, pixel maps are built in float64
+            if any table is stored as float64, defaults to None (float32)
+        :type precision: utils.Precision, optional
+        :param sparse_density: stores the tables with a lower fraction of
+            pixels holding a value as coordinate lists, layout="tables" only,
+            defaults to None (all dense)
+        :type sparse_density: float, optional
+        """
         self.log = utils.setup_logger()
+        self.metrics = utils.Metrics() if metrics is None else metrics
         self.tables = []
+        self.chunks = None
+        self.segment = None
+        self.parse_jobs = parse_jobs
+        if compression is None:
+            compression = utils.Compression(level=self.h5_compression_level)
+        self.compression = compression
+        self.h5_compression_level = compression.complevel
+        self.precision = precision
+        self.sparse_density = sparse_density
+        self.dtype = np.float32
+        if precision is not None and "float64" in precision.precisions:
+            self.dtype = np.float64
 
         self.df = pd.DataFrame()
-        match inp:
-            case str():
-                file_content = self.process_json_strings(inp)
-                file_content = self.decipher_json_strings(file_content)
-                self.df = pd.DataFrame(file_content)  # finally, enter pandas
-                self.outname = f"nil-{utils.get_time()}"
-                self.input_file = None
-
-            case Path():
-                self.df = self.get_pixel_data_from_txt(inp)
-                self.outname = inp.stem
-                self.input_file = inp
-
-            case _:
-                raise NotImplementedError(f"{inp=}")
-
-        self.outname = f"{self.outname}-cp{self.h5_compression_level}.h5"
+        chunk_size = PIPELINE_CHUNK_SIZE if pipeline else None
+        if max_memory_mb:
+            chunk_size = get_chunk_size(max_memory_mb)
+        with self.metrics.stage("parse") as stage:
+            match inp:
+                case str():
+                    records = parsers.scan_string(inp)
+                    self.df = records.to_frame()  # finally, enter pandas
+                    self.outname = f"nil-{utils.get_time()}"
+                    self.input_file = None
+
+                case Path() if chunk_size:
+                    self.chunks = parsers.iter_file_chunks(inp, chunk_size)
+                    self.outname = inp.stem
+                    self.input_file = inp
+
+                case Path():
+                    self.df = self.get_pixel_data_from_txt(inp)
+                    self.outname = inp.stem
+                    self.input_file = inp
+
+                case io.IOBase() if chunk_size:
+                    self.chunks = parsers.iter_byte_chunks(inp, chunk_size)
+                    self.outname = f"nil-{utils.get_time()}"
+                    self.input_file = None
+
+                case io.IOBase():  # binary stream, e.g. sys.stdin.buffer
+                    records = parsers.scan_chunks(parsers.iter_byte_chunks(inp))
+                    self.df = records.to_frame()
+                    self.outname = f"nil-{utils.get_time()}"
+                    self.input_file = None
+
+                case segments.SegmentSource():  # mapped in run(), no parsing
+                    self.segment = inp
+                    self.outname = inp.stem
+                    self.input_file = None if inp.is_shared_memory else Path(inp.source)
+
+                case _:
+                    raise NotImplementedError(f"{inp=}")
+            if self.chunks is None and self.segment is None:  # else in run()
+                stage["records"] = len(self.df)
+            if self.input_file is not None:
+                stage["bytes"] = self.input_file.stat().st_size
+
+        self.max_memory_mb = max_memory_mb
+        self.outname = utils.get_output_name(self.outname, self.compression)
         if output_folder is None:
             output_folder = utils.FileManager().go_up().cd("resources").get_cwd()
         else:
@@ -57,15 +490,154 @@ class DevicePixelArray:
         self.outpath = output_folder / self.outname
 
     def run(self):
-        df = self.df
-        df = self.process_raw_dataframe(df)
-        for tn in df["table_name"].unique():
-            self.add_df_array(tn, df)
+        self.stack = self.build_stack()
+        with self.metrics.stage("tables") as stage:
+            self.tables.extend(self.stack.to_tables())
+            stage["tables"] = len(self.tables)
+        with self.metrics.stage("summary") as stage:
+            self.summary = self.stack.summarize()
+            stage["tables"] = len(self.summary)
+
+    def build_stack(self) -> PixelStack:
+        if self.segment is not None:
+            with self.metrics.stage("pivot") as stage:
+                stack, self.n_records = segments.read_segment_stack(
+                    self.segment.source, self.dtype
+                )
+                stage["records"] = self.n_records
+        elif self.chunks is not None:
+            with self.metrics.stage("accumulate") as stage:
+                stack = self.accumulate_chunks()
+                stage["records"] = self.n_records
+        else:
+            with self.metrics.stage("process") as stage:
+                df = self.df
+                df = self.process_raw_dataframe(df)
+                self.n_records = stage["records"] = len(df)
+            with self.metrics.stage("pivot") as stage:
+                stack = pivot_stack(df, self.dtype)
+                stage["records"] = len(df)
+        return stack
+
+    def run_pipelined(self, layout: str = "tables", queue_size: int = 8) -> Path:
+        """Runs and saves to self.outpath, writing tables while the next are built
+
+        Tables go into a queue of queue_size as soon as they are complete, a
+        writer thread compresses and writes them meanwhile, see
+        writers.BackgroundWriter. With chunked inputs (pipeline=True), the
+        tables are complete as soon as parsing has moved past their part.
+
+        :param layout: only "tables", defaults to "tables"
+        :type layout: str, optional
+        :param queue_size: tables waiting for the writer, defaults to 8
+        :type queue_size: int, optional
+        :return: output filepath
+        :rtype: Path
+        """
+        if layout != "tables":
+            raise NotImplementedError(f"pipelined writes with {layout=}")
+        hdf_writer = writers.HdfWriter(
+            self.outpath,
+            compression=self.compression,
+            precision_schema=self.precision,
+            sparse_density=self.sparse_density,
+        )
+        with self.metrics.stage("pipeline") as stage:
+            with writers.BackgroundWriter(hdf_writer, queue_size) as writer:
+                positions: dict[str, int] = {}
+                for table in self.iter_pipeline_tables():
+                    if table.name in positions:
+                        self.tables[positions[table.name]] = table
+                    else:
+                        positions[table.name] = len(self.tables)
+                        self.tables.append(table)
+                    writer.submit(table.name, table.df)
+                if not self.tables:
+                    writer.close(commit=False)
+                    return self.outpath
+                assert self.stack is not None
+                self.summary = self.stack.summarize()
+                writer.submit_summary(self.summary)
+            self.metrics.table_writes.update(writer.write_times)
+            stage["records"] = self.n_records
+            stage["tables"] = len(self.tables)
+            stage["write_s"] = round(writer.busy_s, 6)
+            stage["queue_wait_s"] = round(writer.wait_s, 6)
+            if self.sparse_density:
+                stage["sparse"] = hdf_writer.n_sparse
+            stage["bytes"] = self.outpath.stat().st_size
+        return self.outpath
+
+    def iter_pipeline_tables(self) -> Iterator[Table]:
+        if self.chunks is not None:
+            yield from self.iter_sealed_tables()
+            return
+        self.stack = self.build_stack()
+        for i in range(len(self.stack.names)):
+            yield self.stack.get_table(i)
+
+    def iter_sealed_tables(self) -> Iterator[Table]:
+        """Accumulates the chunks, yielding every table as soon as it is complete
+
+        The testfilewriter writes the records part by part, so the tables of a
+        serialnumber are taken as complete once a chunk no longer holds it. A
+        table receiving records after all is yielded again at the end.
+        """
+        accumulator = PixelAccumulator(self.dtype)
+        pending: dict[str, str] = {}  # table name: serialnumber
+        sealed: set[str] = set()
+        reopened: set[str] = set()
+        self.n_records = 0
+        for records in parsers.iter_record_chunks(self.chunks):
+            self.n_records += len(records)
+            df = self.process_raw_dataframe(records.to_frame())
+            accumulator.add(df)
+            keys = df[["table_name", "serialnumber"]].drop_duplicates()
+            for name, sn in zip(keys["table_name"].astype(str), keys["serialnumber"]):
+                if name in sealed:
+                    reopened.add(name)
+                else:
+                    pending[name] = sn
+            active = set(keys["serialnumber"])
+            for name in [k for k, sn in pending.items() if sn not in active]:
+                del pending[name]
+                sealed.add(name)
+                yield accumulator.get_table(name)
+        self.chunks = None
+        self.stack = accumulator.to_stack()
+        if reopened:
+            self.log.warning(
+                f"{len(reopened)} tables got records after being written,"
+                " rewriting them"
+            )
+        for i, name in enumerate(self.stack.names):
+            if name not in sealed or name in reopened:
+                yield self.stack.get_table(i)
+
+    def accumulate_chunks(self) -> PixelStack:
+        """Parses and pivots the input chunk by chunk, see max_memory_mb"""
+        accumulator = PixelAccumulator(self.dtype)
+        ceiling = (self.max_memory_mb or 0) * 2**20
+        warned = False
+        self.n_records = 0
+        for records in parsers.iter_record_chunks(self.chunks):
+            self.n_records += len(records)
+            accumulator.add(self.process_raw_dataframe(records.to_frame()))
+            if not warned and accumulator.nbytes > ceiling:
+                self.log.warning(
+                    f"pixel arrays ({accumulator.nbytes / 2**20:.1f} MB) exceed"
+                    f" max_memory_mb={self.max_memory_mb}"
+                )
+                warned = True
+        self.chunks = None
+        return accumulator.to_stack()
 
     def get_pixel_data_from_txt(self, filepath: Path | str) -> pd.DataFrame:
-        file_content = self.read_txt_file(filepath)  # gets a bunch of list[dict(json)]
-        file_content = self.decipher_json_strings(file_content)  # tags the data
-        df = pd.DataFrame(file_content)  # finally, enter pandas
+        if self.parse_jobs > 1:
+            records = parsers.scan_file_parallel(filepath, self.parse_jobs)
+        else:
+            records = parsers.scan_file(filepath)  # single pass, straight into columns
+        df = records.to_frame()  # finally, enter pandas
         return df
 
     def read_txt_file(self, filepath: str | Path) -> list[Mapping]:
@@ -100,22 +672,10 @@ class DevicePixelArray:
                 self.log.error(f"{e=}, {x=}")
         return json_str_list
 
-    def decipher_json_strings(self, values: list[Mapping]) -> list[PixelData]:
-        pixel_data_list = []
-        for x in values:
-            sn = list(x.keys())[0]
-            x = x[sn]
-            co = list(x.keys())[0]
-            x = x[co]
-            si = list(x.keys())[0]
-            x = x[si]
-            ch = list(x.keys())[0]
-            ve = x[ch]
-            pixel_data_list.append(
-                PixelData(site=si, serialnumber=sn, coord=co, value=ve, ch=ch)
-            )
-
-        return pixel_data_list
+    def decipher_json_strings(self, values: list[Mapping]) -> parsers.ColumnarRecords:
+        records = parsers.ColumnarRecords()
+        records.extend([parsers.unnest_record(x) for x in values])
+        return records
 
     def process_raw_dataframe(self, dfin: pd.DataFrame) -> pd.DataFrame:
         """Adds name, col/row information to the dataframe
@@ -126,10 +686,14 @@ class DevicePixelArray:
         :rtype: pd.DataFrame
         """
         df = dfin
-        df["table_name"] = df["site"] + "_" + df["serialnumber"] + "_" + df["ch"]
-        df["row"] = df["coord"].apply(lambda x: int(x[1:3]))
-        df["col"] = df["coord"].apply(lambda x: x[3:])
+        df["table_name"] = table_keys(df)
+        df["row"], df["col"] = decode_coords(df["coord"])
         df["value"] = pd.to_numeric(df["value"])
+        invalid = df["row"] < 0
+        if invalid.any():
+            bad = df.loc[invalid, "coord"].unique().tolist()
+            self.log.error(f"dropped {invalid.sum()} records with invalid coord {bad}")
+            df = df[~invalid]
         return df
 
     def add_df_array(self, name: str, dfin: pd.DataFrame) -> None:
@@ -142,22 +706,105 @@ class DevicePixelArray:
         """
         df = dfin[dfin["table_name"] == name][["row", "col", "value"]]
         df = pd.pivot_table(df, columns="col", index="row", values="value")
-        for col in df.columns:
-            df[col] = pd.to_numeric(df[col], downcast="float", errors="ignore")
+        df = df.astype(self.dtype)  # as in the stack, stored per self.precision
         self.tables.append(Table(name=name, df=df))
 
-    def save_to_hdf(self) -> Path:
-        for i, table in enumerate(self.tables):
-            if not self.outpath.parent.is_dir():
-                self.outpath.parent.mkdir(parents=True, exist_ok=True)
-            df = table.df
-            df.to_hdf(
+    def save_to_hdf(self, layout: str = "tables", incremental: bool = False) -> Path:
+        """Writes the pixel maps to self.outpath
+
+        :param layout: "tables" (one node per table) or "stacked"
+            (one (table, row, col) dataset), defaults to "tables"
+        :type layout: str, optional
+        :param incremental: merges the tables into an existing output, only
+            writing the tables that changed, see merge_into_hdf(), defaults to False
+        :type incremental: bool, optional
+        :return: output filepath
+        :rtype: Path
+        """
+        if incremental:
+            if layout != "tables":
+                raise NotImplementedError(f"incremental appends with {layout=}")
+            return self.merge_into_hdf()
+        with self.metrics.stage("write") as stage:
+            with writers.HdfWriter(
                 self.outpath,
-                key=table.name,
-                mode="a",
-                complevel=self.h5_compression_level,
-            )
-            self.log.info(f"{i}: appended({table.name}) to {self.outpath.name}")
+                compression=self.compression,
+                layout=layout,
+                precision_schema=self.precision,
+                sparse_density=self.sparse_density,
+            ) as writer:
+                if layout == "stacked":
+                    assert self.stack is not None, "run() before save_to_hdf()"
+                    writer.write_stack(*self.stack)
+                    self.log.info(
+                        f"appended({len(self.stack.names)} tables, stacked)"
+                        f" to {self.outpath.name}"
+                    )
+                else:
+                    for i, table in enumerate(self.tables):
+                        start_time = time.perf_counter()
+                        writer.write(table.name, table.df)
+                        self.metrics.table_writes[table.name] = round(
+                            time.perf_counter() - start_time, 6
+                        )
+                        self.log.info(
+                            f"{i}: appended({table.name}) to {self.outpath.name}"
+                        )
+                if self.summary is not None:
+                    writer.write_summary(self.summary)
+            if self.sparse_density:
+                stage["sparse"] = writer.n_sparse
+            stage["bytes"] = self.outpath.stat().st_size
+        return self.outpath
+
+    def merge_into_hdf(self) -> Path:
+        """Merges the tables into self.outpath, table by table
+
+        New pixel values replace stored ones, tables whose values did not
+        change are not rewritten. Writes go straight into the output and are
+        recorded in its manifest (/_phdf/manifest) one by one, so an
+        interrupted run resumes by skipping the tables already merged.
+
+        :return: output filepath
+        :rtype: Path
+        """
+        statuses = dict.fromkeys(["added", "merged", "unchanged", "skipped"], 0)
+        with self.metrics.stage("write") as stage:
+            with writers.HdfWriter(
+                self.outpath,
+                compression=self.compression,
+                atomic=False,
+                precision_schema=self.precision,
+                sparse_density=self.sparse_density,
+            ) as writer:
+                changed, kept = [], []
+                for i, table in enumerate(self.tables):
+                    start_time = time.perf_counter()
+                    status, df = writer.merge(table.name, table.df)
+                    self.metrics.table_writes[table.name] = round(
+                        time.perf_counter() - start_time, 6
+                    )
+                    statuses[status] += 1
+                    if status in ("added", "merged"):
+                        changed.append(Table(table.name, df))
+                    else:
+                        kept.append(table.name)
+                    self.log.info(f"{i}: {status}({table.name}) in {self.outpath.name}")
+                # an interrupted run stops before writing the summary rows
+                summarized = writer.summarized_keys()
+                changed += [
+                    Table(k, writer.read(k)) for k in kept if k not in summarized
+                ]
+                if changed:
+                    writer.write_summary(summarize_tables(changed))
+            stage.update(statuses)
+            if self.sparse_density:
+                stage["sparse"] = writer.n_sparse
+            stage["bytes"] = self.outpath.stat().st_size
+        self.log.info(
+            f"incremental write to {self.outpath.name}: "
+            + ", ".join(f"{v} {k}" for k, v in statuses.items())
+        )
         return self.outpath
 
     def cleanup(self):
@@ -0,0 +1,681 @@
+import codecs
+import itertools
+import json
+import os
+import re
+import struct
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import BinaryIO, Iterable, Iterator, Mapping, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from phdf import utils
+
+# {"partId1": {"R00C00": { "site1":{"aTB_0": "0.0"}}}}
+RECORD_PATTERN = re.compile(
+    r'\{\s*"([^"\\]*)"\s*:\s*'  # serialnumber
+    r'\{\s*"([^"\\]*)"\s*:\s*'  # coord
+    r'\{\s*"([^"\\]*)"\s*:\s*'  # site
+    r'\{\s*"([^"\\]*)"\s*:\s*'  # ch
+    r'(?:"([^"\\]*)"|([^\s{}",]+))'  # value, quoted or bare
+    r"\s*\}\s*\}\s*\}\s*\}"
+)
+SEPARATORS = " ,\t\r\n"
+READ_CHUNK_SIZE = 1 << 20
+
+# "}}}}," closes a record, a file can be split right after it
+RECORD_BOUNDARY = re.compile(rb"\}\s*\}\s*\}\s*\}\s*,")
+BOUNDARY_WINDOW = 1 << 16
+MIN_PART_SIZE = 1 << 22
+
+COLUMNS = ("serialnumber", "coord", "site", "ch", "value")
+
+FORMATS = ("json", "lines", "binary")
+# binary format: BINARY_MAGIC, then blocks of
+#   b"S" <u1 field> <u2 length> <utf-8 string>, appended to the field's strings
+#   b"R" <u4 count> count * RECORD_DTYPE, codes indexing the field's strings
+BINARY_MAGIC = b"PHDB\x01"
+RECORD_DTYPE = np.dtype([(k, "<u4") for k in COLUMNS[:-1]] + [("value", "<f8")])
+BINARY_BLOCK_SIZE = 1 << 16
+# where the text formats can be split for parallel parsing
+BOUNDARIES = {"json": RECORD_BOUNDARY, "lines": re.compile(rb"\n")}
+
+
+class _Encoder(dict):
+    def __init__(self, categories: list[str]):
+        super().__init__()
+        self.categories = categories
+
+    def __missing__(self, key: str) -> int:
+        code = self[key] = len(self.categories)
+        self.categories.append(key)
+        return code
+
+
+class StringColumn:
+    """Dictionary-encoded string column, int32 codes into a list of categories"""
+
+    def __init__(self):
+        self.categories: list[str] = []
+        self.codes = array("i")
+        self._lookup = _Encoder(self.categories)
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def extend(self, values: Iterable[str]) -> None:
+        self.codes.extend(map(self._lookup.__getitem__, values))
+
+    def decode(self) -> list[str]:
+        return [self.categories[i] for i in self.codes]
+
+    def extend_encoded(self, other: "StringColumn") -> None:
+        """Appends another column, re-encoding its codes into this one's"""
+        self.extend_codes(np.frombuffer(other.codes, dtype=np.int32), other.categories)
+
+    def extend_codes(self, codes: np.ndarray, categories: list[str]) -> None:
+        """Appends codes into categories, re-encoded into this column's
+
+        Categories new to this column are added in order of first appearance
+        in codes, as if the strings had been appended one by one.
+
+        :param codes: integer codes
+        :type codes: np.ndarray
+        :param categories: strings the codes index into
+        :type categories: list[str]
+        """
+        if not len(codes):
+            return
+        used, first = np.unique(codes, return_index=True)
+        if used[0] < 0 or used[-1] >= len(categories):
+            raise ValueError(f"codes out of range of {len(categories)} categories")
+        mapping = np.zeros(used[-1] + 1, dtype=np.int32)
+        for code in used[np.argsort(first)]:
+            mapping[code] = self._lookup[categories[code]]
+        self.codes.frombytes(mapping[codes].tobytes())
+
+
+class ColumnarRecords:
+    """Compact columnar store that the parsers append records into
+
+    serialnumber, coord, site and ch are dictionary encoded, value is kept
+    as a float64 array. Once handed over to pandas with to_frame(), the value
+    column shares memory with the store and no more records can be added.
+    """
+
+    def __init__(self):
+        self.log = utils.setup_logger()
+        self.serialnumber = StringColumn()
+        self.coord = StringColumn()
+        self.site = StringColumn()
+        self.ch = StringColumn()
+        self.value = array("d")
+
+    def __len__(self) -> int:
+        return len(self.value)
+
+    def extend(self, records: list[tuple]) -> None:
+        if records:
+            self.extend_columns(*zip(*records))
+
+    def extend_columns(
+        self,
+        sn: Sequence[str],
+        co: Sequence[str],
+        si: Sequence[str],
+        ch: Sequence[str],
+        ve: Sequence,
+    ) -> None:
+        self.serialnumber.extend(sn)
+        self.coord.extend(co)
+        self.site.extend(si)
+        self.ch.extend(ch)
+        try:
+            values = array("d", map(float, ve))
+        except (TypeError, ValueError):
+            values = array("d", map(self.to_float, ve))
+        self.value.extend(values)
+
+    @classmethod
+    def concat(cls, parts: Iterable["ColumnarRecords"]) -> "ColumnarRecords":
+        """Joins stores in order, as if their records had been scanned by one
+
+        :param parts: e.g. the records of consecutive file ranges
+        :type parts: Iterable[ColumnarRecords]
+        :return: all records, categories in order of first appearance
+        :rtype: ColumnarRecords
+        """
+        records = cls()
+        for part in parts:
+            for k in COLUMNS[:-1]:
+                getattr(records, k).extend_encoded(getattr(part, k))
+            records.value.extend(part.value)
+        return records
+
+    def to_float(self, x) -> float:
+        try:
+            return float(x)
+        except (TypeError, ValueError) as e:
+            self.log.error(f"{e=}, {x=}")
+            return float("nan")
+
+    def to_frame(self) -> pd.DataFrame:
+        """Hands the columns over to pandas
+
+        The value column shares the buffer of the store. The categorical
+        columns do not: pandas copies their int32 codes into the smallest
+        integer dtype.
+
+        :return: one row per record
+        :rtype: pd.DataFrame
+        """
+        data = {}
+        for k in COLUMNS[:-1]:
+            col: StringColumn = getattr(self, k)
+            data[k] = pd.Categorical.from_codes(
+                np.frombuffer(col.codes, dtype=np.int32), categories=col.categories
+            )
+        data["value"] = np.frombuffer(self.value, dtype=np.float64)
+        return pd.DataFrame(data, copy=False)
+
+
+def unnest_record(x: Mapping) -> tuple:
+    """Walks a single {sn: {coord: {site: {ch: value}}}} record
+
+    :param x: record decoded by json.loads()
+    :type x: Mapping
+    :return: (serialnumber, coord, site, ch, value)
+    :rtype: tuple
+    """
+    sn = next(iter(x))
+    x = x[sn]
+    co = next(iter(x))
+    x = x[co]
+    si = next(iter(x))
+    x = x[si]
+    ch = next(iter(x))
+    return sn, co, si, ch, x[ch]
+
+
+class RecordScanner:
+    """Single-pass scanner for the testfilewriter record stream
+
+    Text is fed in arbitrary chunks; complete records are emitted straight
+    into the columnar store. Anything in between records that is not a
+    separator is handed to the json.loads() path instead.
+    """
+
+    def __init__(self, records: Optional[ColumnarRecords] = None):
+        self.log = utils.setup_logger()
+        self.records = ColumnarRecords() if records is None else records
+        self.n_fallback = 0
+        self._pending = ""
+
+    def feed(self, text: str) -> None:
+        buf = self._pending + text if self._pending else text
+        pos = 0
+        records = []
+        for m in RECORD_PATTERN.finditer(buf):
+            start = m.start()
+            if start > pos and buf[pos:start].strip(SEPARATORS):
+                self.records.extend(records)
+                records = []
+                self.parse_fallback(buf[pos:start])
+            sn, co, si, ch, ve, bare = m.groups()
+            records.append((sn, co, si, ch, bare if ve is None else ve))
+            pos = m.end()
+        self.records.extend(records)
+        self._pending = buf[pos:]
+
+    def close(self) -> ColumnarRecords:
+        if self._pending.strip(SEPARATORS):
+            self.parse_fallback(self._pending)
+        self._pending = ""
+        return self.records
+
+    def parse_fallback(self, fragment: str) -> None:
+        """Parses a fragment the scanner could not recognise, using json.loads()
+
+        :param fragment: text between two recognised records
+        :type fragment: str
+        """
+        records = []
+        for x in fragment.strip().split(","):
+            try:
+                if x.strip():
+                    records.append(unnest_record(json.loads(x)))
+                    self.n_fallback += 1
+            except Exception as e:
+                self.log.error(f"{e=}, {x=}")
+        self.records.extend(records)
+
+
+class LineScanner(RecordScanner):
+    """Scanner for the line format, one "sn,coord,site,ch,value" record per line
+
+    An optional header line with the column names is skipped, malformed
+    lines are logged and dropped.
+    """
+
+    def feed(self, text: str) -> None:
+        buf = self._pending + text if self._pending else text
+        lines = buf.split("\n")
+        self._pending = lines.pop()
+        self.parse_lines(lines)
+
+    def close(self) -> ColumnarRecords:
+        if self._pending.strip():
+            self.parse_lines([self._pending])
+        self._pending = ""
+        return self.records
+
+    def parse_lines(self, lines: list[str]) -> None:
+        if lines and lines[0].strip() == ",".join(COLUMNS):
+            del lines[0]  # header
+        if not lines:
+            return
+        if all(x.count(",") == 4 for x in lines):
+            # no per-line lists: split all fields at once, then slice columns
+            fields = ",".join(lines).split(",")
+            self.records.extend_columns(*(fields[i::5] for i in range(5)))
+        else:
+            records = [x.strip().split(",") for x in lines]
+            self.records.extend([x for x in records if self.check_fields(x)])
+
+    def check_fields(self, fields: list[str]) -> bool:
+        if len(fields) == 5:
+            return True
+        if fields != [""]:
+            self.log.error(f"invalid line {','.join(fields)!r}")
+        return False
+
+
+class BinaryScanner:
+    """Scanner for the length-prefixed binary format, see BINARY_MAGIC
+
+    Bytes are fed in arbitrary chunks; every complete block is decoded, the
+    record blocks straight into the columnar store.
+    """
+
+    def __init__(self, records: Optional[ColumnarRecords] = None):
+        self.records = ColumnarRecords() if records is None else records
+        self.strings: list[list[str]] = [[] for _ in COLUMNS[:-1]]
+        self._buffer = bytearray()
+        self._has_magic = False
+
+    def feed(self, data: bytes) -> None:
+        self._buffer += data
+        buf = self._buffer
+        pos = 0
+        if not self._has_magic:
+            if len(buf) < len(BINARY_MAGIC):
+                return
+            if buf[: len(BINARY_MAGIC)] != BINARY_MAGIC:
+                raise ValueError(f"not a {BINARY_MAGIC!r} binary input")
+            self._has_magic = True
+            pos = len(BINARY_MAGIC)
+        while pos < len(buf):
+            tag = buf[pos : pos + 1]
+            if tag == b"S" and len(buf) >= pos + 4:
+                field, length = struct.unpack_from("<BH", buf, pos + 1)
+                end = pos + 4 + length
+                if len(buf) < end:
+                    break
+                self.strings[field].append(buf[pos + 4 : end].decode())
+            elif tag == b"R" and len(buf) >= pos + 5:
+                (count,) = struct.unpack_from("<I", buf, pos + 1)
+                end = pos + 5 + count * RECORD_DTYPE.itemsize
+                if len(buf) < end:
+                    break
+                self.add_block(np.frombuffer(buf, RECORD_DTYPE, count, pos + 5))
+            elif tag in (b"S", b"R"):
+                break
+            else:
+                raise ValueError(f"invalid binary block {bytes(tag)!r} at byte {pos}")
+            pos = end
+        del buf[:pos]
+
+    def add_block(self, block: np.ndarray) -> None:
+        for i, k in enumerate(COLUMNS[:-1]):
+            column: StringColumn = getattr(self.records, k)
+            column.extend_codes(block[k].astype(np.intp), self.strings[i])
+        self.records.value.frombytes(block["value"].astype(np.float64).tobytes())
+
+    def close(self) -> ColumnarRecords:
+        if self._buffer:
+            raise ValueError("binary input ends in a partial block")
+        return self.records
+
+
+class RecordWriter:
+    """Writes records in one of FORMATS, the reference for input producers
+
+    Records are (serialnumber, coord, site, ch, value) tuples. For the
+    binary format, strings are written once, ahead of the first record
+    block using them, and records are written in blocks of block_size.
+    """
+
+    def __init__(
+        self, f: BinaryIO, fmt: str = "json", block_size: int = BINARY_BLOCK_SIZE
+    ):
+        if fmt not in FORMATS:
+            raise NotImplementedError(f"{fmt=}")
+        self.f = f
+        self.fmt = fmt
+        self.block_size = block_size
+        self.n_written = 0  # records
+        self.lookups: list[dict[str, int]] = [{} for _ in COLUMNS[:-1]]
+        self.block: list[tuple] = []
+        match fmt:
+            case "lines":
+                f.write(",".join(COLUMNS).encode() + b"\n")
+            case "binary":
+                f.write(BINARY_MAGIC)
+
+    def __enter__(self) -> "RecordWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def write(self, records: Iterable[tuple]) -> None:
+        match self.fmt:
+            case "json":
+                text = ",".join(
+                    f'{{"{sn}": {{"{co}": {{ "{si}":{{"{ch}": "{ve}"}}}}}}}}'
+                    for sn, co, si, ch, ve in records
+                )
+                if text:
+                    self.f.write((b"," if self.n_written else b"") + text.encode())
+                    self.n_written += text.count("}}}},") + 1
+            case "lines":
+                lines = [",".join(map(str, x)) + "\n" for x in records]
+                self.f.write("".join(lines).encode())
+                self.n_written += len(lines)
+            case "binary":
+                for record in records:
+                    self.block.append(record)
+                    self.n_written += 1
+                    if len(self.block) >= self.block_size:
+                        self.flush()
+
+    def flush(self) -> None:
+        if not self.block:
+            return
+        block = np.empty(len(self.block), dtype=RECORD_DTYPE)
+        strings = []
+        for i, k in enumerate(COLUMNS[:-1]):
+            lookup = self.lookups[i]
+            codes = []
+            for x in (record[i] for record in self.block):
+                if x not in lookup:
+                    lookup[x] = len(lookup)
+                    data = str(x).encode()
+                    strings.append(struct.pack("<cBH", b"S", i, len(data)) + data)
+                codes.append(lookup[x])
+            block[k] = codes
+        block["value"] = [float(record[4]) for record in self.block]
+        self.f.write(b"".join(strings))
+        self.f.write(struct.pack("<cI", b"R", len(block)) + block.tobytes())
+        self.block = []
+
+    def close(self) -> None:
+        if self.fmt == "binary":
+            self.flush()
+
+
+def detect_format(head: bytes | str) -> str:
+    """Detects the input format, one of FORMATS, from the start of the input"""
+    if isinstance(head, bytes):
+        if head.startswith(BINARY_MAGIC[:4]):
+            return "binary"
+        head = head[:256].decode("utf-8", errors="ignore")
+    head = head.lstrip(SEPARATORS)
+    if not head or head.startswith("{"):
+        return "json"
+    return "lines"
+
+
+def get_scanner(fmt: str) -> RecordScanner | BinaryScanner:
+    match fmt:
+        case "json":
+            return RecordScanner()
+        case "lines":
+            return LineScanner()
+        case "binary":
+            return BinaryScanner()
+        case _:
+            raise NotImplementedError(f"{fmt=}")
+
+
+def detect_chunks(chunks: Iterable[bytes]) -> tuple[str, Iterator[bytes]]:
+    """Reads ahead until the input format is known
+
+    :param chunks: e.g. iter_file_chunks() or iter_byte_chunks()
+    :type chunks: Iterable[bytes]
+    :return: format, and all the chunks, including the ones read ahead
+    :rtype: tuple[str, Iterator[bytes]]
+    """
+    chunks = iter(chunks)
+    head = b""
+    for chunk in chunks:
+        head += chunk
+        if len(head) >= len(BINARY_MAGIC) and head.lstrip(SEPARATORS.encode()):
+            break
+    return detect_format(head), itertools.chain([head], chunks)
+
+
+def iter_scanner_input(chunks: Iterable[bytes]) -> tuple:
+    fmt, chunks = detect_chunks(chunks)
+    if fmt == "binary":
+        return get_scanner(fmt), chunks
+    return get_scanner(fmt), iter_decoded(chunks)
+
+
+def scan_string(input_str: str) -> ColumnarRecords:
+    scanner = get_scanner(detect_format(input_str))
+    scanner.feed(input_str)
+    return scanner.close()
+
+
+def scan_stream(stream: Iterable[str]) -> ColumnarRecords:
+    """Scans text chunks, the format is detected from the first one"""
+    stream = iter(stream)
+    first = next(stream, "")
+    scanner = get_scanner(detect_format(first))
+    for chunk in itertools.chain([first], stream):
+        scanner.feed(chunk)
+    return scanner.close()
+
+
+def scan_chunks(chunks: Iterable[bytes]) -> ColumnarRecords:
+    """Scans byte chunks of any of FORMATS, detected from the first bytes
+
+    :param chunks: e.g. iter_file_chunks() or iter_byte_chunks()
+    :type chunks: Iterable[bytes]
+    :return: scanned records
+    :rtype: ColumnarRecords
+    """
+    scanner, chunks = iter_scanner_input(chunks)
+    for chunk in chunks:
+        scanner.feed(chunk)
+    return scanner.close()
+
+
+def scan_file(
+    filepath: str | Path, chunk_size: int = READ_CHUNK_SIZE
+) -> ColumnarRecords:
+    """Reads the input file once, chunk by chunk, into the columnar store
+
+    :param filepath: file input, any of FORMATS
+    :type filepath: str | Path
+    :param chunk_size: bytes per read, defaults to READ_CHUNK_SIZE
+    :type chunk_size: int, optional
+    :return: scanned records
+    :rtype: ColumnarRecords
+    """
+    return scan_chunks(iter_file_chunks(filepath, chunk_size))
+
+
+def find_record_boundaries(
+    filepath: str | Path, n_parts: int, boundary: re.Pattern = RECORD_BOUNDARY
+) -> list[int]:
+    """Byte offsets splitting the file into up to n_parts record-aligned ranges
+
+    Every offset but the first and last falls right after a boundary, by
+    default the "," that follows a record, so each range can be scanned on
+    its own.
+
+    :param filepath: file input
+    :type filepath: str | Path
+    :param n_parts: wanted number of ranges
+    :type n_parts: int
+    :param boundary: end of a record, see BOUNDARIES
+    :type boundary: re.Pattern, optional
+    :return: [0, ..., file size]
+    :rtype: list[int]
+    """
+    size = os.path.getsize(filepath)
+    offsets = [0]
+    with open(filepath, "rb") as f:
+        for i in range(1, n_parts):
+            pos = max(size * i // n_parts, offsets[-1])
+            while pos < size:
+                f.seek(pos)
+                window = f.read(BOUNDARY_WINDOW)
+                m = boundary.search(window)
+                if m:
+                    offsets.append(pos + m.end())
+                    break
+                if len(window) < BOUNDARY_WINDOW:
+                    pos = size
+                else:  # overlap, in case the boundary straddles two windows
+                    pos += BOUNDARY_WINDOW - 64
+    return sorted(set(offsets + [size]))
+
+
+def scan_file_range(
+    filepath: str | Path,
+    start: int,
+    end: int,
+    chunk_size: int = READ_CHUNK_SIZE,
+    fmt: str = "json",
+) -> ColumnarRecords:
+    """Scans the records between two offsets of find_record_boundaries()"""
+    scanner = get_scanner(fmt)
+    for chunk in iter_decoded(iter_file_chunks(filepath, chunk_size, start, end)):
+        scanner.feed(chunk)
+    return scanner.close()
+
+
+def scan_file_parallel(
+    filepath: str | Path,
+    jobs: int,
+    chunk_size: int = READ_CHUNK_SIZE,
+    min_part_size: int = MIN_PART_SIZE,
+) -> ColumnarRecords:
+    """Scans record-aligned ranges of the file in worker processes
+
+    The ranges are merged back in file order, so the result is the same as
+    scan_file(). Files smaller than two parts and binary inputs are scanned
+    in-process.
+
+    :param filepath: file input
+    :type filepath: str | Path
+    :param jobs: number of worker processes
+    :type jobs: int
+    :param chunk_size: bytes per read, defaults to READ_CHUNK_SIZE
+    :type chunk_size: int, optional
+    :param min_part_size: smallest range worth a worker, defaults to MIN_PART_SIZE
+    :type min_part_size: int, optional
+    :return: scanned records
+    :rtype: ColumnarRecords
+    """
+    n_parts = min(jobs, os.path.getsize(filepath) // max(min_part_size, 1))
+    with open(filepath, "rb") as f:
+        fmt = detect_format(f.read(BOUNDARY_WINDOW))
+    if n_parts < 2 or fmt not in BOUNDARIES:
+        return scan_file(filepath, chunk_size)
+    offsets = find_record_boundaries(filepath, n_parts, BOUNDARIES[fmt])
+    n_parts = len(offsets) - 1
+    with ProcessPoolExecutor(max_workers=n_parts) as executor:
+        parts = executor.map(
+            scan_file_range,
+            [filepath] * n_parts,
+            offsets[:-1],
+            offsets[1:],
+            [chunk_size] * n_parts,
+            [fmt] * n_parts,
+        )
+        return ColumnarRecords.concat(parts)
+
+
+def iter_record_chunks(chunks: Iterable[bytes]) -> Iterator[ColumnarRecords]:
+    """Yields the records of every input chunk as its own ColumnarRecords
+
+    Records split across two chunks are completed by the scanner and
+    emitted with the later one, so each yielded store ends on a record
+    boundary and can be released once consumed.
+
+    :param chunks: e.g. iter_file_chunks() or iter_byte_chunks()
+    :type chunks: Iterable[bytes]
+    :yield: records per chunk
+    :rtype: Iterator[ColumnarRecords]
+    """
+    scanner, chunks = iter_scanner_input(chunks)
+    for chunk in chunks:
+        scanner.feed(chunk)
+        if len(scanner.records):
+            yield scanner.records
+            scanner.records = ColumnarRecords()
+    records = scanner.close()
+    if len(records):
+        yield records
+
+
+def iter_file_chunks(
+    filepath: str | Path,
+    chunk_size: int = READ_CHUNK_SIZE,
+    start: int = 0,
+    end: Optional[int] = None,
+) -> Iterator[bytes]:
+    with open(filepath, "rb") as f:
+        f.seek(start)
+        remaining = os.path.getsize(filepath) - start if end is None else end - start
+        while remaining > 0 and (chunk := f.read(min(chunk_size, remaining))):
+            remaining -= len(chunk)
+            yield chunk
+
+
+def iter_byte_chunks(
+    stream: BinaryIO, chunk_size: int = READ_CHUNK_SIZE
+) -> Iterator[bytes]:
+    """Yields bytes as soon as they arrive, without waiting for EOF
+
+    :param stream: e.g. sys.stdin.buffer
+    :type stream: BinaryIO
+    :param chunk_size: maximum bytes per read, defaults to READ_CHUNK_SIZE
+    :type chunk_size: int, optional
+    :yield: byte chunks
+    :rtype: Iterator[bytes]
+    """
+    read = getattr(stream, "read1", stream.read)
+    while chunk := read(chunk_size):
+        yield chunk
+
+
+def iter_decoded(chunks: Iterable[bytes]) -> Iterator[str]:
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    for chunk in chunks:
+        yield decoder.decode(chunk)
+    yield decoder.decode(b"", final=True)
+
+
+def iter_binary_stream(
+    stream: BinaryIO, chunk_size: int = READ_CHUNK_SIZE
+) -> Iterator[str]:
+    """Yields decoded text as soon as bytes arrive, without waiting for EOF"""
+    return iter_decoded(iter_byte_chunks(stream, chunk_size))
@@ -0,0 +1,115 @@
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+# quantized precisions: integer dtype, NaN stored as the dtype minimum
+QUANTIZED = {"int16q": np.int16, "int32q": np.int32}
+# decoded dtype of a quantized precision, beyond its resolution anyway
+DECODED = {"int16q": np.float32, "int32q": np.float64}
+# HDF5 attributes of an encoded table
+PRECISION_ATTR = "phdf_precision"
+SCALE_ATTR = "phdf_scale"
+OFFSET_ATTR = "phdf_offset"
+
+
+class Encoded(NamedTuple):
+    """Stored values, values = codes * scale + offset for quantized precisions"""
+
+    codes: np.ndarray
+    precision: str
+    scale: float = 1.0
+    offset: float = 0.0
+
+
+def encode(values: np.ndarray, precision: str) -> Encoded:
+    """Converts pixel values to their storage precision
+
+    Quantized precisions map the finite range of values onto the integer
+    range, so the absolute error is at most scale / 2.
+
+    :param values: pixel values, NaN for missing pixels
+    :type values: np.ndarray
+    :param precision: one of utils.PRECISIONS
+    :type precision: str
+    :return: stored values and their scale and offset
+    :rtype: Encoded
+    """
+    if precision not in QUANTIZED:
+        with np.errstate(over="ignore"):  # inf, counted by measure_loss()
+            return Encoded(values.astype(precision, copy=False), precision)
+    info = np.iinfo(QUANTIZED[precision])
+    missing = np.isnan(values)
+    finite = values[np.isfinite(values)]
+    lo, hi = (float(finite.min()), float(finite.max())) if finite.size else (0.0, 0.0)
+    offset = (lo + hi) / 2
+    scale = (hi - lo) / (2 * info.max) or 1.0  # codes in [-max, max]
+    codes = np.rint((values.astype(np.float64) - offset) / scale)
+    codes = np.clip(codes, -info.max, info.max)
+    codes[missing] = info.min
+    return Encoded(codes.astype(info.dtype), precision, scale, offset)
+
+
+def decode(encoded: Encoded) -> np.ndarray:
+    codes, precision, scale, offset = encoded
+    if precision not in QUANTIZED:
+        return codes
+    values = codes * scale + offset
+    values[codes == np.iinfo(codes.dtype).min] = np.nan
+    return values.astype(DECODED[precision])
+
+
+def as_stored(values: np.ndarray, dtype: np.dtype, attrs) -> np.ndarray:
+    """Values as they read back once stored like a table of dtype and attrs
+
+    Quantized values are rounded to the scale and offset of the stored table,
+    not to the range of values. Codes beyond its range are kept, so they do
+    not read back as any stored value.
+    """
+    if SCALE_ATTR not in attrs:
+        with np.errstate(over="ignore"):
+            return values.astype(dtype)
+    scale = float(getattr(attrs, SCALE_ATTR))
+    offset = float(getattr(attrs, OFFSET_ATTR))
+    codes = np.rint((values.astype(np.float64) - offset) / scale)
+    return (codes * scale + offset).astype(dtype)
+
+
+def measure_loss(values: np.ndarray, encoded: Encoded) -> dict[str, float]:
+    """Precision loss of encoded values against the original ones
+
+    :return: max_abs_error, max_rel_error (relative to the largest magnitude)
+        and overflow, the number of finite values stored as inf
+    :rtype: dict[str, float]
+    """
+    decoded = decode(encoded).astype(np.float64)
+    original = values.astype(np.float64)
+    present = ~np.isnan(original)
+    error = np.abs(decoded[present] - original[present])
+    overflow = int(np.isinf(decoded[present]).sum() - np.isinf(original[present]).sum())
+    finite = np.isfinite(error)
+    max_abs = float(error[finite].max(initial=0.0))
+    magnitude = float(np.abs(original[present]).max(initial=0.0))
+    return dict(
+        max_abs_error=max_abs,
+        max_rel_error=max_abs / magnitude if magnitude else 0.0,
+        overflow=overflow,
+    )
+
+
+def encode_frame(df: pd.DataFrame, precision: str) -> tuple[pd.DataFrame, Encoded]:
+    encoded = encode(df.to_numpy(), precision)
+    return pd.DataFrame(encoded.codes, index=df.index, columns=df.columns), encoded
+
+
+def decode_frame(df: pd.DataFrame, attrs) -> pd.DataFrame:
+    """Decodes a table read back from HDF5, attrs being its node attributes"""
+    if SCALE_ATTR not in attrs:
+        return df
+    encoded = Encoded(
+        df.to_numpy(),
+        getattr(attrs, PRECISION_ATTR),
+        float(getattr(attrs, SCALE_ATTR)),
+        float(getattr(attrs, OFFSET_ATTR)),
+    )
+    return pd.DataFrame(decode(encoded), index=df.index, columns=df.columns)
@@ -0,0 +1,248 @@
+import json
+import mmap
+import struct
+import sys
+from multiprocessing import resource_tracker, shared_memory
+from pathlib import Path
+from typing import NamedTuple, Sequence
+
+import numpy as np
+import pandas as pd
+
+from phdf.utils import SHM_PREFIX
+
+# segment layout, little-endian:
+#   HEADER: magic, version, n_records, n_tables, names_nbytes
+#   names: utf-8 JSON list of [serialnumber, site, ch], one per table
+#   zero padding to a multiple of 8 bytes
+#   value <f8[n_records], table <u4[n_records], row <u4[n_records], col <u4[n_records]
+SEGMENT_MAGIC = b"PHSM"
+SEGMENT_VERSION = 1
+HEADER = struct.Struct("<4sIQII")
+
+
+class PixelSegment(NamedTuple):
+    """Records of a segment, array columns viewing the segment memory"""
+
+    names: list[tuple[str, str, str]]  # (serialnumber, site, ch) per table
+    table: np.ndarray
+    row: np.ndarray
+    col: np.ndarray
+    value: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.value)
+
+    def to_stack(self, dtype=np.float32):
+        """Scatters the records into a PixelStack, without any text decoding
+
+        :param dtype: stack dtype, defaults to np.float32
+        :type dtype: np.dtype, optional
+        :return: pixel maps, tables in order of first appearance
+        :rtype: models.PixelStack
+        """
+        from phdf import models
+
+        t_codes, tables = pd.factorize(self.table, sort=False)
+        if len(tables) and tables.max() >= len(self.names):
+            raise ValueError(f"table index out of range of {len(self.names)} names")
+        names = []
+        for i in tables:
+            sn, site, ch = self.names[i]
+            names.append(f"{site}_{sn}_{ch}")
+        stack = models.scatter_stack(
+            t_codes, names, self.row, self.col, self.value, dtype
+        )
+        return stack._replace(
+            rows=stack.rows.astype(np.int64), cols=stack.cols.astype(np.int64)
+        )
+
+
+class SegmentSource(NamedTuple):
+    """DevicePixelArray input, f"shm://{name}" or a .phsm filepath"""
+
+    source: str
+
+    @property
+    def is_shared_memory(self) -> bool:
+        return self.source.startswith(SHM_PREFIX)
+
+    @property
+    def stem(self) -> str:
+        if self.is_shared_memory:
+            return self.source[len(SHM_PREFIX) :].lstrip("/")
+        return Path(self.source).stem
+
+
+def get_names_block(names: Sequence[tuple[str, str, str]]) -> bytes:
+    data = json.dumps([list(x) for x in names]).encode()
+    return data + b"\0" * (-(HEADER.size + len(data)) % 8)
+
+
+def segment_nbytes(n_records: int, names: Sequence[tuple[str, str, str]]) -> int:
+    return HEADER.size + len(get_names_block(names)) + 20 * n_records
+
+
+def read_segment(buf) -> PixelSegment:
+    """Wraps the arrays of a segment with numpy.frombuffer, without copying
+
+    :param buf: segment memory, e.g. mmap or SharedMemory.buf
+    :type buf: bytes-like
+    :return: records viewing buf
+    :rtype: PixelSegment
+    """
+    magic, version, n, n_tables, names_nbytes = HEADER.unpack_from(buf, 0)
+    if magic != SEGMENT_MAGIC or version != SEGMENT_VERSION:
+        raise ValueError(f"not a {SEGMENT_MAGIC!r} v{SEGMENT_VERSION} segment")
+    offset = HEADER.size
+    names_block = bytes(buf[offset : offset + names_nbytes])
+    names = [tuple(x) for x in json.loads(names_block.rstrip(b"\0"))]
+    if len(names) != n_tables:
+        raise ValueError(f"{len(names)=} != {n_tables=}")
+    offset += names_nbytes
+    if len(buf) < offset + 20 * n:
+        raise ValueError(f"segment holds less than its {n} records")
+    value = np.frombuffer(buf, dtype="<f8", count=n, offset=offset)
+    offset += 8 * n
+    table, row, col = (
+        np.frombuffer(buf, dtype="<u4", count=n, offset=offset + 4 * n * i)
+        for i in range(3)
+    )
+    return PixelSegment(names, table, row, col, value)
+
+
+def write_segment(
+    buf,
+    names: Sequence[tuple[str, str, str]],
+    table: np.ndarray,
+    row: np.ndarray,
+    col: np.ndarray,
+    value: np.ndarray,
+) -> int:
+    """Reference writer, fills buf with one segment
+
+    :param buf: writable memory of at least segment_nbytes()
+    :type buf: bytes-like
+    :param names: (serialnumber, site, ch) per table
+    :type names: Sequence[tuple[str, str, str]]
+    :param table: index into names of every record
+    :type table: np.ndarray
+    :param row: row of every record
+    :type row: np.ndarray
+    :param col: col of every record
+    :type col: np.ndarray
+    :param value: value of every record
+    :type value: np.ndarray
+    :return: bytes written
+    :rtype: int
+    """
+    n = len(value)
+    names_block = get_names_block(names)
+    HEADER.pack_into(
+        buf, 0, SEGMENT_MAGIC, SEGMENT_VERSION, n, len(names), len(names_block)
+    )
+    offset = HEADER.size
+    buf[offset : offset + len(names_block)] = names_block
+    offset += len(names_block)
+    for array, dtype in ((value, "<f8"), (table, "<u4"), (row, "<u4"), (col, "<u4")):
+        out = np.frombuffer(buf, dtype=dtype, count=n, offset=offset)
+        out[:] = array
+        offset += out.nbytes
+        del out
+    return offset
+
+
+def write_segment_file(filepath: str | Path, *arrays) -> Path:
+    """Writes a segment into a memory-mapped file, see write_segment()"""
+    filepath = Path(filepath)
+    names, value = arrays[0], arrays[-1]
+    with open(filepath, "w+b") as f:
+        f.truncate(segment_nbytes(len(value), names))
+        with mmap.mmap(f.fileno(), 0) as mm:
+            write_segment(mm, *arrays)
+    return filepath
+
+
+def create_shared_segment(name: str, *arrays) -> shared_memory.SharedMemory:
+    """Writes a segment into a new POSIX shared memory block
+
+    The caller owns the block: close() and unlink() it once PHDF is done.
+
+    :param name: block name, PHDF reads it from f"shm://{name}"
+    :type name: str
+    :return: the shared memory block
+    :rtype: shared_memory.SharedMemory
+    """
+    names, value = arrays[0], arrays[-1]
+    size = segment_nbytes(len(value), names)
+    shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+    write_segment(shm.buf, *arrays)
+    return shm
+
+
+def attach_shared_memory(name: str) -> shared_memory.SharedMemory:
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    shm = shared_memory.SharedMemory(name=name)
+    # attaching registers the block too, which would unlink it on exit
+    resource_tracker.unregister(shm._name, "shared_memory")  # type: ignore
+    return shm
+
+
+def read_segment_stack(source: str | Path, dtype=np.float32):
+    """Builds the pixel maps of a shared memory block or segment file
+
+    :param source: f"shm://{name}" or a .phsm filepath
+    :type source: str | Path
+    :param dtype: stack dtype, defaults to np.float32
+    :type dtype: np.dtype, optional
+    :return: pixel maps and number of records
+    :rtype: tuple[models.PixelStack, int]
+    """
+    source = str(source)
+    if source.startswith(SHM_PREFIX):
+        shm = attach_shared_memory(source[len(SHM_PREFIX) :])
+        try:
+            segment = read_segment(shm.buf)
+            n_records = len(segment)
+            stack = segment.to_stack(dtype)
+            del segment  # views must be released before closing
+        finally:
+            shm.close()
+        return stack, n_records
+
+    with open(source, "rb") as f, mmap.mmap(
+        f.fileno(), 0, access=mmap.ACCESS_READ
+    ) as mm:
+        segment = read_segment(mm)
+        n_records = len(segment)
+        stack = segment.to_stack(dtype)
+        del segment
+    return stack, n_records
+
+
+def arrays_from_records(records) -> tuple:
+    """Test harness, turns parsed text records into segment arrays
+
+    :param records: e.g. parsers.scan_file() of a testfilewriter file
+    :type records: parsers.ColumnarRecords
+    :return: names, table, row, col, value, as write_segment() takes them
+    :rtype: tuple
+    """
+    from phdf import models
+
+    df = records.to_frame()
+    row, col = models.decode_coords(df["coord"])
+    valid = row >= 0
+    df = df[valid]
+    keys = pd.MultiIndex.from_arrays(
+        [df["serialnumber"].astype(str), df["site"].astype(str), df["ch"].astype(str)]
+    )
+    table, uniques = pd.factorize(keys, sort=False)
+    return (
+        [tuple(x) for x in uniques],
+        table.astype(np.uint32),
+        row[valid].astype(np.uint32),
+        col[valid].astype(np.uint32),
+        df["value"].to_numpy(dtype=np.float64),
+    )
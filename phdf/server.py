@@ -0,0 +1,227 @@
+import base64
+import contextlib
+import io
+import json
+import logging
+import os
+import socket
+import socketserver
+import stat
+import sys
+import threading
+from pathlib import Path
+from typing import Any
+
+from phdf import main, utils
+
+log = utils.setup_logger()
+
+REQUEST_OPTIONS = (
+    "skip_cleanup",
+    "measure_timing",
+    "layout",
+    "compression",
+    "max_memory_mb",
+    "parse_jobs",
+    "metrics_path",
+    "incremental",
+    "pipeline",
+    "pipeline_queue_size",
+    "precision",
+    "sparse_density",
+)
+
+
+class LogCapture(logging.Handler):
+    """Collects the log records of one request, to be replayed by the client"""
+
+    def __init__(self):
+        super().__init__(level=logging.DEBUG)
+        self.records: list[tuple[int, str]] = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.records.append((record.levelno, record.getMessage()))
+
+
+class ConversionHandler(socketserver.StreamRequestHandler):
+    """Handles one JSON line request per connection
+
+    Request: {"data_input": ..., "output_dir": ..., "skip_cleanup": ..., ...}
+    or {"command": "ping" | "shutdown"}; data_input "-" comes with the
+    client's stdin bytes, base64 encoded, as "stdin"
+    Response: {"exit_code": int, "log": [[levelno, message], ...]}
+    """
+
+    def handle(self) -> None:
+        try:
+            request = json.loads(self.rfile.readline())
+            response = self.server.dispatch(request)  # type: ignore
+        except Exception as e:
+            log.error(f"{e=}")
+            response = {"exit_code": 1, "log": [[logging.ERROR, f"{e=}"]]}
+        self.wfile.write(json.dumps(response).encode() + b"\n")
+
+
+class PhdfServer(socketserver.UnixStreamServer):
+    """Long-running PHDF worker listening on a Unix domain socket
+
+    Conversions run in-process, one at a time, so the interpreter startup
+    and the pandas/numpy/tables imports are paid once, not per call. The
+    socket is only accessible to its owner (mode 0600): requests choose the
+    paths the server writes to.
+    """
+
+    def __init__(self, socket_path: str | Path):
+        self.socket_path = Path(socket_path)
+        remove_stale_socket(self.socket_path)
+        super().__init__(str(self.socket_path), ConversionHandler)
+
+    def server_bind(self) -> None:
+        umask = os.umask(0o177)  # the socket is created with mode 0600
+        try:
+            super().server_bind()
+        finally:
+            os.umask(umask)
+
+    def dispatch(self, request: dict[str, Any]) -> dict[str, Any]:
+        match request.get("command", "convert"):
+            case "ping":
+                return {"exit_code": 0, "log": [], "pid": os.getpid()}
+            case "shutdown":
+                threading.Thread(target=self.shutdown, daemon=True).start()
+                return {"exit_code": 0, "log": [[logging.INFO, "server stopping"]]}
+            case "convert":
+                return self.convert(request)
+            case command:
+                raise NotImplementedError(f"{command=}")
+
+    def convert(self, request: dict[str, Any]) -> dict[str, Any]:
+        capture = LogCapture()
+        log.addHandler(capture)
+        stderr = io.StringIO()  # metrics_path="-" is sent back to the client
+        try:
+            options = {k: request[k] for k in REQUEST_OPTIONS if k in request}
+            if request["data_input"] == "-":
+                if "stdin" not in request:
+                    raise ValueError("the server has no stdin, send the data instead")
+                options["stdin"] = io.BytesIO(base64.b64decode(request["stdin"]))
+            if options.get("compression"):
+                options["compression"] = utils.Compression(*options["compression"])
+            match options.get("precision"):
+                case str() as spec:  # e.g. from the Java client
+                    options["precision"] = utils.Precision.from_spec(spec)
+                case [default, channels]:
+                    options["precision"] = utils.Precision(
+                        default, tuple(tuple(x) for x in channels)
+                    )
+            with contextlib.redirect_stderr(stderr):
+                exit_code = main.launcher(
+                    request["data_input"], request["output_dir"], **options
+                )
+        except Exception as e:
+            log.error(f"{e=}")
+            exit_code = 1
+        finally:
+            log.removeHandler(capture)
+        return {
+            "exit_code": exit_code,
+            "log": capture.records,
+            "metrics": stderr.getvalue().splitlines(),
+        }
+
+    def server_close(self) -> None:
+        super().server_close()
+        self.socket_path.unlink(missing_ok=True)
+
+
+def remove_stale_socket(socket_path: Path) -> None:
+    """Removes a socket left behind by a server that is gone
+
+    :param socket_path: Unix domain socket path
+    :type socket_path: Path
+    :raises FileExistsError: the path is not a socket, or a server is still
+        listening on it
+    """
+    try:
+        mode = socket_path.lstat().st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise FileExistsError(f"{socket_path} exists and is not a socket")
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(str(socket_path))
+        except ConnectionRefusedError:
+            socket_path.unlink()
+            return
+    raise FileExistsError(f"a server is already listening on {socket_path}")
+
+
+def serve(socket_path: str | Path) -> int:
+    main.import_models()  # pays the pandas/numpy/tables imports once, up front
+    try:
+        phdf_server = PhdfServer(socket_path)
+    except FileExistsError as e:
+        log.error(f"cannot serve: {e}")
+        return 1
+    with phdf_server as server:
+        log.info(f"serving on {server.socket_path} (pid={os.getpid()})")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            log.info("interrupted")
+    return 0
+
+
+def request(socket_path: str | Path, payload: dict[str, Any]) -> dict[str, Any]:
+    """Sends one request to a running server and returns its response
+
+    :param socket_path: Unix domain socket of the server
+    :type socket_path: str | Path
+    :param payload: request, see ConversionHandler
+    :type payload: dict[str, Any]
+    :return: response
+    :rtype: dict[str, Any]
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(str(socket_path))
+        sock.sendall(json.dumps(payload).encode() + b"\n")
+        with sock.makefile("rb") as f:
+            return json.loads(f.readline())
+
+
+def client(socket_path: str | Path, data_input: str, output_dir: str, **options) -> int:
+    """Runs a conversion on the server, replaying its log lines locally
+
+    Falls back to converting in this process when no server is listening.
+
+    :return: exit code
+    :rtype: int
+    """
+    stdin = None
+    if data_input == "-":  # sent as bytes, any format incl. binary PHDB
+        stdin = sys.stdin.buffer.read()
+    elif main.is_input_file(data_input) or (
+        main.is_segment(data_input) and not data_input.startswith(utils.SHM_PREFIX)
+    ):
+        data_input = str(Path(data_input).resolve())  # server has its own cwd
+    if options.get("metrics_path") not in (None, "-"):
+        options["metrics_path"] = str(Path(options["metrics_path"]).resolve())
+    payload = {
+        "data_input": data_input,
+        "output_dir": str(Path(output_dir).resolve()),
+        **options,
+    }
+    if stdin is not None:
+        payload["stdin"] = base64.b64encode(stdin).decode("ascii")
+        options["stdin"] = io.BytesIO(stdin)  # for the local fallback
+    try:
+        response = request(socket_path, payload)
+    except (FileNotFoundError, ConnectionRefusedError) as e:
+        log.warning(f"no server on {socket_path} ({e.strerror}), running locally")
+        return main.launcher(data_input, output_dir, **options)
+    for levelno, message in response["log"]:
+        log.log(levelno, message)
+    for line in response.get("metrics", []):
+        print(line, file=sys.stderr, flush=True)
+    return response["exit_code"]
@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+
+from phdf import precision
+
+# HDF5 attributes of a table stored as a coordinate list
+SPARSE_ATTR = "phdf_sparse"
+ROWS_ATTR = "phdf_rows"
+COLS_ATTR = "phdf_cols"
+
+
+def density(df: pd.DataFrame) -> float:
+    """Fraction of the pixels of a map holding a value"""
+    values = df.to_numpy()
+    if not values.size:
+        return 1.0
+    return np.count_nonzero(~np.isnan(values)) / values.size
+
+
+def to_coo(df: pd.DataFrame) -> tuple[pd.Series, dict[str, np.ndarray | str]]:
+    """Converts a pixel map into its coordinate list
+
+    Only the pixels holding a value are kept, indexed by their row-major
+    position in the map, row_pos * len(cols) + col_pos. A Series keeps the
+    stored node to one index and one value array.
+
+    :param df: pixel map
+    :type df: pd.DataFrame
+    :return: values by position, and the node attributes to store with them
+        (the row and col labels of the map)
+    :rtype: tuple[pd.Series, dict[str, np.ndarray | str]]
+    """
+    values = df.to_numpy().reshape(-1)
+    pos = np.flatnonzero(~np.isnan(values))
+    coo = pd.Series(
+        values[pos],
+        index=pd.Index(
+            pos.astype(np.min_scalar_type(max(len(values) - 1, 0))), name="pos"
+        ),
+        name="value",
+    )
+    attrs = {
+        SPARSE_ATTR: "coo",
+        ROWS_ATTR: df.index.to_numpy(),
+        COLS_ATTR: df.columns.to_numpy(),
+    }
+    return coo, attrs
+
+
+def to_dense(coo: pd.Series, rows: np.ndarray, cols: np.ndarray) -> pd.DataFrame:
+    """Rebuilds the pixel map of a coordinate list, NaN for missing pixels"""
+    values = coo.to_numpy()
+    plane = np.full(len(rows) * len(cols), np.nan, dtype=values.dtype)
+    plane[coo.index.to_numpy()] = values
+    return pd.DataFrame(
+        plane.reshape(len(rows), len(cols)),
+        index=pd.Index(rows, name="row"),
+        columns=pd.Index(cols, name="col"),
+    )
+
+
+def decode_table(obj: pd.DataFrame | pd.Series, attrs) -> pd.DataFrame:
+    """Pixel map of a table read back from HDF5, attrs being its node attributes
+
+    Quantized values are decoded, coordinate lists rebuilt into dense maps.
+    """
+    if SPARSE_ATTR not in attrs:
+        return precision.decode_frame(obj, attrs)
+    values = precision.decode_frame(obj.to_frame(), attrs).iloc[:, 0]
+    return to_dense(values, getattr(attrs, ROWS_ATTR), getattr(attrs, COLS_ATTR))
+
+
+def get_shape(attrs) -> tuple[int, int] | None:
+    """(rows, cols) of the pixel map of a coordinate list, None if stored dense"""
+    if SPARSE_ATTR not in attrs:
+        return None
+    return len(getattr(attrs, ROWS_ATTR)), len(getattr(attrs, COLS_ATTR))
+
+
+def to_coordinates(df: pd.DataFrame) -> pd.DataFrame:
+    """Pixels of a map holding a value, as row, col and value columns"""
+    values = df.to_numpy()
+    r, c = np.nonzero(~np.isnan(values))
+    return pd.DataFrame(
+        {
+            "row": df.index.to_numpy()[r],
+            "col": df.columns.to_numpy()[c],
+            "value": values[r, c],
+        }
+    )
@@ -1,12 +1,34 @@
 from __future__ import annotations
+import fnmatch
 import time
+import json
 import logging
-from typing import Optional
+from contextlib import contextmanager
+from typing import Any, Iterator, NamedTuple, Optional
 from pathlib import Path
 import platform
 import subprocess
+import sys
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
 
 APP_NAME = "phdf"
+CODECS = ("zlib", "blosc:lz4", "blosc:zstd", "none")
+LAYOUTS = ("tables", "stacked")
+# HDF5 nodes of an output file next to the pixel maps
+STACK_GROUP = "/stack"
+META_GROUP = "/_phdf"  # PHDF bookkeeping, not pixel maps
+SUMMARY_KEY = f"{META_GROUP}/summary"
+MANIFEST_KEY = f"{META_GROUP}/manifest"
+PRECISION_KEY = f"{META_GROUP}/precision"
+# zero-copy inputs, see segments.py
+SHM_PREFIX = "shm://"
+SEGMENT_SUFFIX = ".phsm"
+# value storage, "q": scale/offset quantized integers, see precision.py
+PRECISIONS = ("float64", "float32", "float16", "int16q", "int32q")
 
 
 class PtConfigError(ValueError):
@@ -125,6 +147,163 @@ def get_time(datetimestrformat: str = "%Y%m%d_%H%M%S"):
     return time.strftime(datetimestrformat, time.localtime(time.time()))
 
 
+class StageTimer:
+    """Wall-clock time per pipeline stage, in seconds"""
+
+    def __init__(self):
+        self.laps: dict[str, float] = {}
+        self.restart()
+
+    def restart(self) -> None:
+        self.start_time = time.perf_counter()
+
+    def lap(self, stage: str) -> float:
+        """Records the time since the previous lap (or restart) under stage"""
+        now = time.perf_counter()
+        elapsed = self.laps[stage] = now - self.start_time
+        self.start_time = now
+        return elapsed
+
+
+def get_peak_rss_mb() -> Optional[float]:
+    """Peak resident memory of this process so far, None where unsupported"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / 2**20 if sys.platform == "darwin" else peak / 2**10, 1)
+
+
+class Metrics:
+    """Wall time, throughput and peak memory per stage of one conversion
+
+    peak_rss_mb is the process high-water mark at the end of a stage, so
+    the stage where it jumps is the one that allocated the memory.
+    """
+
+    def __init__(self):
+        self.start_time = time.perf_counter()
+        self.stages: dict[str, dict[str, Any]] = {}
+        self.table_writes: dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[dict[str, Any]]:
+        """Times the block; "records" and "bytes" may be set on the yielded dict"""
+        entry: dict[str, Any] = {}
+        start_time = time.perf_counter()
+        try:
+            yield entry
+        finally:
+            wall_s = time.perf_counter() - start_time
+            entry["wall_s"] = round(wall_s, 6)
+            if entry.get("records"):
+                entry["records_per_s"] = round(entry["records"] / max(wall_s, 1e-9))
+            entry["peak_rss_mb"] = get_peak_rss_mb()
+            self.stages[name] = entry
+
+    def to_record(self, **fields: Any) -> dict[str, Any]:
+        return {
+            "event": "phdf_metrics",
+            **fields,
+            "total_s": round(time.perf_counter() - self.start_time, 6),
+            "peak_rss_mb": get_peak_rss_mb(),
+            "stages": self.stages,
+            "table_writes": self.table_writes,
+        }
+
+    def emit(self, path: str | Path, **fields: Any) -> None:
+        """Writes the metrics as one JSON line to path, "-" being stderr"""
+        line = json.dumps(self.to_record(**fields))
+        if str(path) == "-":
+            print(line, file=sys.stderr, flush=True)
+        else:
+            with open(path, "a") as f:
+                f.write(line + "\n")
+
+
+class Compression(NamedTuple):
+    """HDF5 compression settings, codec is one of CODECS"""
+
+    codec: str = "zlib"
+    level: int = 3
+    shuffle: bool = True
+
+    @property
+    def complevel(self) -> int:
+        return 0 if self.codec == "none" else self.level
+
+    @property
+    def complib(self) -> Optional[str]:
+        return None if self.codec == "none" else self.codec
+
+    @property
+    def tag(self) -> str:
+        """e.g. "cp3" for zlib level 3, "blosc-lz4-cp5" for blosc:lz4 level 5"""
+        if self.codec in ("zlib", "none"):
+            return f"cp{self.complevel}"
+        return f"{self.codec.replace(':', '-')}-cp{self.complevel}"
+
+
+class Precision(NamedTuple):
+    """Value storage schema: a default precision, overridden per channel
+
+    channels holds (glob on the channel, precision) pairs, the first match
+    wins. Every precision is one of PRECISIONS.
+    """
+
+    default: str = "float32"
+    channels: tuple[tuple[str, str], ...] = ()
+
+    @classmethod
+    def from_spec(cls, spec: str) -> Precision:
+        """Parses e.g. "float32" or "float32,aTB_*=int16q,vref=float64"
+
+        :param spec: comma separated default precision and channel=precision
+            overrides, in any order
+        :type spec: str
+        :raises ValueError: on an unknown precision
+        :return: schema
+        :rtype: Precision
+        """
+        default = "float32"
+        channels = []
+        for item in spec.split(","):
+            pattern, _, precision = item.strip().rpartition("=")
+            if precision not in PRECISIONS:
+                raise ValueError(f"{precision=} is not one of {PRECISIONS}")
+            if pattern:
+                channels.append((pattern, precision))
+            else:
+                default = precision
+        return cls(default, tuple(channels))
+
+    @property
+    def precisions(self) -> set[str]:
+        return {self.default, *(x for _, x in self.channels)}
+
+    def get(self, name: str) -> str:
+        """Precision of a "site_serialnumber_ch" table"""
+        channel = name.rsplit("/", 1)[-1].split("_", 2)[-1]
+        for pattern, precision in self.channels:
+            if fnmatch.fnmatchcase(channel, pattern):
+                return precision
+        return self.default
+
+
+def get_output_name(stem: str, compression: Optional[Compression] = None) -> str:
+    """Returns the .h5 output filename for an input stem
+
+    :param stem: input file stem, or "nil-<time>" for JSON strings
+    :type stem: str
+    :param compression: compression settings, defaults to None (zlib, level 3)
+    :type compression: Compression, optional
+    :return: output filename
+    :rtype: str
+    """
+    if compression is None:
+        compression = Compression()
+    return f"{stem}-{compression.tag}.h5"
+
+
 def get_python_path() -> str:
     python_path = Path(".")
     current_os = platform.system()
@@ -158,6 +337,39 @@ def get_python_path() -> str:
     return str(python_path.absolute())
 
 
+def import_times(statement: str = "import phdf.models") -> list[tuple[str, int, int]]:
+    """Runs the statement in a fresh interpreter with `-X importtime`
+
+    :param statement: python code to time, defaults to "import phdf.models"
+    :type statement: str, optional
+    :return: (module, self [us], cumulative [us]), slowest cumulative first
+    :rtype: list[tuple[str, int, int]]
+    """
+    p0 = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        capture_output=True,
+        cwd=Path(__file__).parent.parent,
+    )
+    results = []
+    for line in p0.stderr.decode("utf-8").splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, module = line.split(":", 1)[1].split("|")
+        results.append((module.strip(), int(self_us), int(cumulative_us)))
+    return sorted(results, key=lambda x: x[2], reverse=True)
+
+
+def log_startup_report(top: int = 10) -> None:
+    """Logs the slowest imports of the CLI startup and of a conversion"""
+    log = setup_logger()
+    for label, module in [("startup", "cli"), ("conversion", "phdf.models")]:
+        results = import_times(f"import {module}")
+        total_us = next((c for m, _, c in results if m == module), 0)
+        log.info(f"{label} ({module}): {total_us / 1e6:.4f}s cumulative imports")
+        for module, self_us, cumulative_us in results[:top]:
+            log.info(f"  {cumulative_us / 1e6:8.4f}s {self_us / 1e6:8.4f}s  {module}")
+
+
 if __name__ == "__main__":
     # test_logger()
     test_file_manager()
@@ -1,29 +1,246 @@
 import pandas as pd
 import numpy as np
 from pathlib import Path
+import fnmatch
 import random
+from collections import OrderedDict
+from typing import Iterable, Iterator, Optional
+import tables
 
 APP_NAME = "phdf"
 # local libraries
 if __name__.startswith(APP_NAME):
-    from . import utils
+    from . import parsers, precision, sparse, utils
 else:
+    import parsers
+    import precision
+    import sparse
     import utils
 
 
 def read_hdf5_file(filepath: str):
     print(f"reading {filepath=}")
-    store = pd.HDFStore(filepath)
-    dflist = []
-    for k in store.keys():
-        df = store.get(k)
-        print(f"{k=}: {df.shape=}")
-        dflist.append(df)
-    print("printing a random df:")
-    df = random.choice(dflist)
+    with PixelMapReader(filepath) as reader:
+        for k, shape in reader.info().items():
+            print(f"{k=}: {shape=}")
+        print("printing a random df:")
+        df = reader.get(random.choice(reader.names))
     print(df)
 
 
+class PixelMapReader:
+    """Lazy reader of PHDF outputs, either layout
+
+    Table names and shapes come from the HDF5 metadata; a table is only read
+    from disk when requested. Recently used tables are kept in an LRU cache
+    of up to cache_mb, tables larger than that are returned without caching.
+    Tables stored as coordinate lists are returned as dense maps too.
+
+    with PixelMapReader("lot.h5") as reader:
+        for name in reader.select(site="site1", channel="aTB_*"):
+            df = reader.get(name)
+    """
+
+    def __init__(self, filepath: str | Path, cache_mb: float = 256.0):
+        self.filepath = Path(filepath)
+        self.store = pd.HDFStore(self.filepath, mode="r")
+        self.cache: OrderedDict[str, pd.DataFrame] = OrderedDict()
+        self.cache_budget = int(cache_mb * 2**20)
+        self.cache_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.stack = self.store.get_node(utils.STACK_GROUP)
+        if self.stack is not None:
+            self.layout = "stacked"
+            self.names = [x.decode() for x in self.stack.table_names.read()]
+            self.rows = pd.Index(self.stack.row_labels.read(), name="row")
+            self.cols = pd.Index(self.stack.col_labels.read(), name="col")
+        else:
+            self.layout = "tables"
+            self.names = [
+                k.lstrip("/")
+                for k in self.store.keys()
+                if not k.startswith(f"{utils.META_GROUP}/")
+            ]
+
+    def __enter__(self) -> "PixelMapReader":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.names
+
+    def __getitem__(self, name: str) -> pd.DataFrame:
+        return self.get(name)
+
+    def close(self) -> None:
+        self.cache.clear()
+        self.cache_bytes = 0
+        self.store.close()
+
+    def shape(self, name: str) -> tuple[int, int]:
+        """(rows, cols) of a table, from metadata; stacked planes are not trimmed"""
+        if self.layout == "stacked":
+            return tuple(self.stack.values.shape[1:])
+        storer = self.store.get_storer(name)
+        return sparse.get_shape(storer.attrs) or tuple(storer.shape)
+
+    def info(self) -> dict[str, tuple[int, int]]:
+        return {name: self.shape(name) for name in self.names}
+
+    def summary(self, where: Optional[str] = None) -> pd.DataFrame:
+        """Per-table statistics from the summary index, without reading tables
+
+        :param where: HDFStore.select() query, defaults to None (all tables),
+            e.g. "site == 'site2' & mean > 0.5"
+        :type where: str, optional
+        :return: one row per table, see models.SUMMARY_COLUMNS
+        :rtype: pd.DataFrame
+        """
+        if utils.SUMMARY_KEY not in self.store:
+            raise KeyError(f"{self.filepath.name} has no summary index")
+        return self.store.select(utils.SUMMARY_KEY, where=where)
+
+    def precision_loss(self) -> pd.DataFrame:
+        """Per-table precision and loss, for outputs written with a precision schema"""
+        if utils.PRECISION_KEY not in self.store:
+            raise KeyError(f"{self.filepath.name} has no precision report")
+        return self.store.select(utils.PRECISION_KEY)
+
+    def select(
+        self,
+        pattern: Optional[str] = None,
+        site: str = "*",
+        part: str = "*",
+        channel: str = "*",
+    ) -> list[str]:
+        """Names of the tables matching a glob pattern, or site/part/channel
+
+        :param pattern: glob on the full name, defaults to None
+            (f"{site}_{part}_{channel}" on the name's last path component)
+        :type pattern: str, optional
+        :param site: site glob, defaults to "*"
+        :type site: str, optional
+        :param part: serialnumber glob, defaults to "*"
+        :type part: str, optional
+        :param channel: channel glob, defaults to "*"
+        :type channel: str, optional
+        :return: matching names, in file order
+        :rtype: list[str]
+        """
+        if pattern is not None:
+            return [x for x in self.names if fnmatch.fnmatchcase(x, pattern)]
+        pattern = f"{site}_{part}_{channel}"
+        return [
+            x for x in self.names if fnmatch.fnmatchcase(x.rsplit("/", 1)[-1], pattern)
+        ]
+
+    def get(self, name: str) -> pd.DataFrame:
+        """Returns a table, from the cache or read from disk"""
+        if name in self.cache:
+            self.hits += 1
+            self.cache.move_to_end(name)
+            return self.cache[name]
+        self.misses += 1
+        df = self.read(name)
+        self.add_to_cache(name, df)
+        return df
+
+    def iter_tables(self, names: Iterable[str]) -> Iterator[tuple[str, pd.DataFrame]]:
+        for name in names:
+            yield name, self.get(name)
+
+    def read(self, name: str) -> pd.DataFrame:
+        if name not in self.names:
+            raise KeyError(name)
+        if self.layout == "stacked":
+            plane = read_plane(self.stack, self.names.index(name))
+            return plane_to_frame(plane, self.rows, self.cols)
+        df = self.store.get(name)
+        return sparse.decode_table(df, self.store.get_storer(name).attrs)
+
+    def coordinates(self, name: str) -> pd.DataFrame:
+        """Pixels of a table holding a value, as row, col and value columns"""
+        return sparse.to_coordinates(self.get(name))
+
+    def is_sparse(self, name: str) -> bool:
+        """Whether a table is stored as a coordinate list, from metadata"""
+        if self.layout == "stacked":
+            return False
+        return sparse.SPARSE_ATTR in self.store.get_storer(name).attrs
+
+    def add_to_cache(self, name: str, df: pd.DataFrame) -> None:
+        nbytes = int(df.memory_usage(index=True).sum())
+        if nbytes > self.cache_budget:
+            return
+        while self.cache and self.cache_bytes + nbytes > self.cache_budget:
+            _, evicted = self.cache.popitem(last=False)
+            self.cache_bytes -= int(evicted.memory_usage(index=True).sum())
+        self.cache[name] = df
+        self.cache_bytes += nbytes
+
+
+def read_plane(group: tables.Group, i: int) -> np.ndarray:
+    """Plane i of a stacked layout, quantized values decoded"""
+    plane = group.values[i]
+    if "scales" not in group:
+        return plane
+    encoded = precision.Encoded(
+        plane,
+        getattr(group._v_attrs, precision.PRECISION_ATTR),
+        float(group.scales[i]),
+        float(group.offsets[i]),
+    )
+    return precision.decode(encoded)
+
+
+def plane_to_frame(plane: np.ndarray, rows: pd.Index, cols: pd.Index) -> pd.DataFrame:
+    """Drops the rows and cols without any value, like layout="tables" """
+    present = ~np.isnan(plane)
+    row_mask = present.any(axis=1)
+    col_mask = present.any(axis=0)
+    return pd.DataFrame(
+        plane[np.ix_(row_mask, col_mask)],
+        index=rows[row_mask],
+        columns=cols[col_mask],
+    )
+
+
+def read_stacked_hdf5_file(
+    filepath: str | Path, names: Optional[list[str]] = None
+) -> dict[str, pd.DataFrame]:
+    """Reads pixel maps written with layout="stacked"
+
+    Only the planes of the requested tables are read from disk. Rows and
+    cols without any value in a table are dropped, so each frame matches
+    the one written with layout="tables".
+
+    :param filepath: .h5 file
+    :type filepath: str | Path
+    :param names: tables to read, defaults to None (all tables)
+    :type names: list[str], optional
+    :return: pixel map per table name
+    :rtype: dict[str, pd.DataFrame]
+    """
+    with tables.open_file(filepath, mode="r") as h5:
+        group = h5.get_node(utils.STACK_GROUP)
+        all_names = [x.decode() for x in group.table_names.read()]
+        rows = pd.Index(group.row_labels.read(), name="row")
+        cols = pd.Index(group.col_labels.read(), name="col")
+        if names is None:
+            names = all_names
+        dfs = {}
+        for name in names:
+            plane = read_plane(group, all_names.index(name))
+            dfs[name] = plane_to_frame(plane, rows, cols)
+    return dfs
+
+
 def generate_pixel_array(
     n_row: int, n_col: int, use_str_col: bool = False
 ) -> pd.DataFrame:
@@ -37,6 +254,64 @@ def generate_pixel_array(
     return df
 
 
+def generate_testfilewriter_file(
+    outname: str | Path,
+    n_parts: int = 1,
+    n_sites: int = 2,
+    n_channels: int = 10,
+    n_rows: int = 40,
+    n_cols: int = 64,
+    missing: float = 0.0,
+    seed: Optional[int] = None,
+    fmt: str = "json",
+) -> Path:
+    """Writes a synthetic testfilewriter input file, as the TestProgram would
+
+    Records are written part by part, then coord, site and channel, with
+    normally distributed values. Each (part, coord) die is left out with
+    probability `missing`, like pixels that were never tested.
+
+    :param outname: .txt, .csv or .phdb filepath
+    :type outname: str | Path
+    :param n_parts: number of serialnumbers, "partId1", ...
+    :type n_parts: int, optional
+    :param n_sites: number of sites, "site1", ...
+    :type n_sites: int, optional
+    :param n_channels: number of channels, "aTB_0", ...
+    :type n_channels: int, optional
+    :param n_rows: grid rows
+    :type n_rows: int, optional
+    :param n_cols: grid cols
+    :type n_cols: int, optional
+    :param missing: fraction of missing pixels, 0-1, defaults to 0.0
+    :type missing: float, optional
+    :param seed: random seed, defaults to None
+    :type seed: int, optional
+    :param fmt: one of parsers.FORMATS, defaults to "json"
+    :type fmt: str, optional
+    :return: filepath written
+    :rtype: Path
+    """
+    filepath = Path(outname)
+    rng = np.random.default_rng(seed)
+    width = max(2, len(str(max(n_rows, n_cols) - 1)))
+    coords = [
+        f"R{r:0{width}d}C{c:0{width}d}" for r in range(n_rows) for c in range(n_cols)
+    ]
+    channels = [f"aTB_{k}" for k in range(n_channels)]
+    with open(filepath, "wb") as f, parsers.RecordWriter(f, fmt) as writer:
+        for part in range(1, n_parts + 1):
+            present = rng.random(len(coords)) >= missing
+            values = rng.normal(0, 1, size=(len(coords), n_sites, n_channels))
+            for i in np.flatnonzero(present):
+                writer.write(
+                    (f"partId{part}", coords[i], f"site{site + 1}", ch, f"{value:.4f}")
+                    for site in range(n_sites)
+                    for ch, value in zip(channels, values[i, site])
+                )
+    return filepath
+
+
 def generate_sample_file(outname: str = "output.csv", mode: str = "csv"):
     filepath = Path(outname)
     mode = filepath.suffix
@@ -44,6 +319,8 @@ def generate_sample_file(outname: str = "output.csv", mode: str = "csv"):
         case ".csv":
             df = generate_pixel_array(40, 64)
             df.to_csv(filepath)
+        case ".txt":
+            generate_testfilewriter_file(filepath)
         case _:
             raise NotImplementedError(f"{mode=}")
 
@@ -51,4 +328,4 @@ def generate_sample_file(outname: str = "output.csv", mode: str = "csv"):
 if __name__ == "__main__":
 
     some_filepath = "nil-20230606_201824-cp3.h5"
-    read_hdf5_file(utils.FileManager().get_resource_file(some_filepath)) # type: ignore
+    read_hdf5_file(utils.FileManager().get_resource_file(some_filepath))  # type: ignore
@@ -0,0 +1,147 @@
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Optional
+
+from phdf import batch, main, utils
+
+log = utils.setup_logger()
+
+
+class DirectoryWatcher:
+    """Converts input files as they are completed in a watched directory
+
+    Files with one of suffixes are watched, by default main.INPUT_SUFFIXES as
+    in batch.collect_inputs(). A file counts as completed once its size and
+    mtime have not changed for settle_time seconds. Completed files are queued
+    to a pool of worker processes that have already imported the libraries. At
+    most jobs + queue_size files are in flight; further files wait in the
+    directory until there is room. Every file is converted exactly once per
+    watcher, and files whose output already exists are skipped on startup.
+    """
+
+    def __init__(
+        self,
+        input_dir: str | Path,
+        output_dir: str,
+        jobs: int = 1,
+        queue_size: int = 8,
+        poll_interval: float = 0.2,
+        settle_time: float = 0.5,
+        suffixes: tuple[str, ...] = main.INPUT_SUFFIXES,
+        **options: Any,
+    ):
+        self.input_dir = Path(input_dir)
+        self.output_dir = output_dir
+        self.jobs = max(1, jobs)
+        self.poll_interval = poll_interval
+        self.settle_time = settle_time
+        self.suffixes = suffixes
+        self.options = options
+        self.seen: set[Path] = set()
+        self.pending: dict[Path, tuple[int, int, float]] = {}
+        self.slots = threading.BoundedSemaphore(self.jobs + queue_size)
+        self.n_ok = 0
+        self.n_failed = 0
+        self._lock = threading.Lock()
+
+    def list_inputs(self) -> list[Path]:
+        return sorted(
+            x for x in self.input_dir.iterdir() if x.suffix.lower() in self.suffixes
+        )
+
+    def skip_converted(self) -> None:
+        for fp in self.list_inputs():
+            outname = utils.get_output_name(fp.stem, self.options.get("compression"))
+            if (Path(self.output_dir) / outname).is_file():
+                self.seen.add(fp)
+        if self.seen:
+            log.info(f"skipping {len(self.seen)} files already converted")
+
+    def poll(self) -> list[Path]:
+        """Returns the files that have been completed since the last poll"""
+        now = time.monotonic()
+        completed = []
+        for fp in self.list_inputs():
+            if fp in self.seen:
+                continue
+            try:
+                stat = fp.stat()
+            except FileNotFoundError:
+                self.pending.pop(fp, None)
+                continue
+            signature = (stat.st_size, stat.st_mtime_ns)
+            previous = self.pending.get(fp)
+            if previous is None or previous[:2] != signature:
+                self.pending[fp] = (*signature, now)
+            elif stat.st_size > 0 and now - previous[2] >= self.settle_time:
+                completed.append(fp)
+        return completed
+
+    def is_writing(self) -> bool:
+        """Whether a pending file may still be completed
+
+        Files that stayed empty for settle_time are left out, so an empty file
+        does not keep the watcher from going idle. They stay pending and are
+        picked up once written to.
+        """
+        now = time.monotonic()
+        return any(
+            size > 0 or now - since < self.settle_time
+            for size, _, since in self.pending.values()
+        )
+
+    def on_done(self, future: Future) -> None:
+        self.slots.release()
+        try:
+            result: batch.BatchResult = future.result()
+        except Exception as e:
+            result = batch.BatchResult(Path("?"), False, 0.0, f"{e=}")
+        with self._lock:
+            if result.ok:
+                self.n_ok += 1
+                log.info(f"ok {result.input_file.name} ({result.elapsed:.4f}s)")
+            else:
+                self.n_failed += 1
+                log.error(f"failed {result.input_file.name}: {result.error}")
+
+    def run(self, idle_timeout: Optional[float] = None) -> int:
+        """Watches until interrupted, or until idle for idle_timeout seconds
+
+        :param idle_timeout: seconds without new files before returning,
+            defaults to None (watch forever)
+        :type idle_timeout: float, optional
+        :return: exit code, 1 if any file failed
+        :rtype: int
+        """
+        self.skip_converted()
+        suffixes = ", ".join(self.suffixes)
+        log.info(f"watching {self.input_dir} for {suffixes}, jobs={self.jobs}")
+        last_activity = time.monotonic()
+        with ProcessPoolExecutor(
+            max_workers=self.jobs, initializer=main.import_models
+        ) as executor:
+            try:
+                while True:
+                    for fp in self.poll():
+                        if not self.slots.acquire(blocking=False):
+                            break  # queue is full, picked up again next poll
+                        self.seen.add(fp)
+                        self.pending.pop(fp, None)
+                        log.info(f"queued {fp.name}")
+                        future = executor.submit(
+                            batch.convert_file, fp, self.output_dir, **self.options
+                        )
+                        future.add_done_callback(self.on_done)
+                        last_activity = time.monotonic()
+                    if self.is_writing():
+                        last_activity = time.monotonic()
+                    idle = time.monotonic() - last_activity
+                    if idle_timeout is not None and idle >= idle_timeout:
+                        break
+                    time.sleep(self.poll_interval)
+            except KeyboardInterrupt:
+                log.info("interrupted, finishing queued files")
+        log.info(f"watch stopped: {self.n_ok} ok, {self.n_failed} failed")
+        return 1 if self.n_failed else 0
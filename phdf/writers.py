@@ -0,0 +1,519 @@
+import hashlib
+import os
+import queue
+import shutil
+import threading
+import time
+import warnings
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+import numpy as np
+import pandas as pd
+import tables
+
+from phdf import precision, sparse, utils
+
+MANIFEST_COLUMNS = ["input_digest", "digest", "rows", "cols", "updated"]
+MAX_KEY_SIZE = 255  # manifest index itemsize
+
+
+def frame_digest(df: pd.DataFrame) -> str:
+    """Content hash of a pixel map: values, dtype, row and col labels"""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(str(df.to_numpy().dtype).encode())
+    for x in (df.index.to_numpy(), df.columns.to_numpy(), df.to_numpy()):
+        h.update(np.ascontiguousarray(x).tobytes())
+        h.update(b"|")
+    return h.hexdigest()
+
+
+class HdfWriter:
+    """Writer session that puts all tables of a run through one HDFStore handle
+
+    The store is opened once, on a temporary file next to outpath, and only
+    renamed over outpath when the session closes without error. Downstream
+    readers therefore never see a partially written .h5 file. An existing
+    outpath is copied first, so tables are appended like mode="a".
+
+    layout="tables" writes one pandas "fixed" node per table, layout="stacked"
+    writes one chunked (table, row, col) float32 dataset under /stack, with
+    the table names, row and col labels as sidecar index arrays.
+
+    merge() writes incrementally instead: straight into outpath (atomic=False),
+    recording every table in a manifest as soon as it is written, so that an
+    interrupted run resumes where it stopped.
+
+    With a precision schema, values are stored in each table's precision and
+    the precision loss of every table is written to PRECISION_KEY; quantized
+    tables carry their scale and offset as node attributes, see precision.py.
+    With sparse_density, tables with a lower fraction of pixels holding a
+    value are stored as coordinate lists instead, see sparse.py.
+    """
+
+    def __init__(
+        self,
+        outpath: Path,
+        compression: Optional[utils.Compression] = None,
+        atomic: bool = True,
+        layout: str = "tables",
+        precision_schema: Optional[utils.Precision] = None,
+        sparse_density: Optional[float] = None,
+    ):
+        if layout not in utils.LAYOUTS:
+            raise NotImplementedError(f"{layout=}")
+        if layout == "stacked" and sparse_density:
+            raise NotImplementedError("layout='stacked' is always dense")
+        if layout == "stacked" and precision_schema and precision_schema.channels:
+            raise NotImplementedError("layout='stacked' takes a single precision")
+        self.log = utils.setup_logger()
+        self.outpath = Path(outpath)
+        self.layout = layout
+        self.compression = utils.Compression() if compression is None else compression
+        self.atomic = atomic
+        self.n_written = 0
+        self.store: pd.HDFStore | None = None
+        self.h5file: tables.File | None = None
+        self.manifest: dict[str, dict] | None = None
+        self.precision_schema = precision_schema
+        self.losses: dict[str, dict] = {}
+        self.sparse_density = sparse_density
+        self.n_sparse = 0
+        if atomic:
+            self.workpath = self.outpath.with_name(
+                f".{self.outpath.name}.{os.getpid()}.tmp"
+            )
+        else:
+            self.workpath = self.outpath
+
+    def __enter__(self) -> "HdfWriter":
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close(commit=exc_type is None)
+
+    def open(self) -> None:
+        self.outpath.parent.mkdir(parents=True, exist_ok=True)
+        if self.atomic and self.outpath.is_file():
+            shutil.copy2(self.outpath, self.workpath)
+        if self.layout == "stacked":
+            self.h5file = tables.open_file(self.workpath, mode="a")
+        else:
+            self.store = self.open_store()
+
+    def open_store(self) -> pd.HDFStore:
+        c = self.compression
+        store = pd.HDFStore(
+            self.workpath, mode="a", complevel=c.complevel, complib=c.complib
+        )
+        if c.complevel and not c.shuffle:
+            # HDFStore always shuffles and has no option to turn it off; its
+            # nodes take their filters from this private attribute instead
+            if not isinstance(getattr(store, "_filters", None), tables.Filters):
+                store.close()
+                raise NotImplementedError(
+                    f"shuffle=False is not supported by pandas {pd.__version__}"
+                )
+            store._filters = self.get_filters()
+        return store
+
+    def get_filters(self) -> tables.Filters | None:
+        c = self.compression
+        if not c.complevel:
+            return None
+        return tables.Filters(
+            complevel=c.complevel, complib=c.complib, shuffle=c.shuffle
+        )
+
+    def write(self, key: str, df: pd.DataFrame) -> None:
+        assert self.store is not None, "writer session is not open"
+        attrs: dict[str, Any] = {}
+        if self.sparse_density and sparse.density(df) < self.sparse_density:
+            df, attrs = sparse.to_coo(df)
+            self.n_sparse += 1
+        if self.precision_schema is not None:
+            if attrs:  # coordinate list, values by position
+                values, encoded = self.encode(key, df.to_frame())
+                df = values.iloc[:, 0]
+            else:
+                df, encoded = self.encode(key, df)
+            if encoded.precision in precision.QUANTIZED:
+                attrs[precision.PRECISION_ATTR] = encoded.precision
+                attrs[precision.SCALE_ATTR] = encoded.scale
+                attrs[precision.OFFSET_ATTR] = encoded.offset
+        with warnings.catch_warnings():
+            # e.g. '<file stem>/<table>' keys are fine without natural naming
+            warnings.simplefilter("ignore", tables.NaturalNameWarning)
+            self.store.put(key, df)
+        storer_attrs = self.store.get_storer(key).attrs
+        for name, value in attrs.items():
+            setattr(storer_attrs, name, value)
+        self.n_written += 1
+
+    def encode(
+        self, key: str, df: pd.DataFrame
+    ) -> tuple[pd.DataFrame, precision.Encoded]:
+        """Converts a table to its precision, recording the precision loss"""
+        assert self.precision_schema is not None
+        df_encoded, encoded = precision.encode_frame(df, self.precision_schema.get(key))
+        self.add_loss(key, df.to_numpy(), encoded)
+        return df_encoded, encoded
+
+    def add_loss(self, key: str, values: np.ndarray, encoded: precision.Encoded):
+        self.losses[key] = dict(
+            precision=encoded.precision,
+            scale=encoded.scale,
+            offset=encoded.offset,
+            **precision.measure_loss(values, encoded),
+        )
+
+    def read(self, key: str) -> pd.DataFrame:
+        """Reads a table back, decoding quantized values and coordinate lists"""
+        assert self.store is not None, "writer session is not open"
+        df = self.store.get(key)
+        return sparse.decode_table(df, self.store.get_storer(key).attrs)
+
+    def summarized_keys(self) -> set[str]:
+        assert self.store is not None, "writer session is not open"
+        if utils.SUMMARY_KEY not in self.store:
+            return set()
+        return set(self.store.select_column(utils.SUMMARY_KEY, "index"))
+
+    def read_manifest(self) -> dict[str, dict]:
+        """Latest manifest entry of every table, see MANIFEST_COLUMNS"""
+        assert self.store is not None, "writer session is not open"
+        if utils.MANIFEST_KEY not in self.store:
+            return {}
+        df = self.store.select(utils.MANIFEST_KEY)
+        df = df[~df.index.duplicated(keep="last")]
+        return df.to_dict(orient="index")
+
+    def merge(self, key: str, df: pd.DataFrame) -> tuple[str, pd.DataFrame]:
+        """Merges a table into the stored one, only writing what changed
+
+        New values replace stored ones pixel by pixel, pixels without a new
+        value keep the stored one. The table is not read at all when the
+        manifest shows the same input was already merged, e.g. on resume.
+
+        :param key: table name
+        :type key: str
+        :param df: pixel map of this run
+        :type df: pd.DataFrame
+        :return: status ("added", "merged", "unchanged" or "skipped") and
+            the merged table (df itself when skipped)
+        :rtype: tuple[str, pd.DataFrame]
+        """
+        assert self.store is not None, "writer session is not open"
+        if self.manifest is None:
+            self.manifest = self.read_manifest()
+        input_digest = frame_digest(df)
+        entry = self.manifest.get(key)
+        exists = key in self.store
+        if exists and entry is not None and entry["input_digest"] == input_digest:
+            return "skipped", df
+        if exists:
+            stored = self.read(key)
+            merged = df.combine_first(stored)
+            digest = frame_digest(merged)
+            status = "unchanged" if self.is_stored(key, df, stored) else "merged"
+        else:
+            merged, digest, status = df, input_digest, "added"
+        if status != "unchanged":
+            self.write(key, merged)
+        self.record(key, input_digest, digest, merged.shape)
+        return status, merged
+
+    def is_stored(self, key: str, df: pd.DataFrame, stored: pd.DataFrame) -> bool:
+        """Whether every value of df is already in the stored table
+
+        Stored values may have lost precision, so those of df are compared as
+        they would be stored, see precision.as_stored().
+        """
+        assert self.store is not None, "writer session is not open"
+        if not (
+            df.index.isin(stored.index).all() and df.columns.isin(stored.columns).all()
+        ):
+            return False
+        current = stored.loc[df.index, df.columns].to_numpy()
+        values = df.to_numpy()
+        present = ~np.isnan(values)
+        attrs = self.store.get_storer(key).attrs
+        values = precision.as_stored(values[present], current.dtype, attrs)
+        return np.array_equal(values, current[present])
+
+    def record(
+        self, key: str, input_digest: str, digest: str, shape: tuple[int, int]
+    ) -> None:
+        """Appends a manifest entry, flushed to disk with the table before it"""
+        assert self.store is not None and self.manifest is not None
+        entry = dict(
+            input_digest=input_digest,
+            digest=digest,
+            rows=shape[0],
+            cols=shape[1],
+            updated=time.time(),
+        )
+        self.manifest[key] = entry
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", tables.NaturalNameWarning)
+            self.store.append(
+                utils.MANIFEST_KEY,
+                pd.DataFrame(entry, index=[key])[MANIFEST_COLUMNS],
+                format="table",
+                min_itemsize={"index": MAX_KEY_SIZE},
+                index=False,
+            )
+        self.store.flush(fsync=True)
+
+    def compact_manifest(self) -> None:
+        """Rewrites the manifest with only the latest entry of every table"""
+        assert self.store is not None and self.manifest is not None
+        df = pd.DataFrame.from_dict(self.manifest, orient="index")[MANIFEST_COLUMNS]
+        self.store.put(
+            utils.MANIFEST_KEY,
+            df,
+            format="table",
+            min_itemsize={"index": MAX_KEY_SIZE},
+            index=False,
+        )
+
+    def write_stack(
+        self,
+        names: list[str],
+        rows: np.ndarray,
+        cols: np.ndarray,
+        values: np.ndarray,
+    ) -> None:
+        """Writes all pixel maps as one chunked, compressed dataset
+
+        :param names: table names, one per plane of values
+        :type names: list[str]
+        :param rows: row labels
+        :type rows: np.ndarray
+        :param cols: col labels
+        :type cols: np.ndarray
+        :param values: (table, row, col) pixel maps
+        :type values: np.ndarray
+        """
+        h5 = self.h5file
+        assert h5 is not None, "writer session is not open"
+        if utils.STACK_GROUP in h5:
+            self.log.warning(f"replacing {utils.STACK_GROUP} in {self.outpath.name}")
+            h5.remove_node(utils.STACK_GROUP, recursive=True)
+        group = h5.create_group("/", utils.STACK_GROUP.strip("/"))
+        filters = self.get_filters()
+        if self.precision_schema is not None:
+            values = self.encode_stack(group, names, values)
+        values = np.ascontiguousarray(values, dtype=values.dtype)
+        node = h5.create_carray(
+            group,
+            "values",
+            obj=values,
+            filters=filters,
+            chunkshape=(1, *values.shape[1:]) if values.size else None,
+        )
+        node.attrs.axes = ["table", "row", "col"]
+        h5.create_array(
+            group, "table_names", obj=np.array([x.encode() for x in names], dtype="S")
+        )
+        h5.create_array(group, "row_labels", obj=np.asarray(rows))
+        h5.create_array(group, "col_labels", obj=np.asarray(cols))
+        self.n_written += len(names)
+
+    def encode_stack(
+        self, group: tables.Group, names: list[str], values: np.ndarray
+    ) -> np.ndarray:
+        """Converts the stack to its precision, quantized planes one by one
+
+        Quantized stacks get the "scales" and "offsets" of every plane as
+        sidecar arrays, next to the values.
+        """
+        assert self.h5file is not None and self.precision_schema is not None
+        planes = [
+            precision.encode(values[i], self.precision_schema.default)
+            for i in range(len(names))
+        ]
+        for name, plane, encoded in zip(names, values, planes):
+            self.add_loss(name, plane, encoded)
+        setattr(group._v_attrs, precision.PRECISION_ATTR, self.precision_schema.default)
+        if self.precision_schema.default not in precision.QUANTIZED:
+            return values.astype(self.precision_schema.default, copy=False)
+        scales = np.array([x.scale for x in planes], dtype=np.float64)
+        offsets = np.array([x.offset for x in planes], dtype=np.float64)
+        self.h5file.create_array(group, "scales", obj=scales)
+        self.h5file.create_array(group, "offsets", obj=offsets)
+        dtype = precision.QUANTIZED[self.precision_schema.default]
+        return np.stack([x.codes for x in planes]) if planes else values.astype(dtype)
+
+    def use_store(self) -> pd.HDFStore:
+        if self.store is None:
+            # the stacked layout writes through PyTables, switch to pandas
+            assert self.h5file is not None, "writer session is not open"
+            self.h5file.close()
+            self.h5file = None
+            self.store = self.open_store()
+        return self.store
+
+    def put_index(self, key: str, df: pd.DataFrame) -> None:
+        """Writes a queryable per-table index, keeping rows of other tables"""
+        store = self.use_store()
+        if key in store:
+            previous = store.get(key)
+            previous = previous[~previous.index.isin(df.index)]
+            df = pd.concat([previous, df])
+        # no PyTables column indexes: they are most of the node size, and
+        # where= queries on a few thousand rows do not need them
+        store.put(key, df, format="table", data_columns=True, index=False)
+
+    def write_summary(self, summary: pd.DataFrame) -> None:
+        """Writes the per-table statistics as one queryable index table
+
+        Stored at SUMMARY_KEY with format="table" and all columns as data
+        columns, so HDFStore.select(SUMMARY_KEY, where=...) filters on disk;
+        the columns are not indexed, which keeps the node small.
+        Rows of tables already in the file are kept, unless replaced.
+
+        :param summary: see models.PixelStack.summarize()
+        :type summary: pd.DataFrame
+        """
+        self.put_index(utils.SUMMARY_KEY, summary)
+
+    def write_losses(self) -> None:
+        """Writes the precision loss of every table to PRECISION_KEY, and logs it"""
+        losses = pd.DataFrame.from_dict(self.losses, orient="index")
+        self.put_index(utils.PRECISION_KEY, losses.rename_axis("table"))
+        self.losses = {}
+        totals = losses.groupby("precision").agg(
+            tables=("scale", "size"),
+            max_abs_error=("max_abs_error", "max"),
+            max_rel_error=("max_rel_error", "max"),
+            overflow=("overflow", "sum"),
+        )
+        for name, row in totals.iterrows():
+            overflow = int(row.overflow)
+            self.log.info(
+                f"precision {name}: {int(row.tables)} tables,"
+                f" max_abs_error={row.max_abs_error:.3g},"
+                f" max_rel_error={row.max_rel_error:.3g}, {overflow=}"
+            )
+            if overflow:
+                self.log.warning(
+                    f"{overflow} values overflowed {name} in {self.outpath.name}"
+                )
+
+    def close(self, commit: bool = True) -> None:
+        is_open = self.store is not None or self.h5file is not None
+        if commit and self.losses and is_open:
+            self.write_losses()
+        if self.store is not None:
+            if commit and self.manifest is not None:
+                self.compact_manifest()
+            self.store.close()
+            self.store = None
+        elif self.h5file is not None:
+            self.h5file.close()
+            self.h5file = None
+        else:
+            return
+        if not self.atomic:
+            return
+        if commit:
+            os.replace(self.workpath, self.outpath)
+        else:
+            self.workpath.unlink(missing_ok=True)
+            if self.n_written:
+                self.log.error(f"discarded partially written {self.outpath.name}")
+
+
+class BackgroundWriteError(RuntimeError):
+    """The writer thread of a BackgroundWriter failed, the output was discarded"""
+
+
+class BackgroundWriter:
+    """Runs an HdfWriter session in a dedicated thread, fed by a bounded queue
+
+    submit() blocks while queue_size tables are waiting, so the producer never
+    runs further ahead of the disk than that (backpressure). The first error
+    of the writer thread is raised in the producer by the next submit() or by
+    close(), as a BackgroundWriteError, and the output is then discarded.
+    HDF5 calls are serialised: only the writer thread touches the store while
+    the session is open.
+
+    with BackgroundWriter(HdfWriter(outpath)) as writer:
+        for table in tables:
+            writer.submit(table.name, table.df)
+    """
+
+    def __init__(self, writer: HdfWriter, queue_size: int = 8):
+        self.writer = writer
+        self.queue: queue.Queue = queue.Queue(maxsize=max(queue_size, 1))
+        self.thread = threading.Thread(target=self.work, name="phdf-writer")
+        self.error: BaseException | None = None
+        self.write_times: dict[str, float] = {}
+        self.busy_s = 0.0  # writer thread, time spent writing
+        self.wait_s = 0.0  # producer, time blocked on a full queue
+
+    def __enter__(self) -> "BackgroundWriter":
+        self.writer.open()
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close(commit=exc_type is None)
+
+    def submit(self, key: str, df: pd.DataFrame) -> None:
+        """Queues a table for HdfWriter.write(), waiting while the queue is full"""
+        self.put(self.writer.write, key, df)
+
+    def submit_summary(self, summary: pd.DataFrame) -> None:
+        self.put(self.writer.write_summary, summary)
+
+    def put(self, fn: Callable, *args: Any) -> None:
+        start_time = time.perf_counter()
+        while True:
+            self.raise_error()
+            try:
+                self.queue.put((fn, args), timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        self.wait_s += time.perf_counter() - start_time
+
+    def work(self) -> None:
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            if self.error is not None:
+                continue  # drain, so that the producer never blocks
+            fn, args = item
+            start_time = time.perf_counter()
+            try:
+                fn(*args)
+            except BaseException as e:
+                self.error = e
+                continue
+            elapsed = time.perf_counter() - start_time
+            self.busy_s += elapsed
+            if fn == self.writer.write:
+                self.write_times[args[0]] = round(elapsed, 6)
+                self.writer.log.info(
+                    f"{self.writer.n_written - 1}: appended({args[0]})"
+                    f" to {self.writer.outpath.name}"
+                )
+
+    def raise_error(self) -> None:
+        if self.error is not None:
+            raise BackgroundWriteError(
+                f"background writer failed: {self.error!r}"
+            ) from self.error
+
+    def close(self, commit: bool = True) -> None:
+        """Waits for the queued tables, then commits the session"""
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        self.writer.close(commit=commit and self.error is None)
+        if commit:
+            self.raise_error()
@@ -1,6 +1,14 @@
 package phdf_j;
 
+import java.io.BufferedReader;
 import java.io.IOException;
+import java.io.InputStreamReader;
+import java.io.OutputStream;
+import java.net.UnixDomainSocketAddress;
+import java.nio.ByteBuffer;
+import java.nio.channels.Channels;
+import java.nio.channels.SocketChannel;
+import java.nio.charset.StandardCharsets;
 import java.util.ArrayList;
 import java.util.List;
 import javax.swing.filechooser.FileSystemView;
@@ -12,6 +20,11 @@ public class Phdf {
     private String cliPath;
     private String targetDir;
     private String dataString;
+    private String metricsPath;
+    private boolean incremental;
+    private boolean pipeline;
+    private String precision;
+    private Double sparseDensity;
     private List<String> command;
 
     public Phdf() {
@@ -27,6 +40,24 @@ public class Phdf {
         appendCommand(this.cliPath);
         appendCommand("--measure_timing");
         appendCommand("--skip_cleanup");
+        if (this.metricsPath != null) {
+            appendCommand("--metrics");
+            appendCommand(this.metricsPath);
+        }
+        if (this.incremental) {
+            appendCommand("--incremental");
+        }
+        if (this.pipeline) {
+            appendCommand("--pipeline");
+        }
+        if (this.precision != null) {
+            appendCommand("--precision");
+            appendCommand(this.precision);
+        }
+        if (this.sparseDensity != null) {
+            appendCommand("--sparse");
+            appendCommand(this.sparseDensity.toString());
+        }
         System.out.println("command iniialized: " + this.command);
     }
 
@@ -85,6 +116,66 @@ public class Phdf {
         this.dataString = dataString;
     }
 
+    public String getMetricsPath() {
+        return this.metricsPath;
+    }
+
+    /**
+     * Every conversion appends one JSON line of stage metrics (wall time,
+     * records/s, bytes written, peak memory) to this file, "-" for stderr.
+     */
+    public void setMetricsPath(String metricsPath) {
+        this.metricsPath = metricsPath;
+    }
+
+    public boolean isIncremental() {
+        return this.incremental;
+    }
+
+    /**
+     * Merges every conversion into its existing output file, rewriting only
+     * the tables that changed; an interrupted conversion resumes when rerun.
+     */
+    public void setIncremental(boolean incremental) {
+        this.incremental = incremental;
+    }
+
+    public boolean isPipeline() {
+        return this.pipeline;
+    }
+
+    /**
+     * Writes tables in a background thread while the rest of the input is
+     * parsed; a failed write still makes the conversion exit with code 1.
+     */
+    public void setPipeline(boolean pipeline) {
+        this.pipeline = pipeline;
+    }
+
+    public String getPrecision() {
+        return this.precision;
+    }
+
+    /**
+     * Value storage precision, e.g. "float32,aTB_*=int16q" (see --precision);
+     * null keeps the float32 default.
+     */
+    public void setPrecision(String precision) {
+        this.precision = precision;
+    }
+
+    public Double getSparseDensity() {
+        return this.sparseDensity;
+    }
+
+    /**
+     * Stores tables with fewer than this fraction of pixels holding a value
+     * as coordinate lists (see --sparse); null stores every table dense.
+     */
+    public void setSparseDensity(Double sparseDensity) {
+        this.sparseDensity = sparseDensity;
+    }
+
     public void setCommand(List<String> command) {
         this.command = command;
     }
@@ -118,4 +209,100 @@ public class Phdf {
         return 0;
     }
 
-}
\ No newline at end of file
+    /**
+     * Streams the data into the stdin of `python cli.py - targetDir`, so it
+     * is parsed while it is being written, without a temporary file.
+     */
+    public int runStreaming(String dataString, String targetDir) {
+        initCommand();
+        appendUserInputToCommand("-", targetDir);
+        System.out.println(" >> streaming to subprocess phdf (data.length="
+                + dataString.length() + ") " + this.targetDir);
+
+        ProcessBuilder builder = new ProcessBuilder(this.command);
+        builder.redirectOutput(ProcessBuilder.Redirect.INHERIT);
+        builder.redirectError(ProcessBuilder.Redirect.INHERIT);
+        try {
+            Process process = builder.start();
+            try (OutputStream stdin = process.getOutputStream()) {
+                byte[] data = dataString.getBytes(StandardCharsets.UTF_8);
+                int chunkSize = 1 << 16;
+                for (int i = 0; i < data.length; i += chunkSize) {
+                    stdin.write(data, i, Math.min(chunkSize, data.length - i));
+                }
+            }
+            process.waitFor();
+            System.out.println(" >> phdf completed with exitCode=" + process.exitValue());
+            return process.exitValue();
+        } catch (IOException e) {
+            System.out.println(e.getMessage());
+            return 1;
+        } catch (InterruptedException e) {
+            System.out.println(e.getMessage());
+            return 2;
+        }
+    }
+
+    /**
+     * Sends the conversion to a PHDF worker started with
+     * `python cli.py --serve socketPath`, instead of starting a new python
+     * process. Requires Java 16+ (Unix domain sockets).
+     */
+    public int runOnServer(String socketPath, String dataString, String targetDir) {
+        this.targetDir = targetDir;
+        this.dataString = dataString;
+        String request = "{\"data_input\": " + toJsonString(dataString)
+                + ", \"output_dir\": " + toJsonString(targetDir)
+                + (this.metricsPath != null
+                        ? ", \"metrics_path\": " + toJsonString(this.metricsPath) : "")
+                + (this.incremental ? ", \"incremental\": true" : "")
+                + (this.pipeline ? ", \"pipeline\": true" : "")
+                + (this.precision != null
+                        ? ", \"precision\": " + toJsonString(this.precision) : "")
+                + (this.sparseDensity != null
+                        ? ", \"sparse_density\": " + this.sparseDensity : "")
+                + ", \"measure_timing\": true, \"skip_cleanup\": true}\n";
+        System.out.println(" >> sending to phdf server " + socketPath + " (data.length="
+                + dataString.length() + ") " + targetDir);
+
+        try (SocketChannel channel = SocketChannel.open(UnixDomainSocketAddress.of(socketPath))) {
+            ByteBuffer buffer = ByteBuffer.wrap(request.getBytes(StandardCharsets.UTF_8));
+            while (buffer.hasRemaining()) {
+                channel.write(buffer);
+            }
+            BufferedReader reader = new BufferedReader(
+                    new InputStreamReader(Channels.newInputStream(channel), StandardCharsets.UTF_8));
+            String response = reader.readLine();
+            System.out.println(" >> phdf server replied " + response);
+            if (response == null || !response.startsWith("{\"exit_code\": 0")) {
+                return 1;
+            }
+        } catch (IOException e) {
+            System.out.println(e.getMessage());
+            return 1;
+        }
+        return 0;
+    }
+
+    private static String toJsonString(String value) {
+        StringBuilder sb = new StringBuilder("\"");
+        for (char c : value.toCharArray()) {
+            switch (c) {
+                case '"' -> sb.append("\\\"");
+                case '\\' -> sb.append("\\\\");
+                case '\n' -> sb.append("\\n");
+                case '\r' -> sb.append("\\r");
+                case '\t' -> sb.append("\\t");
+                default -> {
+                    if (c < 0x20) {
+                        sb.append(String.format("\\u%04x", (int) c));
+                    } else {
+                        sb.append(c);
+                    }
+                }
+            }
+        }
+        return sb.append('"').toString();
+    }
+
+}
@@ -0,0 +1,78 @@
+from pathlib import Path
+import shutil
+
+import pandas as pd
+import pytest
+
+from phdf import batch
+
+BASE_DIR = Path(__file__).parent.parent.resolve()
+
+
+def make_inputs(tmp_path: Path) -> Path:
+    input_dir = tmp_path / "inputs"
+    input_dir.mkdir()
+    for f in (BASE_DIR / "resources").glob("*testfilewriter*.txt"):
+        shutil.copy(f, input_dir / f.name)
+    return input_dir
+
+
+def test_collect_inputs(tmp_path, monkeypatch):
+    input_dir = make_inputs(tmp_path)
+    files = sorted(input_dir.iterdir())
+    filelist = tmp_path / "files.lst"
+    filelist.write_text("\n".join(str(f) for f in files[:1]))
+
+    assert batch.collect_inputs(str(input_dir)) == files
+    assert batch.collect_inputs(str(input_dir / "*.txt")) == files
+    assert batch.collect_inputs(str(files[0])) == files[:1]
+    assert batch.collect_inputs(f"@{filelist}") == files[:1]
+
+    monkeypatch.setenv("HOME", str(tmp_path))
+    assert batch.collect_inputs(f"~/{input_dir.name}/*.txt") == files
+
+
+def test_run_batch_reports_failures(tmp_path):
+    input_dir = make_inputs(tmp_path)
+    (input_dir / "broken.txt").write_text('{"bad"')
+    output_dir = tmp_path / "outputs"
+
+    exit_code = batch.run_batch(str(input_dir), str(output_dir), jobs=2)
+
+    assert exit_code == 1
+    assert len(list(output_dir.glob("testfilewriter-*-cp3.h5"))) == 2
+
+
+def test_run_batch_merges_into_one_file(tmp_path):
+    input_dir = make_inputs(tmp_path)
+    output_dir = tmp_path / "outputs"
+
+    exit_code = batch.run_batch(str(input_dir), str(output_dir), jobs=2, merge="lot.h5")
+
+    assert exit_code == 0
+    assert [f.name for f in output_dir.iterdir()] == ["lot.h5"]
+    with pd.HDFStore(output_dir / "lot.h5", mode="r") as store:
+        keys = [k for k in store.keys() if not k.startswith("/_phdf/")]
+        stems = {k.split("/")[1] for k in keys}
+        assert len(keys) == 40
+        summary = store.get("/_phdf/summary")
+    assert stems == {f.stem for f in input_dir.iterdir()}
+    assert sorted(summary.index) == sorted(k.lstrip("/") for k in keys)
+
+
+def test_interrupted_merge_keeps_previous_output(tmp_path, monkeypatch):
+    input_dir = make_inputs(tmp_path)
+    output_dir = tmp_path / "outputs"
+    output_dir.mkdir()
+    pd.DataFrame({"a": [1.0]}).to_hdf(output_dir / "lot.h5", key="previous")
+
+    def interrupted(*args):
+        yield batch.convert_file(next(input_dir.iterdir()), str(output_dir), True)
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(batch, "iter_results", interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        batch.run_batch(str(input_dir), str(output_dir), merge="lot.h5")
+    assert [f.name for f in output_dir.iterdir()] == ["lot.h5"]
+    with pd.HDFStore(output_dir / "lot.h5", mode="r") as store:
+        assert store.keys() == ["/previous"]
@@ -0,0 +1,35 @@
+import numpy as np
+
+from phdf import benchmark, models, views
+
+
+def test_generated_file_has_requested_shape(tmp_path):
+    input_file = views.generate_testfilewriter_file(
+        tmp_path / "generated.txt",
+        n_parts=2,
+        n_sites=3,
+        n_channels=4,
+        n_rows=5,
+        n_cols=120,
+        missing=0.2,
+        seed=0,
+    )
+    dpx = models.DevicePixelArray(input_file, output_folder=tmp_path)
+    dpx.run()
+
+    assert len(dpx.tables) == 2 * 3 * 4
+    assert dpx.tables[0].name == "site1_partId1_aTB_0"
+    assert dpx.stack.values.shape == (24, 5, 120)
+    density = (~np.isnan(dpx.stack.values)).mean()
+    assert 0.7 < density < 0.9
+
+
+def test_benchmark_suite_times_every_stage(tmp_path):
+    input_file = views.generate_testfilewriter_file(
+        tmp_path / "tiny.txt", n_rows=4, n_cols=4, seed=0
+    )
+    df = benchmark.run_benchmark_suite(tmp_path, [str(input_file)], repeats=1)
+
+    assert list(df.columns[2:-1]) == list(benchmark.STAGES)
+    assert (df[list(benchmark.STAGES)] >= 0).all(axis=None)
+    assert len(list(tmp_path.glob("benchmark-*.csv"))) == 1
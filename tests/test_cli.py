@@ -1,11 +1,15 @@
+import json
 import subprocess
 from pathlib import Path
 import pytest
 import os
 import platform
 from utils import PathFinder
+from phdf import utils as phdf_utils
 
 BASE_DIR = Path(__file__).parent.parent.resolve()
+STARTUP_BUDGET_S = 0.25  # cumulative imports of cli.py, before argparse runs
+HEAVY_MODULES = {"pandas", "numpy", "tables"}
 
 
 class PtConfigError(ValueError):
@@ -58,6 +62,7 @@ def generate_broken_commands():
     Generates a list of commands that will raise an error
     (Test#1) phdf {MISSING ARGS}
     (Test#2) phdf {json string} {NO 2nd Arg}
+    (Test#3) phdf -cp {out of range} {json string} {output dir}
     """
     return [
         ((find_python(), find_cli()), ("usage: ", "error: ")),
@@ -72,6 +77,17 @@ def generate_broken_commands():
                 "error: ",
             ),
         ),
+        (
+            (
+                find_python(),
+                find_cli(),
+                "-cp",
+                "12",
+                '{"partId": {"R00C00": { "site1":{"aTB_0": "0.0"}}}}',
+                str(BASE_DIR / "tests"),
+            ),
+            ("usage: ", "error: ", "--complevel"),
+        ),
     ]
 
 
@@ -123,7 +139,9 @@ def check_for_hdf5_output_files_and_cleanup():
     return number_of_output_files
 
 
-@pytest.fixture(params=generate_broken_commands(), ids=["No args", "Missing args"])
+@pytest.fixture(
+    params=generate_broken_commands(), ids=["No args", "Missing args", "Bad complevel"]
+)
 def broken_commands_and_expected_kws(request):
     return request.param
 
@@ -169,6 +187,134 @@ def test_cli(commands_and_expected_kws):
     assert check_for_hdf5_output_files_and_cleanup() > 0  # there must be output files
 
 
+def test_cli_startup_imports_stay_light():
+    """
+    Test that `cli.py -h` and argument errors do not pay for pandas & co.
+    Expect no heavy imports and cli.py imported within budget
+    """
+    results = phdf_utils.import_times("import cli")
+    modules = {module for module, _, _ in results}
+    cli_time_s = next(c for m, _, c in results if m == "cli") / 1e6
+
+    assert not modules & HEAVY_MODULES
+    assert cli_time_s < STARTUP_BUDGET_S
+
+
+def test_cli_stdin():
+    """
+    Test streaming the records into the cli through stdin
+    Expect hdf5 files in output dir and no errors
+    """
+    pytest_folder = BASE_DIR / "tests"
+    input_file = next((BASE_DIR / "resources").glob("*testfilewriter*.txt"))
+    with open(input_file, "rb") as f:
+        p0 = subprocess.run(
+            (find_python(), find_cli(), "-", str(pytest_folder.absolute())),
+            stdin=f,
+            capture_output=True,
+        )
+    stderr = p0.stderr.decode("utf-8")
+
+    assert p0.returncode == 0
+    assert "appended(" in stderr
+    assert "ERROR   :" not in stderr
+    assert check_for_hdf5_output_files_and_cleanup() > 0
+
+
+def test_cli_metrics():
+    """
+    Test --metrics - on a file input
+    Expect one JSON line on stderr with every stage of the conversion
+    """
+    pytest_folder = BASE_DIR / "tests"
+    input_file = next((BASE_DIR / "resources").glob("*testfilewriter*.txt"))
+    p0 = subprocess.run(
+        (
+            find_python(),
+            find_cli(),
+            "--metrics",
+            "-",
+            str(input_file),
+            str(pytest_folder),
+        ),
+        capture_output=True,
+    )
+    stderr = p0.stderr.decode("utf-8")
+    lines = [x for x in stderr.splitlines() if x.startswith('{"event": "phdf_metrics"')]
+
+    assert p0.returncode == 0
+    assert len(lines) == 1
+    metrics = json.loads(lines[0])
+    assert list(metrics["stages"]) == [
+        "import",
+        "parse",
+        "process",
+        "pivot",
+        "tables",
+        "summary",
+        "write",
+    ]
+    assert metrics["stages"]["parse"]["records"] == 25600
+    assert metrics["stages"]["write"]["bytes"] > 0
+    assert len(metrics["table_writes"]) == 20
+    assert check_for_hdf5_output_files_and_cleanup() > 0
+
+
+def test_cli_pipeline():
+    """
+    Test --pipeline on a file input
+    Expect every table written by the background writer, and its stage metrics
+    """
+    pytest_folder = BASE_DIR / "tests"
+    input_file = next((BASE_DIR / "resources").glob("*testfilewriter*.txt"))
+    p0 = subprocess.run(
+        (
+            find_python(),
+            find_cli(),
+            "--pipeline",
+            "--metrics",
+            "-",
+            str(input_file),
+            str(pytest_folder),
+        ),
+        capture_output=True,
+    )
+    stderr = p0.stderr.decode("utf-8")
+    lines = [x for x in stderr.splitlines() if x.startswith('{"event": "phdf_metrics"')]
+
+    assert p0.returncode == 0, stderr
+    metrics = json.loads(lines[0])
+    assert metrics["stages"]["pipeline"]["tables"] == 20
+    assert stderr.count("appended(") == 20
+    assert len(metrics["table_writes"]) == 20
+    assert check_for_hdf5_output_files_and_cleanup() > 0
+
+
+def test_cli_precision():
+    """
+    Test --precision with a quantized channel override, and an invalid spec
+    Expect the loss report logged per precision, and a usage error
+    """
+    pytest_folder = BASE_DIR / "tests"
+    input_file = next((BASE_DIR / "resources").glob("*testfilewriter*.txt"))
+    command = (find_python(), find_cli(), "--precision")
+    p0 = subprocess.run(
+        (*command, "float32,aTB_*=int16q", str(input_file), str(pytest_folder)),
+        capture_output=True,
+    )
+    stderr = p0.stderr.decode("utf-8")
+
+    assert p0.returncode == 0, stderr
+    assert "precision int16q: " in stderr
+    assert check_for_hdf5_output_files_and_cleanup() > 0
+
+    p1 = subprocess.run(
+        (*command, "int8", str(input_file), str(pytest_folder)), capture_output=True
+    )
+    assert p1.returncode == 2
+    assert "--precision: " in p1.stderr.decode("utf-8")
+
+
 if __name__ == "__main__":
 
     """Simply type 'pytest' in the command line to execute the full test suite"""
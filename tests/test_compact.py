@@ -0,0 +1,59 @@
+import pandas as pd
+import pytest
+
+from phdf import compact, models, views
+
+
+def make_outputs(tmp_path) -> dict[str, models.DevicePixelArray]:
+    """Two tests of the same part (seeds 1, 2) and another part, as h5 outputs"""
+    inputs_dir = tmp_path / "inputs"
+    outputs_dir = tmp_path / "outputs"
+    inputs_dir.mkdir()
+    outputs = {}
+    for stem, seed, layout in [("a", 1, "tables"), ("b", 2, "stacked")]:
+        input_file = views.generate_testfilewriter_file(
+            inputs_dir / f"{stem}.txt", n_rows=4, n_cols=5, seed=seed
+        )
+        dpx = models.DevicePixelArray(input_file, output_folder=outputs_dir)
+        dpx.run()
+        dpx.save_to_hdf(layout=layout)
+        outputs[dpx.outpath.name] = dpx
+    input_file = inputs_dir / "c.txt"
+    input_file.write_text('{"partId2": {"R00C00": { "site1":{"aTB_0": "0.5"}}}}')
+    dpx = models.DevicePixelArray(input_file, output_folder=outputs_dir)
+    dpx.run()
+    dpx.save_to_hdf()
+    outputs[dpx.outpath.name] = dpx
+    return outputs
+
+
+@pytest.mark.parametrize("on_duplicate,jobs", [("last", 1), ("first", 2)])
+def test_compaction_resolves_duplicates(tmp_path, on_duplicate, jobs):
+    outputs = make_outputs(tmp_path)
+    exit_code = compact.run_compaction(
+        str(tmp_path / "outputs"), str(tmp_path), "lot.h5", jobs, on_duplicate
+    )
+
+    assert exit_code == 0
+    kept = outputs["b-cp3.h5" if on_duplicate == "last" else "a-cp3.h5"]
+    expected = {t.name: t.df for t in kept.tables}
+    expected.update({t.name: t.df for t in outputs["c-cp3.h5"].tables})
+    with views.PixelMapReader(tmp_path / "lot.h5") as reader:
+        assert sorted(reader.names) == sorted(expected)
+        for name, df in reader.iter_tables(reader.names):
+            pd.testing.assert_frame_equal(df, expected[name])
+        summary = reader.summary()
+    assert sorted(summary.index) == sorted(expected)
+    assert set(summary["source"]) == {kept.outpath.name, "c-cp3.h5"}
+    pd.testing.assert_series_equal(
+        summary.loc[kept.summary.index, "mean"], kept.summary["mean"]
+    )
+
+
+def test_compaction_can_refuse_duplicates(tmp_path):
+    make_outputs(tmp_path)
+    exit_code = compact.run_compaction(
+        str(tmp_path / "outputs"), str(tmp_path), "lot.h5", on_duplicate="error"
+    )
+    assert exit_code == 1
+    assert not (tmp_path / "lot.h5").exists()
@@ -0,0 +1,140 @@
+import logging
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from phdf import main, models, views, writers
+
+
+def generate_raw_dataframe() -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    n = 500
+    df = pd.DataFrame(
+        {
+            "table_name": rng.choice(["s1_p_a", "s2_p_a", "s1_p_b"], n),
+            "row": rng.integers(0, 12, n),
+            "col": rng.choice([f"C{x:02d}" for x in range(9)], n),
+            "value": rng.normal(0, 1, n),
+        }
+    )
+    df.loc[rng.choice(n, 20), "value"] = np.nan
+    return df
+
+
+def test_pivot_stack_matches_pivot_table():
+    df = generate_raw_dataframe()  # has duplicated pixels and NaN values
+    tables = models.pivot_stack(df).to_tables()
+    assert [t.name for t in tables] == list(df["table_name"].unique())
+    for table in tables:
+        expected = pd.pivot_table(
+            df[df["table_name"] == table.name],
+            columns="col",
+            index="row",
+            values="value",
+        ).astype(np.float32)
+        pd.testing.assert_frame_equal(table.df, expected, check_exact=False)
+
+
+def test_decode_coords_supports_wide_grids():
+    coord = pd.Series(["R00C00", "R100C7", "R9C1024", "R00C00", "bad"])
+    rows, cols = models.decode_coords(coord)
+    assert rows.tolist() == [0, 100, 9, 0, -1]
+    assert cols.tolist() == [0, 7, 1024, 0, -1]
+
+
+def test_table_keys_in_order_of_first_appearance():
+    df = pd.DataFrame(
+        {
+            "site": ["site2", "site1", "site2", "site1"],
+            "serialnumber": ["partId1"] * 4,
+            "ch": ["aTB_1", "aTB_0", "aTB_1", "aTB_1"],
+        }
+    )
+    keys = models.table_keys(df)
+    assert list(keys.categories) == [
+        "site2_partId1_aTB_1",
+        "site1_partId1_aTB_0",
+        "site1_partId1_aTB_1",
+    ]
+    assert keys.codes.tolist() == [0, 1, 0, 2]
+
+
+def test_pixel_accumulator_matches_pivot_stack():
+    df = generate_raw_dataframe()
+    expected = models.pivot_stack(df)
+    accumulator = models.PixelAccumulator()
+    for chunk in np.array_split(np.arange(len(df)), 7):
+        accumulator.add(df.iloc[chunk])
+    stack = accumulator.to_stack()
+    assert stack.names == list(expected.names)
+    pd.testing.assert_index_equal(stack.rows, expected.rows)
+    pd.testing.assert_index_equal(stack.cols, expected.cols)
+    np.testing.assert_allclose(stack.values, expected.values, rtol=1e-6)
+
+
+def test_pixel_accumulator_counts_past_uint16():
+    df = pd.DataFrame(
+        {"table_name": ["t"] * 2, "row": [0, 0], "col": [0, 0], "value": [1.0, 4.0]}
+    )
+    accumulator = models.PixelAccumulator()
+    accumulator.add(df.iloc[:1])
+    accumulator.counts[:] = 70000  # as if 70000 records of 1.0 were added
+    accumulator.max_count = 70000
+    accumulator.add(df.iloc[1:])
+    assert accumulator.counts[0, 0, 0] == 70001
+
+    accumulator.max_count = np.iinfo(np.uint32).max
+    with pytest.raises(OverflowError):
+        accumulator.add(df.iloc[1:])
+    assert accumulator.counts[0, 0, 0] == 70001  # rejected chunk left no trace
+    mean = accumulator.to_stack().values[0, 0, 0]
+    assert mean == pytest.approx((70000 + 4.0) / 70001, rel=1e-6)
+
+
+def test_pipelined_run_matches_sequential_run(tmp_path, monkeypatch, caplog):
+    caplog.set_level(logging.INFO, logger="phdf")
+    monkeypatch.setattr(models, "PIPELINE_CHUNK_SIZE", 1 << 16)
+    input_file = views.generate_testfilewriter_file(
+        tmp_path / "lot.txt", n_parts=3, n_rows=8, n_cols=8, missing=0.1, seed=0
+    )
+    with open(input_file, "a") as f:  # a retest of part 1 after the others
+        f.write(',{"partId1": {"R00C00": { "site1":{"aTB_0": "9.5"}}}}')
+    expected = models.DevicePixelArray(input_file, output_folder=tmp_path)
+    expected.run()
+
+    dpx = models.DevicePixelArray(
+        input_file, output_folder=tmp_path / "out", pipeline=True
+    )
+    outpath = dpx.run_pipelined(queue_size=2)
+
+    assert "1 tables got records after being written" in caplog.text
+    assert f"0: appended({expected.tables[0].name}) to {outpath.name}" in caplog.text
+    assert dpx.metrics.stages["pipeline"]["tables"] == len(expected.tables)
+    pd.testing.assert_frame_equal(dpx.summary, expected.summary)
+    with views.PixelMapReader(outpath) as reader:
+        assert sorted(reader.names) == sorted(t.name for t in expected.tables)
+        for table in expected.tables:
+            pd.testing.assert_frame_equal(reader[table.name], table.df)
+
+
+def test_pipelined_run_raises_writer_errors(tmp_path, monkeypatch):
+    input_file = views.generate_testfilewriter_file(
+        tmp_path / "lot.txt", n_rows=4, n_cols=4, seed=0
+    )
+    write = writers.HdfWriter.write
+
+    def write_then_fail(self, key, df):
+        if self.n_written == 3:
+            raise OSError("disk full")
+        write(self, key, df)
+
+    monkeypatch.setattr(writers.HdfWriter, "write", write_then_fail)
+    dpx = models.DevicePixelArray(input_file, output_folder=tmp_path, pipeline=True)
+    with pytest.raises(writers.BackgroundWriteError, match="disk full"):
+        dpx.run_pipelined(queue_size=1)
+    assert not dpx.outpath.exists()
+
+    exit_code, dpx = main.convert(input_file, str(tmp_path), pipeline=True)
+    assert exit_code == 1
+    assert not dpx.outpath.exists()
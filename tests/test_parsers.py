@@ -0,0 +1,126 @@
+from pathlib import Path
+import io
+import json
+import os
+
+import pytest
+
+from phdf import parsers
+
+BASE_DIR = Path(__file__).parent.parent.resolve()
+
+
+def legacy_parse(input_str: str) -> list[tuple]:
+    return [
+        parsers.unnest_record(json.loads(x)) for x in input_str.strip().split(",") if x
+    ]
+
+
+def test_scan_string_matches_json_path():
+    input_str = (
+        '{"partId1": {"R00C00": { "site1":{"aTB_0": "0.0"}}}},'
+        '{"partId1": {"R01C02": {"site2": {"aTB_1": 1.5}}}},'
+    )
+    df = parsers.scan_string(input_str).to_frame()
+    assert df.astype(object).to_dict("records") == [
+        dict(
+            serialnumber="partId1", coord="R00C00", site="site1", ch="aTB_0", value=0.0
+        ),
+        dict(
+            serialnumber="partId1", coord="R01C02", site="site2", ch="aTB_1", value=1.5
+        ),
+    ]
+
+
+def test_scanner_falls_back_for_unrecognised_records():
+    input_str = (
+        '{"partId1": {"R00C00": { "site1":{"aTB_0": "0.0"}}}},'
+        '{"partId1": {"R00C01": {"site1": {"aTB_\\u0030": "2.0"}}}},'
+        '{"partId1": {"R00C02": { "site1":{"aTB_0": "3.0"}}}}'
+    )
+    scanner = parsers.RecordScanner()
+    scanner.feed(input_str)
+    records = scanner.close()
+    assert scanner.n_fallback == 1  # escaped key goes through json.loads()
+    assert records.coord.decode() == ["R00C00", "R00C01", "R00C02"]
+    assert records.ch.decode() == ["aTB_0", "aTB_0", "aTB_0"]
+
+
+def test_scanner_handles_records_split_across_chunks():
+    input_file = next((BASE_DIR / "resources").glob("*testfilewriter*.txt"))
+    text = input_file.read_text()
+    chunked = parsers.scan_stream(text[i : i + 1000] for i in range(0, len(text), 1000))
+    expected = legacy_parse(text)
+    df = chunked.to_frame()
+    assert len(df) == len(expected)
+    assert list(zip(*[df[k].tolist() for k in parsers.COLUMNS])) == [
+        (*x[:4], float(x[4])) for x in expected
+    ]
+
+
+def test_binary_stream_is_parsed_as_bytes_arrive():
+    r, w = os.pipe()
+    with open(r, "rb") as reader, open(w, "wb", buffering=0) as writer:
+        scanner = parsers.RecordScanner()
+        chunks = parsers.iter_binary_stream(reader)
+        writer.write(b'{"partId1": {"R00C00": { "site1":{"aTB_0": "1.0"}}}},{"part')
+        scanner.feed(next(chunks))
+        assert len(scanner.records) == 1  # before EOF
+        writer.write(b'Id1": {"R00C01": { "site1":{"aTB_0": "2.0"}}}}')
+        writer.close()
+        for chunk in chunks:
+            scanner.feed(chunk)
+    assert scanner.close().coord.decode() == ["R00C00", "R00C01"]
+
+
+def test_parallel_scan_matches_serial_scan():
+    input_file = next((BASE_DIR / "resources").glob("*testfilewriter*.txt"))
+    offsets = parsers.find_record_boundaries(input_file, 3)
+    assert len(offsets) == 4
+    records = parsers.scan_file_parallel(input_file, jobs=3, min_part_size=1 << 10)
+    expected = parsers.scan_file(input_file)
+    for k in parsers.COLUMNS[:-1]:
+        assert getattr(records, k).categories == getattr(expected, k).categories
+    assert records.to_frame().equals(expected.to_frame())
+
+
+@pytest.mark.parametrize("fmt", parsers.FORMATS)
+def test_input_formats_scan_the_same_records(tmp_path, fmt):
+    input_file = next((BASE_DIR / "resources").glob("*testfilewriter*.txt"))
+    expected = parsers.scan_file(input_file).to_frame()
+    records = list(zip(*[expected[k].tolist() for k in parsers.COLUMNS]))
+    filepath = tmp_path / f"records.{fmt}"
+    with open(filepath, "wb") as f, parsers.RecordWriter(f, fmt, block_size=999) as w:
+        w.write(records[:10])
+        w.write(records[10:])
+
+    assert parsers.detect_format(filepath.read_bytes()[:64]) == fmt
+    for chunk_size in (7, parsers.READ_CHUNK_SIZE):  # blocks split across reads
+        records = parsers.scan_file(filepath, chunk_size=chunk_size)
+        assert records.to_frame().equals(expected)
+    chunks = parsers.iter_record_chunks(parsers.iter_file_chunks(filepath, 4096))
+    assert parsers.ColumnarRecords.concat(chunks).to_frame().equals(expected)
+
+
+def test_line_format_skips_header_and_invalid_lines():
+    input_str = (
+        "serialnumber,coord,site,ch,value\r\n"
+        "partId1,R00C00,site1,aTB_0,0.5\r\n"
+        "not a record\n"
+        "\n"
+        "partId1,R00C01,site1,aTB_0,1.5"
+    )
+    df = parsers.scan_string(input_str).to_frame()
+    assert df["coord"].tolist() == ["R00C00", "R00C01"]
+    assert df["value"].tolist() == [0.5, 1.5]
+
+
+def test_binary_input_must_be_complete():
+    with io.BytesIO() as f:
+        with parsers.RecordWriter(f, "binary") as writer:
+            writer.write([("partId1", "R00C00", "site1", "aTB_0", 0.5)])
+        data = f.getvalue()
+    scanner = parsers.BinaryScanner()
+    scanner.feed(data[:-1])
+    with pytest.raises(ValueError):
+        scanner.close()
@@ -0,0 +1,89 @@
+import logging
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from phdf import models, precision, utils, views
+
+
+@pytest.fixture(scope="module")
+def input_file(tmp_path_factory):
+    return views.generate_testfilewriter_file(
+        tmp_path_factory.mktemp("precision") / "lot.txt",
+        n_channels=3,
+        n_rows=6,
+        n_cols=5,
+        missing=0.2,
+        seed=2,
+    )
+
+
+def test_precision_spec():
+    schema = utils.Precision.from_spec("int16q, aTB_1=float64,aTB_*=float16")
+    assert schema == utils.Precision(
+        "int16q", (("aTB_1", "float64"), ("aTB_*", "float16"))
+    )
+    assert schema.get("site1_partId1_aTB_1") == "float64"
+    assert schema.get("lot/site1_partId1_aTB_2") == "float16"
+    assert schema.get("site1_partId1_vref") == "int16q"
+    assert utils.Precision.from_spec("float64").precisions == {"float64"}
+    with pytest.raises(ValueError):
+        utils.Precision.from_spec("aTB_*=int8")
+
+
+@pytest.mark.parametrize("name", ["int16q", "int32q"])
+def test_quantized_error_is_within_half_a_step(name):
+    values = np.random.default_rng(0).normal(5.0, 3.0, (20, 30))
+    values[3, 4] = np.nan
+    encoded = precision.encode(values, name)
+    assert encoded.codes.dtype == precision.QUANTIZED[name]
+
+    decoded = precision.decode(encoded)
+    assert np.isnan(decoded[3, 4]) and np.isnan(decoded).sum() == 1
+    loss = precision.measure_loss(values, encoded)
+    assert 0 < loss["max_abs_error"] <= encoded.scale / 2 * (1 + 1e-6)
+    assert loss["overflow"] == 0
+
+
+def test_float16_overflow_is_counted():
+    values = np.array([1.0, 70000.0, np.nan, -1e6])
+    loss = precision.measure_loss(values, precision.encode(values, "float16"))
+    assert loss["overflow"] == 2
+
+
+@pytest.mark.parametrize(
+    "layout, spec",
+    [
+        ("tables", "float32,aTB_0=int16q,aTB_1=float64"),
+        ("tables", "float16"),
+        ("stacked", "int32q"),
+        ("stacked", "float64"),
+    ],
+)
+def test_round_trip_within_reported_loss(tmp_path, input_file, caplog, layout, spec):
+    caplog.set_level(logging.INFO, logger="phdf")
+    schema = utils.Precision.from_spec(spec)
+    dpx = models.DevicePixelArray(input_file, tmp_path, precision=schema)
+    dpx.run()
+    assert dpx.stack.values.dtype == (
+        np.float64 if "float64" in schema.precisions else np.float32
+    )
+    outpath = dpx.save_to_hdf(layout=layout)
+
+    with views.PixelMapReader(outpath) as reader:
+        assert sorted(reader.names) == sorted(t.name for t in dpx.tables)
+        losses = reader.precision_loss()
+        for table in dpx.tables:
+            df = reader.read(table.name)
+            loss = losses.loc[table.name]
+            assert loss["precision"] == schema.get(table.name)
+            pd.testing.assert_frame_equal(df.isna(), table.df.isna())
+            error = np.nanmax(np.abs(df.to_numpy(np.float64) - table.df.to_numpy()))
+            assert error == pytest.approx(loss["max_abs_error"], abs=1e-12)
+            if loss["precision"] in precision.QUANTIZED:
+                assert error <= loss["scale"] / 2 * (1 + 1e-6)
+            elif loss["precision"] == "float64":
+                assert error == 0
+    for name in schema.precisions:
+        assert f"precision {name}: " in caplog.text
@@ -0,0 +1,65 @@
+from pathlib import Path
+import os
+import subprocess
+import sys
+
+import pandas as pd
+import pytest
+
+from phdf import models, parsers, segments
+
+BASE_DIR = Path(__file__).parent.parent.resolve()
+
+
+def make_arrays() -> tuple[models.DevicePixelArray, tuple]:
+    input_file = next((BASE_DIR / "resources").glob("*testfilewriter*.txt"))
+    dpx = models.DevicePixelArray(input_file)
+    dpx.run()
+    return dpx, segments.arrays_from_records(parsers.scan_file(input_file))
+
+
+def assert_same_tables(expected: list[models.Table], tables: list[models.Table]):
+    assert [t.name for t in tables] == [t.name for t in expected]
+    for table, other in zip(tables, expected):
+        pd.testing.assert_frame_equal(table.df, other.df)
+
+
+def test_segment_file_matches_text_input(tmp_path):
+    dpx, arrays = make_arrays()
+    filepath = segments.write_segment_file(tmp_path / "lot.phsm", *arrays)
+
+    segment_dpx = models.DevicePixelArray(
+        segments.SegmentSource(str(filepath)), output_folder=tmp_path
+    )
+    segment_dpx.run()
+
+    assert segment_dpx.outname == "lot-cp3.h5"
+    assert_same_tables(dpx.tables, segment_dpx.tables)
+
+
+def test_shared_memory_segment_through_cli(tmp_path):
+    dpx, arrays = make_arrays()
+    name = f"phdf-test-{os.getpid()}"
+    shm = segments.create_shared_segment(name, *arrays)
+    try:
+        p0 = subprocess.run(
+            [sys.executable, str(BASE_DIR / "cli.py"), f"shm://{name}", str(tmp_path)],
+            capture_output=True,
+        )
+    finally:
+        shm.close()
+        shm.unlink()
+
+    assert p0.returncode == 0, p0.stderr.decode()
+    with pd.HDFStore(tmp_path / f"{name}-cp3.h5", mode="r") as store:
+        tables = [
+            models.Table(k.lstrip("/"), store.get(k))
+            for k in store.keys()
+            if not k.startswith("/_phdf/")
+        ]
+    assert_same_tables(sorted(dpx.tables), sorted(tables))
+
+
+def test_read_segment_rejects_other_data():
+    with pytest.raises(ValueError):
+        segments.read_segment(b"PHDB\x01" + bytes(64))
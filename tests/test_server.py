@@ -0,0 +1,68 @@
+import io
+import logging
+import socket
+import stat
+import threading
+import types
+
+import pytest
+
+from phdf import server, views
+
+server_unavailable = not hasattr(server.socket, "AF_UNIX")
+
+
+@pytest.mark.skipif(server_unavailable, reason="needs Unix domain sockets")
+def test_server_converts_in_process(tmp_path, caplog, monkeypatch):
+    caplog.set_level(logging.INFO, logger="phdf")
+    socket_path = tmp_path / "phdf.sock"
+    phdf_server = server.PhdfServer(socket_path)
+    thread = threading.Thread(target=phdf_server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        assert stat.S_IMODE(socket_path.stat().st_mode) == 0o600
+        with pytest.raises(FileExistsError, match="already listening"):
+            server.PhdfServer(socket_path)
+        assert server.request(socket_path, {"command": "ping"})["exit_code"] == 0
+        response = server.request(
+            socket_path,
+            {
+                "data_input": '{"partId": {"R00C00": { "site1":{"aTB_0": "0.0"}}}}',
+                "output_dir": str(tmp_path),
+            },
+        )
+        assert response["exit_code"] == 0
+        assert any("appended(" in message for _, message in response["log"])
+        assert len(list(tmp_path.glob("*.h5"))) == 1
+
+        # binary stdin goes through the client as bytes
+        phdb = views.generate_testfilewriter_file(
+            tmp_path / "lot.phdb", n_rows=2, n_cols=2, fmt="binary"
+        )
+        stdin = types.SimpleNamespace(buffer=io.BytesIO(phdb.read_bytes()))
+        monkeypatch.setattr(server.sys, "stdin", stdin)
+        out_dir = tmp_path / "stdin"
+        assert server.client(socket_path, "-", str(out_dir)) == 0
+        assert "running locally" not in caplog.text
+        assert len(list(out_dir.glob("*.h5"))) == 1
+        server.request(socket_path, {"command": "shutdown"})
+        thread.join(timeout=5)
+        assert not thread.is_alive()
+    finally:
+        phdf_server.server_close()
+    assert not socket_path.exists()
+
+
+@pytest.mark.skipif(server_unavailable, reason="needs Unix domain sockets")
+def test_server_only_replaces_stale_sockets(tmp_path, caplog):
+    not_a_socket = tmp_path / "data.txt"
+    not_a_socket.write_text("keep me")
+    assert server.serve(not_a_socket) == 1
+    assert not_a_socket.read_text() == "keep me"
+    assert "is not a socket" in caplog.text
+
+    stale = tmp_path / "stale.sock"
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.bind(str(stale))  # bound, never listening: connect() is refused
+    with server.PhdfServer(stale) as phdf_server:
+        assert phdf_server.socket_path == stale
@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from phdf import models, sparse, utils, views
+
+
+@pytest.fixture(scope="module")
+def input_file(tmp_path_factory):
+    return views.generate_testfilewriter_file(
+        tmp_path_factory.mktemp("sparse") / "lot.txt",
+        n_channels=3,
+        n_rows=12,
+        n_cols=10,
+        missing=0.7,
+        seed=3,
+    )
+
+
+def test_coo_round_trip():
+    df = pd.DataFrame(
+        [[1.5, np.nan, np.nan], [np.nan, np.nan, np.nan], [np.nan, -2.0, np.nan]],
+        index=pd.Index([3, 5, 9], name="row"),
+        columns=pd.Index([0, 2, 4], name="col"),
+        dtype=np.float32,
+    )
+    assert sparse.density(df) == pytest.approx(2 / 9)
+    coo, attrs = sparse.to_coo(df)
+    assert coo.index.tolist() == [0, 7] and coo.tolist() == [1.5, -2.0]
+    dense = sparse.to_dense(coo, attrs[sparse.ROWS_ATTR], attrs[sparse.COLS_ATTR])
+    pd.testing.assert_frame_equal(dense, df)
+    assert sparse.to_coordinates(df).values.tolist() == [[3, 0, 1.5], [9, 2, -2.0]]
+
+
+def test_record_sized_pivot_matches_dense_pivot(monkeypatch):
+    rng = np.random.default_rng(0)
+    n = 200
+    args = (
+        rng.integers(0, 3, n),
+        ["a", "b", "c"],
+        rng.integers(0, 50, n),
+        rng.integers(0, 40, n),
+        np.where(rng.random(n) < 0.1, np.nan, rng.normal(size=n)),
+    )
+    sparse_stack = models.scatter_stack(*args)  # 200 records in 6000 cells
+    monkeypatch.setattr(models, "SPARSE_PIVOT_RATIO", 0)
+    dense_stack = models.scatter_stack(*args)
+    np.testing.assert_allclose(sparse_stack.values, dense_stack.values, rtol=1e-6)
+    assert sparse_stack.values.dtype == np.float32
+
+
+@pytest.mark.parametrize("spec", [None, "float32,aTB_0=int16q"])
+def test_sparse_tables_read_back_dense(tmp_path, input_file, spec):
+    schema = utils.Precision.from_spec(spec) if spec else None
+    dpx = models.DevicePixelArray(
+        input_file, tmp_path, precision=schema, sparse_density=0.5
+    )
+    dpx.run()
+    full = dpx.tables[0].df.fillna(0.0)
+    dpx.tables.append(models.Table("site9_partId9_aTB_0", full))
+    outpath = dpx.save_to_hdf()
+    densities = {t.name: sparse.density(t.df) for t in dpx.tables}
+    assert dpx.metrics.stages["write"]["sparse"] == len(dpx.tables) - 1
+
+    with views.PixelMapReader(outpath) as reader:
+        for table in dpx.tables:
+            assert reader.is_sparse(table.name) == (densities[table.name] < 0.5)
+            assert reader.shape(table.name) == table.df.shape
+            df = reader[table.name]
+            if schema is None or schema.get(table.name) == "float32":
+                pd.testing.assert_frame_equal(df, table.df)
+            else:
+                scale = reader.precision_loss().loc[table.name, "scale"]
+                np.testing.assert_allclose(df, table.df, atol=scale / 2 * (1 + 1e-6))
+            assert len(reader.coordinates(table.name)) == table.df.notna().sum().sum()
+
+    dpx.save_to_hdf(incremental=True)  # merges read the coordinate lists back
+    with views.PixelMapReader(outpath) as reader:
+        assert sorted(reader.names) == sorted(densities)
@@ -0,0 +1,80 @@
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from phdf import models, utils, views
+
+BASE_DIR = Path(__file__).parent.parent.resolve()
+
+
+@pytest.fixture(scope="module")
+def dpx() -> models.DevicePixelArray:
+    input_file = next((BASE_DIR / "resources").glob("*testfilewriter*.txt"))
+    dpx = models.DevicePixelArray(input_file)
+    dpx.run()
+    return dpx
+
+
+@pytest.mark.parametrize("layout", ["tables", "stacked"])
+def test_reader_loads_tables_lazily(tmp_path, dpx, layout):
+    dpx.outpath = tmp_path / dpx.outname
+    outpath = dpx.save_to_hdf(layout=layout)
+    expected = {t.name: t.df for t in dpx.tables}
+
+    with views.PixelMapReader(outpath) as reader:
+        assert sorted(reader.names) == sorted(expected)
+        assert reader.misses == 0
+        name = dpx.tables[0].name
+        site, part, channel = name.split("_", 2)
+        selected = reader.select(site=site, channel=channel)
+        assert name in selected
+        assert all(x.startswith(f"{site}_") for x in selected)
+        assert reader.select(pattern=name) == [name]
+
+        for name, df in reader.iter_tables(selected):
+            pd.testing.assert_frame_equal(df, expected[name])
+        assert reader[name] is reader.get(name)
+        assert (reader.hits, reader.misses) == (2, len(selected))
+
+
+def test_reader_cache_stays_within_budget(tmp_path, dpx):
+    dpx.outpath = tmp_path / dpx.outname
+    outpath = dpx.save_to_hdf()
+    with views.PixelMapReader(outpath) as reader:
+        first, second, third = reader.names[:3]
+        nbytes = reader.get(first).memory_usage(index=True).sum()
+        reader.cache_budget = int(nbytes * 2.5)
+        reader.get(second)
+        reader.get(third)
+        assert list(reader.cache) == [second, third]
+        assert reader.cache_bytes <= reader.cache_budget
+        assert reader.shape(first) == reader.get(first).shape
+
+
+@pytest.mark.parametrize("layout", ["tables", "stacked"])
+def test_summary_index_matches_tables(tmp_path, layout):
+    input_file = views.generate_testfilewriter_file(
+        tmp_path / "lot.txt", n_rows=6, n_cols=5, missing=0.2, seed=1
+    )
+    dpx = models.DevicePixelArray(input_file, output_folder=tmp_path)
+    dpx.run()
+    outpath = dpx.save_to_hdf(layout=layout)
+
+    with views.PixelMapReader(outpath) as reader:
+        summary = reader.summary()
+        assert reader.misses == 0
+        assert len(reader.summary(where="site == 'site2' & count > 0")) == 10
+        # queryable without PyTables column indexes, which would dominate the size
+        assert not reader.store.get_storer(utils.SUMMARY_KEY).table.colindexes
+    assert list(summary.index) == [t.name for t in dpx.tables]
+    for table in dpx.tables:
+        values = table.df.stack(dropna=False)
+        row = summary.loc[table.name]
+        assert (row["rows"], row["cols"]) == table.df.shape
+        assert row["count"] == values.count()
+        assert row["nan_count"] == values.isna().sum()
+        assert row["min"] == values.min() and row["max"] == values.max()
+        assert row["mean"] == pytest.approx(values.mean(), abs=1e-5)
+        assert row["std"] == pytest.approx(values.std(), rel=1e-4)
+        assert table.name == "_".join(row[["site", "serialnumber", "ch"]])
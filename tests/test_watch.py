@@ -0,0 +1,68 @@
+from pathlib import Path
+import shutil
+import threading
+import time
+
+import pandas as pd
+
+from phdf import watch
+
+BASE_DIR = Path(__file__).parent.parent.resolve()
+
+
+def test_watcher_converts_each_completed_file_once(tmp_path):
+    input_dir = tmp_path / "inputs"
+    output_dir = tmp_path / "outputs"
+    input_dir.mkdir()
+    input_file = next((BASE_DIR / "resources").glob("*testfilewriter*.txt"))
+    shutil.copy(input_file, input_dir / "testfilewriter-1.txt")
+
+    def produce():
+        time.sleep(0.5)
+        with open(input_dir / "testfilewriter-2.txt", "w") as f:
+            for i in range(4):  # written over ~0.6s, must not be picked up early
+                f.write(
+                    f'{{"partId1": {{"R00C0{i}": {{"site1": {{"aTB_0": "1"}}}}}}}},'
+                )
+                f.flush()
+                time.sleep(0.2)
+
+    producer = threading.Thread(target=produce)
+    producer.start()
+    watcher = watch.DirectoryWatcher(
+        input_dir, str(output_dir), jobs=2, poll_interval=0.05, settle_time=0.3
+    )
+    exit_code = watcher.run(idle_timeout=1.0)
+    producer.join()
+
+    assert exit_code == 0
+    assert watcher.n_ok == 2
+    assert sorted(f.name for f in output_dir.iterdir()) == [
+        "testfilewriter-1-cp3.h5",
+        "testfilewriter-2-cp3.h5",
+    ]
+    with pd.HDFStore(output_dir / "testfilewriter-2-cp3.h5", mode="r") as store:
+        assert store.get("site1_partId1_aTB_0").shape == (1, 4)
+
+    rerun = watch.DirectoryWatcher(input_dir, str(output_dir), poll_interval=0.05)
+    assert rerun.run(idle_timeout=0.2) == 0
+    assert rerun.n_ok == 0  # outputs exist, nothing converted twice
+
+
+def test_empty_file_does_not_keep_the_watcher_busy(tmp_path):
+    (tmp_path / "testfilewriter-1.txt").touch()
+    watcher = watch.DirectoryWatcher(
+        tmp_path, str(tmp_path / "outputs"), poll_interval=0.05, settle_time=0.2
+    )
+    start = time.monotonic()
+    assert watcher.run(idle_timeout=0.3) == 0
+    assert time.monotonic() - start < 5
+    assert watcher.n_ok == 0 and tmp_path / "testfilewriter-1.txt" in watcher.pending
+
+
+def test_watcher_takes_every_input_suffix(tmp_path):
+    for name in ("a.txt", "b.CSV", "c.phdb", "d.h5", "e.log"):
+        (tmp_path / name).write_text("x")
+    watcher = watch.DirectoryWatcher(tmp_path, str(tmp_path), settle_time=0.0)
+    assert watcher.poll() == []  # first seen
+    assert [fp.name for fp in watcher.poll()] == ["a.txt", "b.CSV", "c.phdb"]
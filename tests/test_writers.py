@@ -0,0 +1,160 @@
+import pandas as pd
+import pytest
+
+from phdf import writers
+
+
+def test_hdf_writer_appends_through_one_session(tmp_path):
+    outpath = tmp_path / "out" / "sample-cp3.h5"
+    df = pd.DataFrame({0: [1.0, 2.0]})
+    with writers.HdfWriter(outpath) as writer:
+        writer.write("site1_partId1_aTB_0", df)
+        assert not outpath.exists()  # only visible once committed
+    with writers.HdfWriter(outpath) as writer:
+        writer.write("site1_partId1_aTB_1", df)
+    with pd.HDFStore(outpath, mode="r") as store:
+        assert sorted(store.keys()) == [
+            "/site1_partId1_aTB_0",
+            "/site1_partId1_aTB_1",
+        ]
+    assert [f.name for f in outpath.parent.iterdir()] == [outpath.name]
+
+
+def test_hdf_writer_discards_failed_session(tmp_path):
+    outpath = tmp_path / "sample-cp3.h5"
+    with pytest.raises(RuntimeError):
+        with writers.HdfWriter(outpath) as writer:
+            writer.write("site1_partId1_aTB_0", pd.DataFrame({0: [1.0]}))
+            raise RuntimeError("interrupted")
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_stacked_layout_round_trip(tmp_path):
+    from phdf import models, views
+
+    input_str = (
+        '{"partId1": {"R00C00": { "site1":{"aTB_0": "0.5"}}}},'
+        '{"partId1": {"R01C02": { "site1":{"aTB_0": "1.5"}}}},'
+        '{"partId1": {"R03C01": { "site2":{"aTB_0": "2.5"}}}}'
+    )
+    dpx = models.DevicePixelArray(inp=input_str, output_folder=tmp_path)
+    dpx.run()
+    outpath = dpx.save_to_hdf(layout="stacked")
+    dfs = views.read_stacked_hdf5_file(outpath)
+    assert list(dfs) == [t.name for t in dpx.tables]
+    for table in dpx.tables:
+        pd.testing.assert_frame_equal(dfs[table.name], table.df)
+
+
+@pytest.mark.parametrize("shuffle", [True, False])
+@pytest.mark.parametrize("layout", ["tables", "stacked"])
+def test_hdf_writer_applies_compression(tmp_path, layout, shuffle):
+    import tables
+
+    from phdf import models, utils
+
+    compression = utils.Compression("blosc:lz4", 5, shuffle=shuffle)
+    dpx = models.DevicePixelArray(
+        inp='{"partId1": {"R00C00": { "site1":{"aTB_0": "0.5"}}}}',
+        output_folder=tmp_path,
+        compression=compression,
+    )
+    dpx.run()
+    outpath = dpx.save_to_hdf(layout=layout)
+    assert outpath.name.endswith("-blosc-lz4-cp5.h5")
+    with tables.open_file(outpath, mode="r") as h5:
+        filters = {
+            (x.filters.complib, x.filters.complevel, x.filters.shuffle)
+            for x in h5.walk_nodes("/", "CArray")
+        }
+    assert filters == {("blosc:lz4", 5, shuffle)}
+
+
+def save_incremental(input_str: str, outpath, spec=None) -> dict[str, int]:
+    from phdf import models, utils
+
+    dpx = models.DevicePixelArray(
+        inp=input_str,
+        output_folder=outpath.parent,
+        precision=utils.Precision.from_spec(spec) if spec else None,
+    )
+    dpx.outpath = outpath
+    dpx.run()
+    dpx.save_to_hdf(incremental=True)
+    stage = dpx.metrics.stages["write"]
+    return {k: stage[k] for k in ("added", "merged", "unchanged", "skipped")}
+
+
+def test_incremental_merge_rewrites_only_changed_tables(tmp_path):
+    from phdf import views
+
+    outpath = tmp_path / "lot-cp3.h5"
+    record = '{{"partId1": {{"{}": {{ "site1":{{"aTB_{}": "{}"}}}}}}}}'.format
+    first = ",".join(
+        [
+            record("R00C00", 0, 0.5),
+            record("R01C01", 0, 1.5),
+            record("R00C00", 1, 1.0),
+            record("R01C01", 1, 2.0),
+        ]
+    )
+    retest = ",".join([record("R01C01", 0, 9.5), record("R01C01", 1, 2.0)])
+    assert save_incremental(first, outpath) == dict(
+        added=2, merged=0, unchanged=0, skipped=0
+    )
+    assert save_incremental(retest, outpath) == dict(
+        added=0, merged=1, unchanged=1, skipped=0
+    )
+    assert save_incremental(retest, outpath) == dict(
+        added=0, merged=0, unchanged=0, skipped=2
+    )
+
+    with views.PixelMapReader(outpath) as reader:
+        df = reader["site1_partId1_aTB_0"]
+        assert df.fillna(-1).to_numpy().tolist() == [[0.5, -1], [-1, 9.5]]
+        assert reader.summary().loc["site1_partId1_aTB_0", "max"] == 9.5
+    with pd.HDFStore(outpath, mode="r") as store:
+        manifest = store.get("/_phdf/manifest")
+    assert sorted(manifest.index) == ["site1_partId1_aTB_0", "site1_partId1_aTB_1"]
+
+
+@pytest.mark.parametrize("spec", ["int16q", "int32q", "float16"])
+def test_incremental_merge_compares_stored_precision(tmp_path, spec):
+    outpath = tmp_path / "lot-cp3.h5"
+    record = '{{"partId1": {{"{}": {{ "site1":{{"aTB_0": "{}"}}}}}}}}'.format
+    first = ",".join(
+        [record("R00C00", 0.3), record("R01C01", 1.7), record("R02C00", 2.9)]
+    )
+    assert save_incremental(first, outpath, spec)["added"] == 1
+    retest = record("R01C01", 1.7)  # not stored exactly, but unchanged
+    assert save_incremental(retest, outpath, spec)["unchanged"] == 1
+    assert save_incremental(record("R01C01", 2.3), outpath, spec)["merged"] == 1
+    assert save_incremental(record("R01C01", 9.0), outpath, spec)["merged"] == 1
+
+
+def test_incremental_write_resumes_after_interruption(tmp_path, monkeypatch):
+    from phdf import views
+
+    outpath = tmp_path / "lot-cp3.h5"
+    input_str = ",".join(
+        f'{{"partId1": {{"R00C00": {{ "site1":{{"aTB_{i}": "{i}.5"}}}}}}}}'
+        for i in range(4)
+    )
+    write = writers.HdfWriter.write
+
+    def write_then_crash(self, key, df):
+        if self.n_written == 2:
+            raise RuntimeError("interrupted")
+        write(self, key, df)
+
+    monkeypatch.setattr(writers.HdfWriter, "write", write_then_crash)
+    with pytest.raises(RuntimeError):
+        save_incremental(input_str, outpath)
+    monkeypatch.undo()
+
+    assert save_incremental(input_str, outpath) == dict(
+        added=2, merged=0, unchanged=0, skipped=2
+    )
+    with views.PixelMapReader(outpath) as reader:
+        assert len(reader) == 4
+        assert len(reader.summary()) == 4